@@ -1,6 +1,17 @@
 from django.contrib import admin
 
-from .models import GeneratedAudio, ChatHistory, Avatar, Mood, User
+from .models import (
+    AudioVariant,
+    GeneratedAudio,
+    ChatHistory,
+    Avatar,
+    AvatarUpload,
+    Conversation,
+    Mood,
+    SynthesisJob,
+    User,
+)
+from .pagination import EstimatedCountPaginator
 
 # Register your models here.
 
@@ -39,6 +50,13 @@ class GeneratedAudioAdmin(admin.ModelAdmin):
         "status",
         "user"
     ]
+    list_select_related = ["user"]
+    list_filter = ["status", "sender_type", "created_at"]
+    search_fields = ["=conversation_id"]
+    search_help_text = "Exact conversation id."
+    raw_id_fields = ["user", "dialogue"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def short_text(self, obj):
         return (obj.text[:30] + "...") if len(obj.text) > 30 else obj.text
@@ -46,6 +64,49 @@ class GeneratedAudioAdmin(admin.ModelAdmin):
     short_text.short_description = "Text Preview"
 
 
+@admin.register(AudioVariant)
+class AudioVariantAdmin(admin.ModelAdmin):
+    ordering = ["-id"]
+    list_display = [
+        "id",
+        "uid",
+        "audio",
+        "name",
+        "content_type",
+        "bitrate",
+        "size_bytes",
+        "created_at",
+    ]
+    list_select_related = ["audio"]
+    list_filter = ["name"]
+    raw_id_fields = ["audio"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    ordering = ["-id"]
+    list_display = [
+        "id",
+        "uid",
+        "conversation_id",
+        "turn_count",
+        "total_duration",
+        "last_activity_at",
+        "created_at",
+        "status",
+        "user",
+    ]
+    list_select_related = ["user"]
+    list_filter = ["status"]
+    search_fields = ["=conversation_id"]
+    search_help_text = "Exact conversation id."
+    raw_id_fields = ["user"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
 @admin.register(ChatHistory)
 class ChatHistoryAdmin(admin.ModelAdmin):
     ordering = ["id"]
@@ -60,9 +121,17 @@ class ChatHistoryAdmin(admin.ModelAdmin):
         "status",
         "user",
     ]
+    list_select_related = ["user"]
+    list_filter = ["status", "created_at"]
+    search_fields = ["=conversation_id", "=title"]
+    search_help_text = "Exact conversation id or title."
+    raw_id_fields = ["user"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def short_chat(self, obj):
-        return (obj.chat[:30] + "...") if len(obj.chat) > 30 else obj.chat
+        text = obj.chat[0]["text"] if obj.chat else ""
+        return (text[:30] + "...") if len(text) > 30 else text
 
     short_chat.short_description = "Chat Preview"
 
@@ -85,6 +154,26 @@ class AvatarAdmin(admin.ModelAdmin):
     ]
 
 
+@admin.register(AvatarUpload)
+class AvatarUploadAdmin(admin.ModelAdmin):
+    ordering = ["-id"]
+    list_display = [
+        "id",
+        "uid",
+        "filename",
+        "size",
+        "offset",
+        "state",
+        "avatar",
+        "created_at",
+        "updated_at",
+        "user",
+    ]
+    list_select_related = ["avatar", "user"]
+    list_filter = ["state"]
+    raw_id_fields = ["avatar", "user"]
+
+
 @admin.register(Mood)
 class MoodAdmin(admin.ModelAdmin):
     ordering = ["id"]
@@ -98,3 +187,23 @@ class MoodAdmin(admin.ModelAdmin):
         "status",
         "user"
     ]
+
+
+@admin.register(SynthesisJob)
+class SynthesisJobAdmin(admin.ModelAdmin):
+    ordering = ["-id"]
+    list_display = [
+        "id",
+        "uid",
+        "kind",
+        "state",
+        "attempts",
+        "max_attempts",
+        "run_after",
+        "locked_by",
+        "locked_until",
+        "created_at",
+        "updated_at",
+        "user",
+    ]
+
@@ -4,6 +4,6 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
-    
-    # def ready(self):
-    #     from . import signals
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
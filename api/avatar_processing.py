@@ -0,0 +1,95 @@
+import os
+import posixpath
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .lookups import bump_version
+from .models import Avatar
+from .storage import publish_file
+from .transcoding import run_ffmpeg
+
+# Every stored file of an avatar, original first.
+AVATAR_FILE_FIELDS = ["video", "poster", "faststart_video"]
+
+
+class FFmpegAvatarProcessor:
+    def poster(self, source, target):
+        # The thumbnail filter picks a representative frame from the first few
+        # seconds instead of a (often black) first frame.
+        run_ffmpeg("-i", source, "-vf", "thumbnail", "-frames:v", "1", "-q:v", "3", target)
+
+    def faststart(self, source, target):
+        # Remux only: moving the moov atom to the front lets players start before
+        # the download finishes, and the streams are copied untouched.
+        run_ffmpeg("-i", source, "-map", "0", "-c", "copy", "-movflags", "+faststart", target)
+
+
+class StubAvatarProcessor:
+    """Pure-Python stand-in for tests and machines without ffmpeg."""
+
+    POSTER = b"\xff\xd8\xff\xd9"  # an empty JPEG
+
+    def poster(self, source, target):
+        with open(target, "wb") as f:
+            f.write(self.POSTER)
+
+    def faststart(self, source, target):
+        shutil.copyfile(source, target)
+
+
+def get_avatar_processor():
+    return import_string(settings.AVATAR_PROCESSOR)()
+
+
+def process_avatar(avatar, processor=None):
+    """
+    Build the poster and fast-start rendition of ``avatar.video`` and store them
+    next to it. Returns the stored names, or an empty dict when the video was
+    replaced while this ran (the replacement has its own job).
+    """
+    source_name = avatar.video.name
+    if not source_name:
+        return {}
+
+    processor = processor or get_avatar_processor()
+    directory, filename = posixpath.split(source_name)
+    stem = os.path.splitext(filename)[0]
+
+    os.makedirs(settings.MEDIA_SCRATCH_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=settings.MEDIA_SCRATCH_DIR) as workdir:
+        source = os.path.join(workdir, filename)
+        with avatar.video.open("rb") as src, open(source, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+
+        poster_path = os.path.join(workdir, "poster.jpg")
+        processor.poster(source, poster_path)
+        faststart_path = os.path.join(workdir, "faststart.mp4")
+        processor.faststart(source, faststart_path)
+
+        derivatives = {
+            "poster": publish_file(
+                poster_path,
+                default_storage.get_available_name(f"{directory}/{stem}.poster.jpg"),
+            ),
+            "faststart_video": publish_file(
+                faststart_path,
+                default_storage.get_available_name(f"{directory}/{stem}.faststart.mp4"),
+            ),
+        }
+
+    updated = Avatar.objects.filter(pk=avatar.pk, video=source_name).update(
+        **derivatives, updated_at=timezone.now()
+    )
+    if not updated:
+        for name in derivatives.values():
+            default_storage.delete(name)
+        return {}
+
+    # update() skips the post_save signal that invalidates cached avatar lists.
+    bump_version("avatar")
+    return derivatives
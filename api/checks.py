@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Backends whose entries live in one process: every worker would grant the
+# whole budget again.
+LOCAL_CACHE_BACKENDS = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+@register(Tags.caches)
+def check_throttle_cache_alias(app_configs, **kwargs):
+    if settings.THROTTLE_CACHE in settings.CACHES:
+        return []
+    return [
+        Error(
+            f"THROTTLE_CACHE refers to an unknown cache alias "
+            f"{settings.THROTTLE_CACHE!r}.",
+            hint="Set THROTTLE_CACHE to one of the aliases in CACHES.",
+            id="api.E002",
+        )
+    ]
+
+
+@register(Tags.caches, deploy=True)
+def check_throttle_cache_shared(app_configs, **kwargs):
+    """Run by ``check --deploy``: development and tests use a local cache on purpose."""
+    backend = settings.CACHES.get(settings.THROTTLE_CACHE, {}).get("BACKEND")
+    if backend not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [
+        Error(
+            f"THROTTLE_CACHE {settings.THROTTLE_CACHE!r} uses {backend}, which is "
+            "not shared between worker processes, so throttle budgets would not hold.",
+            hint=(
+                "Set REDIS_URL or point THROTTLE_CACHE at a shared cache. A "
+                "single-process deployment may add api.E001 to "
+                "SILENCED_SYSTEM_CHECKS."
+            ),
+            id="api.E001",
+        )
+    ]
@@ -11,3 +11,20 @@ class SenderTypeChoices(TextChoices):
     USER = "USER", "User"
     AI = "AI", "AI"
 
+
+class JobStateChoices(TextChoices):
+    PENDING = "PENDING", "Pending"
+    RUNNING = "RUNNING", "Running"
+    SUCCEEDED = "SUCCEEDED", "Succeeded"
+    FAILED = "FAILED", "Failed"
+
+
+class JobKindChoices(TextChoices):
+    SPEAK = "SPEAK", "Speak"
+    TRANSCODE = "TRANSCODE", "Transcode"
+    PROCESS_AVATAR = "PROCESS_AVATAR", "Process avatar"
+
+
+class UploadStateChoices(TextChoices):
+    UPLOADING = "UPLOADING", "Uploading"
+    COMPLETE = "COMPLETE", "Complete"
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+
+from django.conf import settings
+
+
+class CircuitBreaker:
+    """
+    Per-process circuit breaker for one upstream provider.
+
+    Failures and calls slower than ``latency_threshold`` both count towards
+    ``failure_threshold`` consecutive bad calls, after which the breaker opens
+    and callers go straight to their fallback. After ``reset_timeout`` seconds
+    a single probe call is let through (half-open); its outcome closes or
+    re-opens the breaker.
+    """
+
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+    def __init__(self, name, failure_threshold, latency_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.trips = 0
+        self.last_trip_reason = ""
+        self.calls = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.short_circuited = 0
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (
+                self.state == self.OPEN
+                and time.monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self, latency):
+        if latency > self.latency_threshold:
+            with self._lock:
+                self.slow_calls += 1
+            self.record_failure(
+                f"latency {latency:.2f}s over {self.latency_threshold}s"
+            )
+            return
+
+        with self._lock:
+            self.calls += 1
+            self.consecutive_failures = 0
+            if self.state != self.CLOSED:
+                self.state = self.CLOSED
+                self.opened_at = None
+                self.probe_in_flight = False
+
+    def record_failure(self, reason):
+        with self._lock:
+            self.calls += 1
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED
+                and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.probe_in_flight = False
+                self.trips += 1
+                self.last_trip_reason = str(reason)
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = max(
+                    round(self.reset_timeout - (time.monotonic() - self.opened_at), 2),
+                    0,
+                )
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "latency_threshold": self.latency_threshold,
+                "trips": self.trips,
+                "last_trip_reason": self.last_trip_reason,
+                "retry_in": retry_in,
+                "calls": self.calls,
+                "failures": self.failures,
+                "slow_calls": self.slow_calls,
+                "short_circuited": self.short_circuited,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=settings.TTS_BREAKER_FAILURE_THRESHOLD,
+                latency_threshold=settings.TTS_BREAKER_LATENCY_THRESHOLD,
+                reset_timeout=settings.TTS_BREAKER_RESET_TIMEOUT,
+            )
+        return _breakers[name]
+
+
+def breaker_snapshots():
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {
+        "pid": os.getpid(),
+        "breakers": {name: breaker.snapshot() for name, breaker in breakers.items()},
+    }
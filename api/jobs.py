@@ -0,0 +1,110 @@
+import os
+import socket
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+from rest_framework import serializers
+
+from .avatar_processing import process_avatar
+from .choices import JobKindChoices, JobStateChoices, StatusChoices
+from .models import Avatar, GeneratedAudio, SynthesisJob
+from .services import run_speak
+from .transcoding import transcode_variants
+
+
+def run_speak_job(job):
+    # A retry or reclaim of a job whose turns were saved must not speak again;
+    # run_speak records the result together with the turns.
+    if job.result:
+        return job.result
+    payload, _generated = run_speak(job.user, job.payload, job=job)
+    return payload
+
+
+def run_transcode_job(job):
+    # Rows removed before the job ran are skipped; done variants are not redone.
+    audios = GeneratedAudio.objects.IS_ACTIVE().filter(pk__in=job.payload["audio_ids"])
+    return {
+        "variants": {
+            str(gen_audio.uid): [variant.name for variant in transcode_variants(gen_audio)]
+            for gen_audio in audios
+        }
+    }
+
+
+def run_process_avatar_job(job):
+    avatar = Avatar.objects.exclude(status=StatusChoices.REMOVED).get(
+        pk=job.payload["avatar_id"]
+    )
+    return process_avatar(avatar)
+
+
+JOB_HANDLERS = {
+    JobKindChoices.SPEAK: run_speak_job,
+    JobKindChoices.TRANSCODE: run_transcode_job,
+    JobKindChoices.PROCESS_AVATAR: run_process_avatar_job,
+}
+
+# Retrying cannot fix bad input or a missing avatar/mood.
+PERMANENT_ERRORS = (serializers.ValidationError, ObjectDoesNotExist)
+
+
+def enqueue_job(kind, payload, user=None):
+    return SynthesisJob.objects.create(
+        kind=kind,
+        payload=payload,
+        user=user,
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+    )
+
+
+def worker_id(index):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def process_job(job):
+    # Only the worker still holding the lease may record the outcome; a job
+    # reclaimed after its visibility timeout belongs to the new holder.
+    leased = SynthesisJob.objects.filter(
+        pk=job.pk,
+        state=JobStateChoices.RUNNING,
+        locked_by=job.locked_by,
+        attempts=job.attempts,
+    )
+    try:
+        result = JOB_HANDLERS[job.kind](job)
+    except PERMANENT_ERRORS as e:
+        return leased.update(
+            state=JobStateChoices.FAILED,
+            error=str(e),
+            locked_until=None,
+            updated_at=timezone.now(),
+        )
+    except Exception as e:
+        now = timezone.now()
+        if job.attempts >= job.max_attempts:
+            return leased.update(
+                state=JobStateChoices.FAILED,
+                error=str(e),
+                locked_until=None,
+                updated_at=now,
+            )
+        backoff = settings.JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        return leased.update(
+            state=JobStateChoices.PENDING,
+            error=str(e),
+            run_after=now + timedelta(seconds=backoff),
+            locked_until=None,
+            updated_at=now,
+        )
+
+    return leased.update(
+        state=JobStateChoices.SUCCEEDED,
+        result=result,
+        error="",
+        locked_until=None,
+        updated_at=timezone.now(),
+    )
@@ -0,0 +1,98 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .choices import StatusChoices
+from .models import Avatar, Mood
+
+# Read-through cache for avatar voice and mood lookups. Every key embeds a
+# per-namespace version number; saving or deleting an Avatar/Mood bumps the
+# version (see signals.py), which orphans all older entries at once.
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def record(namespace, hit):
+    with _stats_lock:
+        counters = _stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        counters["hits" if hit else "misses"] += 1
+
+
+def lookup_cache_stats():
+    with _stats_lock:
+        stats = {namespace: dict(counters) for namespace, counters in _stats.items()}
+    for counters in stats.values():
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = round(counters["hits"] / lookups, 4) if lookups else 0.0
+    return stats
+
+
+def version_key(namespace):
+    return f"lookup:{namespace}:version"
+
+
+def namespace_version(namespace):
+    version = cache.get(version_key(namespace))
+    if version is None:
+        # Seeded from the clock so an evicted counter never comes back at a
+        # value that older entries were written under.
+        cache.add(version_key(namespace), time.time_ns(), timeout=None)
+        version = cache.get(version_key(namespace), time.time_ns())
+    return version
+
+
+def bump_version(namespace):
+    try:
+        cache.incr(version_key(namespace))
+    except ValueError:
+        cache.set(version_key(namespace), time.time_ns(), timeout=None)
+
+
+def make_key(namespace, *parts):
+    digest = hashlib.sha1("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+    return f"lookup:{namespace}:{namespace_version(namespace)}:{digest}"
+
+
+def cached(namespace, key, build):
+    value = cache.get(key)
+    if value is not None:
+        record(namespace, hit=True)
+        return value
+
+    record(namespace, hit=False)
+    value = build()
+    cache.set(key, value, settings.LOOKUP_CACHE_TIMEOUT)
+    return value
+
+
+def get_voice_id(voice_name, side):
+    return cached(
+        "avatar",
+        make_key("avatar", side, voice_name),
+        lambda: Avatar.objects.filter(voice_name=voice_name, side=side)
+        .latest("created_at")
+        .elevenlabs_voice_id,
+    )
+
+
+def get_mood_prompt(mood_name):
+    return cached(
+        "mood",
+        make_key("mood", mood_name),
+        lambda: Mood.objects.filter(mood_name=mood_name, status=StatusChoices.ACTIVE)
+        .latest("created_at")
+        .mood_prompt,
+    )
+
+
+def cached_list(namespace, request, build):
+    """Cache a list response body per user and absolute URL (pagination links embed the host)."""
+    return cached(
+        f"{namespace}_list",
+        make_key(namespace, "list", request.user.pk, request.build_absolute_uri()),
+        build,
+    )
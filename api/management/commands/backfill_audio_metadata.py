@@ -0,0 +1,71 @@
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+
+from api.models import GeneratedAudio
+from api.utils import stored_audio_metadata
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill GeneratedAudio.duration and size_bytes for rows written before they "
+        "were stored. Rows are processed in primary key order, one chunk at a time; "
+        "pass the last reported id to --after to resume an interrupted run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--processes", type=int, default=os.cpu_count())
+        parser.add_argument(
+            "--after", type=int, default=0, help="Only rows with an id above this."
+        )
+
+    def handle(self, *args, **options):
+        queryset = (
+            GeneratedAudio.objects.filter(
+                Q(duration__isnull=True) | Q(size_bytes__isnull=True)
+            )
+            .exclude(audio="")
+            .order_by("pk")
+        )
+        last_pk = options["after"]
+        updated = missing = 0
+
+        # Workers only read files; they must not inherit the parent's connection.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options["processes"]) as pool:
+            while True:
+                chunk = list(
+                    queryset.filter(pk__gt=last_pk).only("pk", "audio")[
+                        : options["chunk_size"]
+                    ]
+                )
+                if not chunk:
+                    break
+
+                names = [gen_audio.audio.name for gen_audio in chunk]
+                for gen_audio, (duration, size_bytes) in zip(
+                    chunk, pool.map(stored_audio_metadata, names, chunksize=32)
+                ):
+                    gen_audio.duration = duration
+                    gen_audio.size_bytes = size_bytes
+                    if size_bytes is None:
+                        missing += 1
+                    else:
+                        updated += 1
+
+                GeneratedAudio.objects.bulk_update(chunk, ["duration", "size_bytes"])
+                last_pk = chunk[-1].pk
+                self.stdout.write(
+                    f"Processed up to id {last_pk} ({updated} updated, {missing} missing)."
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Backfill complete: {updated} updated, {missing} missing files."
+            )
+        )
@@ -0,0 +1,159 @@
+import asyncio
+import statistics
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api.choices import SenderTypeChoices
+from api.models import Avatar, Mood, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent /api/speak throughput of the sync view behind a fixed "
+        "pool of WSGI workers with the async view on a single ASGI event loop. "
+        "Upstream LLM and TTS calls are replaced by stubs that sleep for --latency "
+        "seconds. Runs against a throwaway test database with throttle budgets "
+        "disabled."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Concurrent requests the WSGI run can serve (sync worker count).",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.5,
+            help="Seconds each stubbed upstream call takes.",
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            token = self.seed()
+            payload = {
+                "text": "How was your day?",
+                "user_voice_name": "bench-user",
+                "ai_voice_name": "bench-ai",
+                "reply_as": SenderTypeChoices.AI,
+                "sender_type": SenderTypeChoices.USER,
+            }
+            headers = {"Authorization": f"Bearer {token}"}
+            # Every request comes from one user; budgets would throttle the run.
+            with self.stub_upstreams(options["latency"]), override_settings(
+                THROTTLE_BUDGETS={}
+            ):
+                wsgi = self.run_wsgi(payload, headers, options)
+                asgi = asyncio.run(self.run_asgi(payload, headers, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{'mode':<6}{'requests':>10}{'seconds':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+        )
+        for mode, (elapsed, latencies) in (("wsgi", wsgi), ("asgi", asgi)):
+            latencies.sort()
+            self.stdout.write(
+                f"{mode:<6}{len(latencies):>10}{elapsed:>10.2f}"
+                f"{len(latencies) / elapsed:>10.1f}"
+                f"{statistics.median(latencies):>10.1f}"
+                f"{latencies[int(len(latencies) * 0.95) - 1]:>10.1f}"
+            )
+
+    def seed(self):
+        user = User.objects.create_user(
+            email="bench@example.com", password="bench", username="bench"
+        )
+        Avatar.objects.create(
+            side=SenderTypeChoices.USER,
+            avatar_name="bench-user",
+            voice_name="bench-user",
+            elevenlabs_voice_id="bench-user",
+            video="video/user/bench.mp4",
+        )
+        Avatar.objects.create(
+            side=SenderTypeChoices.AI,
+            avatar_name="bench-ai",
+            voice_name="bench-ai",
+            elevenlabs_voice_id="bench-ai",
+            video="video/ai/bench.mp4",
+        )
+        Mood.objects.create(mood_name="friendly", mood_prompt="Be friendly.")
+        return str(RefreshToken.for_user(user).access_token)
+
+    def stub_upstreams(self, latency):
+        def reply(prompt):
+            time.sleep(latency)
+            return "Pretty good, thanks for asking."
+
+        # Synthesized files are published to media storage, so they must exist.
+        def synthesize(text, voice_id, filename):
+            time.sleep(latency)
+            open(filename, "wb").close()
+
+        async def areply(prompt):
+            await asyncio.sleep(latency)
+            return "Pretty good, thanks for asking."
+
+        async def asynthesize(text, voice_id, filename):
+            await asyncio.sleep(latency)
+            open(filename, "wb").close()
+
+        return mock.patch.multiple(
+            "api.services",
+            generate_ai_reply=reply,
+            generate_audio_with_fallback=synthesize,
+            agenerate_ai_reply=areply,
+            agenerate_audio_with_fallback=asynthesize,
+        )
+
+    def run_wsgi(self, payload, headers, options):
+        client = Client()
+
+        def one():
+            started = time.perf_counter()
+            response = client.post(
+                "/api/speak", payload, content_type="application/json", headers=headers
+            )
+            assert response.status_code == 201, response.content
+            return (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            latencies = list(pool.map(lambda _: one(), range(options["requests"])))
+        return time.perf_counter() - started, latencies
+
+    async def run_asgi(self, payload, headers, options):
+        client = AsyncClient()
+
+        async def one():
+            started = time.perf_counter()
+            response = await client.post(
+                "/api/speak/async",
+                payload,
+                content_type="application/json",
+                headers=headers,
+            )
+            assert response.status_code == 201, response.content
+            return (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(one() for _ in range(options["requests"])))
+        return time.perf_counter() - started, list(latencies)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from api.models import ChatHistory
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare every active chat history transcript with its conversation's "
+        "active turns and rewrite the ones that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Report drift without fixing it."
+        )
+
+    def handle(self, *args, **options):
+        queryset = ChatHistory.objects.IS_ACTIVE().order_by("pk")
+        last_pk = 0
+        checked = drifted = 0
+
+        while True:
+            chunk = list(
+                queryset.filter(pk__gt=last_pk).only(
+                    "pk", "uid", "conversation_id", "user", "chat"
+                )[: options["chunk_size"]]
+            )
+            if not chunk:
+                break
+
+            for chat_history in chunk:
+                checked += 1
+                expected = ChatHistory.objects.build_transcript(
+                    chat_history.conversation_id, chat_history.user_id
+                )
+                if chat_history.chat == expected:
+                    continue
+
+                drifted += 1
+                self.stdout.write(
+                    f"{chat_history.uid}: {len(chat_history.chat)} stored turns, "
+                    f"{len(expected)} expected."
+                )
+                if not options["dry_run"]:
+                    chat_history.chat = expected
+                    chat_history.save(update_fields=["chat", "updated_at"])
+            last_pk = chunk[-1].pk
+
+        action = "found" if options["dry_run"] else "repaired"
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {checked} chat histories, {action} {drifted}.")
+        )
@@ -0,0 +1,75 @@
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from api.jobs import process_job, worker_id
+from api.models import SynthesisJob
+
+
+def worker_loop(index, options, stop):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    name = worker_id(index)
+    while not stop.is_set():
+        close_old_connections()
+        job = SynthesisJob.objects.claim(
+            name, options["visibility_timeout"], kinds=options["kinds"]
+        )
+        if job is None:
+            stop.wait(options["poll_interval"])
+            continue
+        process_job(job)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Run a pool of local worker processes that drain the database-backed job queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, default=settings.JOB_WORKER_CONCURRENCY
+        )
+        parser.add_argument(
+            "--visibility-timeout",
+            type=int,
+            default=settings.JOB_VISIBILITY_TIMEOUT,
+            help="Seconds a claimed job stays invisible to other workers.",
+        )
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument(
+            "--kinds", nargs="*", help="Only run jobs of these kinds (default: all)."
+        )
+
+    def handle(self, *args, **options):
+        # Children must open their own database connections.
+        connections.close_all()
+        stop = multiprocessing.Event()
+        workers = [
+            multiprocessing.Process(
+                target=worker_loop, args=(index, options, stop), daemon=True
+            )
+            for index in range(options["concurrency"])
+        ]
+        for worker in workers:
+            worker.start()
+
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        self.stdout.write(f"Started {len(workers)} job workers.")
+        try:
+            while not stop.is_set():
+                for index, worker in enumerate(workers):
+                    if not worker.is_alive():
+                        workers[index] = multiprocessing.Process(
+                            target=worker_loop, args=(index, options, stop), daemon=True
+                        )
+                        workers[index].start()
+                time.sleep(1)
+        except KeyboardInterrupt:
+            stop.set()
+
+        for worker in workers:
+            worker.join()
+        self.stdout.write("Job workers stopped.")
@@ -0,0 +1,92 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from api.models import Avatar, ChatHistory, GeneratedAudio
+from api.storage import is_sharded, move_file, sharded_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Move audio and avatar video files written under the old flat layout "
+        "(audio/<file>, video/<side>/<file>) into hash-sharded directories and "
+        "update the stored names. Safe to re-run: sharded names are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Report moves without making them."
+        )
+
+    def handle(self, *args, **options):
+        audio_conversations = set()
+        moved, missing = self.shard(
+            GeneratedAudio, "audio", options, audio_conversations
+        )
+        video_moved, video_missing = self.shard(Avatar, "video", options)
+
+        if not options["dry_run"]:
+            # Transcripts embed audio names, so they are rebuilt from the turns.
+            for conversation_id, user_id in audio_conversations:
+                ChatHistory.objects.rebuild(conversation_id, user_id)
+
+        action = "would move" if options["dry_run"] else "moved"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Audio: {action} {moved}, {missing} missing. "
+                f"Video: {action} {video_moved}, {video_missing} missing."
+            )
+        )
+
+    def shard(self, model, field, options, conversations=None):
+        queryset = model.objects.exclude(**{field: ""}).order_by("pk")
+        columns = ["pk", field]
+        if conversations is not None:
+            columns += ["conversation_id", "user"]
+        last_pk = 0
+        moved = missing = 0
+
+        while True:
+            chunk = list(
+                queryset.filter(pk__gt=last_pk).only(*columns)[: options["chunk_size"]]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+
+            changed = []
+            for obj in chunk:
+                file = getattr(obj, field)
+                if is_sharded(file.name):
+                    continue
+
+                directory, filename = os.path.split(file.name)
+                new_name = sharded_name(directory, filename)
+                if default_storage.exists(file.name):
+                    moved += 1
+                    if options["dry_run"]:
+                        self.stdout.write(f"{file.name} -> {new_name}")
+                        continue
+                    new_name = move_file(file.name, new_name)
+                elif default_storage.exists(new_name):
+                    # Moved by a run that stopped before updating this row.
+                    moved += 1
+                    if options["dry_run"]:
+                        self.stdout.write(f"{file.name} -> {new_name} (already moved)")
+                        continue
+                else:
+                    missing += 1
+                    continue
+
+                setattr(obj, field, new_name)
+                changed.append(obj)
+                if conversations is not None:
+                    conversations.add((obj.conversation_id, obj.user_id))
+
+            if changed:
+                model.objects.bulk_update(changed, [field])
+            self.stdout.write(f"{model.__name__}: processed up to id {last_pk}.")
+
+        return moved, missing
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from api.retention import MediaSweeper
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete media files of rows soft-deleted longer than MEDIA_RETENTION_GRACE "
+        "ago, stored files no row references, stale stitched replays, scratch "
+        "files left by failed syntheses and abandoned chunked uploads, and report "
+        "the space reclaimed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Report what would be deleted."
+        )
+        parser.add_argument(
+            "--skip-orphans",
+            action="store_true",
+            help="Skip the storage listing walk, which reads every media directory.",
+        )
+
+    def handle(self, *args, **options):
+        sweeper = MediaSweeper(
+            chunk_size=options["chunk_size"],
+            dry_run=options["dry_run"],
+            log=self.stdout.write if options["verbosity"] > 1 else None,
+        )
+        passes = [("removed", sweeper.sweep_removed)]
+        if not options["skip_orphans"]:
+            passes.append(("orphaned", sweeper.sweep_orphans))
+        passes.append(("scratch", sweeper.sweep_scratch))
+        passes.append(("uploads", sweeper.sweep_uploads))
+
+        action = "Would reclaim" if options["dry_run"] else "Reclaimed"
+        total_files = total_bytes = 0
+        for label, sweep in passes:
+            files, reclaimed = sweep()
+            total_files += files
+            total_bytes += reclaimed
+            self.stdout.write(
+                f"{label}: {files} files, {filesizeformat(reclaimed)} ({reclaimed} bytes)"
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{action} {filesizeformat(total_bytes)} from {total_files} files."
+            )
+        )
@@ -1,7 +1,13 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth.models import BaseUserManager
-from django.db.models import Manager
+from django.db import transaction
+from django.db.models import F, Manager, Q, Sum, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
 
-from .choices import StatusChoices, SenderTypeChoices
+from .choices import JobKindChoices, JobStateChoices, StatusChoices, SenderTypeChoices
 
 
 class StatusManager(Manager):
@@ -62,6 +68,84 @@ class GeneratedAudioManager(StatusManager):
         return super().IS_REMOVED()
 
 
+class ConversationManager(StatusManager):
+    def IS_ACTIVE(self):
+        return super().IS_ACTIVE()
+
+    def IS_INACTIVE(self):
+        return super().IS_INACTIVE()
+
+    def IS_REMOVED(self):
+        return super().IS_REMOVED()
+
+    def add_turns(self, conversation_id, user, turns):
+        """
+        Insert unsaved ``GeneratedAudio`` rows as the next turns of a conversation.
+
+        The conversation row is locked while turn indexes are handed out, so
+        concurrent requests for one conversation get consecutive, non-overlapping
+        indexes; the turns are written with one bulk insert and the denormalized
+        counters are updated in the same transaction.
+        """
+        # Reading the audio files is kept outside the lock.
+        for turn in turns:
+            if turn.duration is None and turn.size_bytes is None:
+                turn.fill_audio_metadata()
+
+        GeneratedAudio = self.model._meta.apps.get_model("api", "GeneratedAudio")
+        with transaction.atomic():
+            conversation, _ = self.get_or_create(
+                conversation_id=conversation_id, user=user
+            )
+            conversation = self.select_for_update().get(pk=conversation.pk)
+            for offset, turn in enumerate(turns):
+                turn.dialogue = conversation
+                turn.turn_index = conversation.turn_count + offset
+            GeneratedAudio.objects.bulk_create(turns)
+
+            self.filter(pk=conversation.pk).update(
+                turn_count=F("turn_count") + len(turns),
+                total_duration=F("total_duration")
+                + sum(turn.duration or 0.0 for turn in turns),
+                last_activity_at=timezone.now(),
+            )
+
+            active = [turn for turn in turns if turn.status == StatusChoices.ACTIVE]
+            ChatHistory = self.model._meta.apps.get_model("api", "ChatHistory")
+            ChatHistory.objects.append_turns(conversation_id, user, active)
+            SynthesisJob = self.model._meta.apps.get_model("api", "SynthesisJob")
+            SynthesisJob.objects.enqueue_transcodes(active)
+        return conversation
+
+    def remove_turns(self, turns):
+        """
+        Mark the ``GeneratedAudio`` rows of ``turns`` REMOVED and take their audio
+        off their conversations' ``total_duration``. ``updated_at`` starts the
+        media retention grace period. Returns the number of rows removed.
+        """
+        with transaction.atomic():
+            turns = turns.exclude(status=StatusChoices.REMOVED)
+            durations = (
+                turns.filter(dialogue__isnull=False)
+                .values_list("dialogue")
+                .annotate(seconds=Sum("duration"))
+                .order_by()
+            )
+            for pk, seconds in durations:
+                if seconds:
+                    self.filter(pk=pk).update(
+                        total_duration=Greatest(
+                            F("total_duration") - seconds, Value(0.0)
+                        )
+                    )
+            return turns.update(status=StatusChoices.REMOVED, updated_at=timezone.now())
+
+    def add_duration(self, pk, seconds):
+        """Account for audio whose length was only known after its turn was saved."""
+        if seconds:
+            self.filter(pk=pk).update(total_duration=F("total_duration") + seconds)
+
+
 class ChatHistoryManager(StatusManager):
     def IS_ACTIVE(self):
         return super().IS_ACTIVE()
@@ -72,6 +156,50 @@ class ChatHistoryManager(StatusManager):
     def IS_REMOVED(self):
         return super().IS_REMOVED()
 
+    @staticmethod
+    def transcript_entry(turn):
+        return {
+            "turn_index": turn.turn_index,
+            "uid": str(turn.uid),
+            "sender_type": turn.sender_type,
+            "text": turn.text,
+            "audio": turn.audio.name,
+        }
+
+    def build_transcript(self, conversation_id, user):
+        """The transcript as it should be, rebuilt from the conversation's active turns."""
+        GeneratedAudio = self.model._meta.apps.get_model("api", "GeneratedAudio")
+        turns = GeneratedAudio.objects.filter(
+            dialogue__conversation_id=conversation_id,
+            dialogue__user=user,
+            status=StatusChoices.ACTIVE,
+        ).order_by("turn_index", "id")
+        return [self.transcript_entry(turn) for turn in turns]
+
+    def append_turns(self, conversation_id, user, turns):
+        """
+        Append turns to the transcripts of the conversation's chat histories. The
+        rows are locked for the read-modify-write, and entries are kept in turn
+        order because streamed turns are only appended once their audio is done.
+        """
+        entries = [self.transcript_entry(turn) for turn in turns]
+        if not entries:
+            return
+        with transaction.atomic():
+            for chat_history in self.select_for_update().filter(
+                conversation_id=conversation_id, user=user
+            ):
+                chat_history.chat = sorted(
+                    chat_history.chat + entries, key=lambda entry: entry["turn_index"]
+                )
+                chat_history.save(update_fields=["chat", "updated_at"])
+
+    def rebuild(self, conversation_id, user):
+        self.filter(conversation_id=conversation_id, user=user).update(
+            chat=self.build_transcript(conversation_id, user),
+            updated_at=timezone.now(),
+        )
+
 
 class AvatarManager(StatusManager):
     def IS_ACTIVE(self):
@@ -93,3 +221,72 @@ class MoodManager(StatusManager):
 
     def IS_REMOVED(self):
         return super().IS_REMOVED()
+
+
+class SynthesisJobManager(Manager):
+    def enqueue_transcodes(self, turns):
+        """Queue one TRANSCODE job producing the audio variants of saved turns."""
+        if not (settings.AUDIO_VARIANTS_ENABLED and settings.AUDIO_VARIANTS and turns):
+            return None
+        return self.create(
+            kind=JobKindChoices.TRANSCODE,
+            payload={"audio_ids": [turn.pk for turn in turns]},
+            user_id=turns[0].user_id,
+            max_attempts=settings.JOB_MAX_ATTEMPTS,
+        )
+
+    def enqueue_avatar_processing(self, avatar):
+        """Queue a PROCESS_AVATAR job deriving the poster and fast-start video."""
+        if not settings.AVATAR_PROCESSING_ENABLED:
+            return None
+        return self.create(
+            kind=JobKindChoices.PROCESS_AVATAR,
+            payload={"avatar_id": avatar.pk},
+            user_id=avatar.user_id,
+            max_attempts=settings.JOB_MAX_ATTEMPTS,
+        )
+
+    def claim(self, worker_id, visibility_timeout, kinds=None):
+        """
+        Lease the oldest runnable job to ``worker_id`` for ``visibility_timeout``
+        seconds. RUNNING jobs whose lease expired are picked up again, so a crashed
+        worker only delays its job. Returns ``None`` when the queue is empty.
+        """
+        while True:
+            now = timezone.now()
+            with transaction.atomic():
+                queryset = self.select_for_update(skip_locked=True).filter(
+                    Q(state=JobStateChoices.PENDING, run_after__lte=now)
+                    | Q(state=JobStateChoices.RUNNING, locked_until__lt=now)
+                )
+                if kinds:
+                    queryset = queryset.filter(kind__in=kinds)
+                job = queryset.order_by("run_after", "id").first()
+                if job is None:
+                    return None
+
+                if job.attempts >= job.max_attempts:
+                    job.state = JobStateChoices.FAILED
+                    job.error = job.error or "Visibility timeout expired."
+                    job.locked_until = None
+                    job.save(
+                        update_fields=["state", "error", "locked_until", "updated_at"]
+                    )
+                    continue
+
+                job.state = JobStateChoices.RUNNING
+                job.attempts = F("attempts") + 1
+                job.locked_by = worker_id
+                job.locked_until = now + timedelta(seconds=visibility_timeout)
+                job.save(
+                    update_fields=[
+                        "state",
+                        "attempts",
+                        "locked_by",
+                        "locked_until",
+                        "updated_at",
+                    ]
+                )
+                job.refresh_from_db(fields=["attempts"])
+                return job
+
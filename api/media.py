@@ -0,0 +1,188 @@
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .models import AudioVariant, Avatar, GeneratedAudio
+from .storage import is_local_storage
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def is_safe_media_path(path):
+    """Whether ``path`` is a normalized, relative path that stays under MEDIA_ROOT."""
+    return (
+        bool(path)
+        and posixpath.normpath(path) == path
+        and not path.startswith(("/", "../"))
+        and path != ".."
+    )
+
+
+def resolve_media_path(path):
+    """Map a media-relative path to a file under MEDIA_ROOT, refusing traversal."""
+    root = os.path.realpath(settings.MEDIA_ROOT)
+    full_path = os.path.realpath(os.path.join(root, path))
+    if not full_path.startswith(root + os.sep) or not os.path.isfile(full_path):
+        raise Http404("Media file not found.")
+    return full_path
+
+
+def media_user(request):
+    if request.user.is_authenticated:
+        return request.user
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def can_access(user, path):
+    if user.is_staff:
+        return True
+    if path.startswith("audio/replay/"):
+        # Stitched replays are named by a hash of their turns.
+        return True
+    if path.startswith("audio/"):
+        return GeneratedAudio.objects.filter(audio=path, user=user).exists()
+    if path.startswith("variants/"):
+        return AudioVariant.objects.filter(file=path, audio__user=user).exists()
+    if path.startswith("video/"):
+        return Avatar.objects.filter(
+            Q(user=user) | Q(user__isnull=True),
+            Q(video=path) | Q(poster=path) | Q(faststart_video=path),
+        ).exists()
+    return False
+
+
+def parse_range(header, size):
+    """
+    Return ``(start, end)`` (inclusive) for a single ``bytes=`` range, None when the
+    header should be ignored (absent, malformed or multi-range), or ``"invalid"``
+    when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header or "")
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return "invalid"
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return "invalid"
+    return start, end
+
+
+def iter_range(full_path, start, length, chunk_size=64 * 1024):
+    with open(full_path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serve a file from MEDIA_ROOT with ETag/Last-Modified revalidation and single
+    byte-range requests. With ``MEDIA_ACCEL_REDIRECT_PREFIX`` set, only the
+    permission check runs here and the transfer is handed to the front proxy;
+    with a non-filesystem storage backend the client is redirected to the
+    backend's (typically signed) URL instead.
+
+    Permission is checked before the filesystem is touched, so a caller who may
+    not read a path gets the same 403 whether or not the file exists.
+    """
+    if not is_safe_media_path(path):
+        raise Http404("Media file not found.")
+
+    if settings.MEDIA_REQUIRE_AUTH:
+        user = media_user(request)
+        if user is None or not can_access(user, path):
+            return HttpResponseForbidden()
+
+    if not is_local_storage():
+        return HttpResponseRedirect(default_storage.url(path))
+
+    full_path = resolve_media_path(path)
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or "application/octet-stream"
+
+    if settings.MEDIA_ACCEL_REDIRECT_PREFIX:
+        response = HttpResponse(content_type=content_type)
+        response[settings.MEDIA_ACCEL_HEADER] = (
+            settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + path
+        )
+        return response
+
+    stat = os.stat(full_path)
+    # Media files are only ever replaced whole, so size + mtime + inode pin the bytes.
+    etag = f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    last_modified = int(stat.st_mtime)
+    conditional = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if conditional is not None:
+        conditional["Cache-Control"] = settings.MEDIA_CACHE_CONTROL
+        return conditional
+
+    byte_range = None
+    if request.headers.get("Range"):
+        # A stale If-Range means the client's partial copy is outdated: send it all.
+        if_range = request.headers.get("If-Range")
+        if (
+            not if_range
+            or if_range == etag
+            or parse_http_date_safe(if_range) == last_modified
+        ):
+            byte_range = parse_range(request.headers["Range"], stat.st_size)
+
+    if byte_range == "invalid":
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{stat.st_size}"
+    elif byte_range is not None:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            iter_range(full_path, start, length), status=206, content_type=content_type
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        response["Content-Length"] = str(length)
+    else:
+        response = FileResponse(open(full_path, "rb"), content_type=content_type)
+        if encoding:
+            response["Content-Encoding"] = encoding
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = settings.MEDIA_CACHE_CONTROL
+    return response
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 09:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_synthesisjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generatedaudio',
+            name='duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='generatedaudio',
+            name='size_bytes',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
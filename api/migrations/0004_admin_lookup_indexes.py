@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-18 09:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_generatedaudio_duration_size_bytes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['conversation_id'], name='api_chathis_convers_717c2a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['status'], name='api_chathis_status_9a34e9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(fields=['created_at'], name='api_chathis_created_247dd1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='generatedaudio',
+            index=models.Index(fields=['conversation_id'], name='api_generat_convers_d8700b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='generatedaudio',
+            index=models.Index(fields=['status'], name='api_generat_status_55d4a7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='generatedaudio',
+            index=models.Index(fields=['sender_type'], name='api_generat_sender__88d139_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='generatedaudio',
+            index=models.Index(fields=['created_at'], name='api_generat_created_553dbe_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18 09:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_admin_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='avatar',
+            index=models.Index(fields=['voice_name', 'side', 'created_at'], name='avatar_voice_side_created'),
+        ),
+        migrations.AddIndex(
+            model_name='avatar',
+            index=models.Index(condition=models.Q(('status', 'ACTIVE')), fields=['user', 'id'], name='avatar_user_active'),
+        ),
+        migrations.AddIndex(
+            model_name='chathistory',
+            index=models.Index(condition=models.Q(('status', 'ACTIVE')), fields=['user', 'id'], name='chathistory_user_active'),
+        ),
+        migrations.AddIndex(
+            model_name='generatedaudio',
+            index=models.Index(condition=models.Q(('status', 'ACTIVE')), fields=['conversation_id', 'user'], name='genaudio_convo_user_active'),
+        ),
+        migrations.AddIndex(
+            model_name='mood',
+            index=models.Index(condition=models.Q(('status', 'ACTIVE')), fields=['mood_name', 'created_at'], name='mood_name_active'),
+        ),
+        migrations.AddIndex(
+            model_name='mood',
+            index=models.Index(condition=models.Q(('status', 'ACTIVE')), fields=['user', 'id'], name='mood_user_active'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def backfill_conversations(apps, schema_editor):
+    """
+    Attach existing GeneratedAudio rows to Conversation rows, in primary key
+    order and one short transaction per batch, so the audio table is never
+    locked as a whole. Turn indexes follow the original insertion order.
+    """
+    Conversation = apps.get_model("api", "Conversation")
+    GeneratedAudio = apps.get_model("api", "GeneratedAudio")
+    db_alias = schema_editor.connection.alias
+
+    pending = (
+        GeneratedAudio.objects.using(db_alias)
+        .filter(dialogue__isnull=True)
+        .exclude(conversation_id="")
+        .order_by("pk")
+    )
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=db_alias):
+            batch = list(
+                pending.filter(pk__gt=last_pk).only(
+                    "pk", "conversation_id", "user_id", "duration", "created_at"
+                )[:BATCH_SIZE]
+            )
+            if not batch:
+                break
+
+            keys = {(row.user_id, row.conversation_id) for row in batch}
+            conversations = {}
+            for conversation in (
+                Conversation.objects.using(db_alias)
+                .select_for_update()
+                .filter(conversation_id__in={key[1] for key in keys})
+            ):
+                conversations[(conversation.user_id, conversation.conversation_id)] = (
+                    conversation
+                )
+
+            missing = [key for key in keys if key not in conversations]
+            for user_id, conversation_id in missing:
+                conversation = Conversation.objects.using(db_alias).create(
+                    user_id=user_id, conversation_id=conversation_id
+                )
+                conversations[(user_id, conversation_id)] = conversation
+
+            for row in batch:
+                conversation = conversations[(row.user_id, row.conversation_id)]
+                row.dialogue = conversation
+                row.turn_index = conversation.turn_count
+                conversation.turn_count += 1
+                conversation.total_duration += row.duration or 0.0
+                if (
+                    conversation.last_activity_at is None
+                    or row.created_at > conversation.last_activity_at
+                ):
+                    conversation.last_activity_at = row.created_at
+
+            GeneratedAudio.objects.using(db_alias).bulk_update(
+                batch, ["dialogue", "turn_index"]
+            )
+            Conversation.objects.using(db_alias).bulk_update(
+                list(conversations.values()),
+                ["turn_count", "total_duration", "last_activity_at"],
+            )
+            last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("api", "0006_conversation"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 500
+
+
+def build_transcripts(apps, schema_editor):
+    """
+    Fill the JSON transcript from each history's active turns. The old text
+    column was a lossy dump, so it is rebuilt rather than parsed.
+    """
+    ChatHistory = apps.get_model("api", "ChatHistory")
+    GeneratedAudio = apps.get_model("api", "GeneratedAudio")
+    db_alias = schema_editor.connection.alias
+
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=db_alias):
+            batch = list(
+                ChatHistory.objects.using(db_alias)
+                .filter(pk__gt=last_pk)
+                .order_by("pk")
+                .only("pk", "conversation_id", "user_id")[:BATCH_SIZE]
+            )
+            if not batch:
+                break
+            for chat_history in batch:
+                turns = (
+                    GeneratedAudio.objects.using(db_alias)
+                    .filter(
+                        dialogue__conversation_id=chat_history.conversation_id,
+                        dialogue__user_id=chat_history.user_id,
+                        status="ACTIVE",
+                    )
+                    .order_by("turn_index", "id")
+                )
+                chat_history.chat_json = [
+                    {
+                        "turn_index": turn.turn_index,
+                        "uid": str(turn.uid),
+                        "sender_type": turn.sender_type,
+                        "text": turn.text,
+                        "audio": turn.audio.name,
+                    }
+                    for turn in turns
+                ]
+            ChatHistory.objects.using(db_alias).bulk_update(batch, ["chat_json"])
+            last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("api", "0007_backfill_conversations"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chathistory",
+            name="chat_json",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(build_transcripts, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="chathistory",
+            name="chat",
+        ),
+        migrations.RenameField(
+            model_name="chathistory",
+            old_name="chat_json",
+            new_name="chat",
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-18 10:12
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_chathistory_chat_json'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='synthesisjob',
+            name='kind',
+            field=models.CharField(choices=[('SPEAK', 'Speak'), ('TRANSCODE', 'Transcode')], default='SPEAK', max_length=32),
+        ),
+        migrations.CreateModel(
+            name='AudioVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('name', models.CharField(max_length=32)),
+                ('content_type', models.CharField(max_length=64)),
+                ('bitrate', models.PositiveIntegerField(help_text='kbit/s')),
+                ('file', models.FileField(upload_to='')),
+                ('size_bytes', models.PositiveBigIntegerField()),
+                ('audio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='api.generatedaudio')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('audio', 'name'), name='audiovariant_audio_name_unique')],
+            },
+        ),
+    ]
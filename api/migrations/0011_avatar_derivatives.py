@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_avatarupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='avatar',
+            name='faststart_video',
+            field=models.FileField(blank=True, upload_to=''),
+        ),
+        migrations.AddField(
+            model_name='avatar',
+            name='poster',
+            field=models.FileField(blank=True, upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='synthesisjob',
+            name='kind',
+            field=models.CharField(choices=[('SPEAK', 'Speak'), ('TRANSCODE', 'Transcode'), ('PROCESS_AVATAR', 'Process avatar')], default='SPEAK', max_length=32),
+        ),
+    ]
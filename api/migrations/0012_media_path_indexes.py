@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_avatar_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='audiovariant',
+            index=models.Index(fields=['file'], name='audiovariant_file'),
+        ),
+        migrations.AddIndex(
+            model_name='avatar',
+            index=models.Index(fields=['video'], name='avatar_video'),
+        ),
+        migrations.AddIndex(
+            model_name='avatar',
+            index=models.Index(fields=['poster'], name='avatar_poster'),
+        ),
+        migrations.AddIndex(
+            model_name='avatar',
+            index=models.Index(fields=['faststart_video'], name='avatar_faststart_video'),
+        ),
+        migrations.AddIndex(
+            model_name='generatedaudio',
+            index=models.Index(fields=['audio'], name='genaudio_audio'),
+        ),
+    ]
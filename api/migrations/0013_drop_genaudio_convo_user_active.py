@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 11:09
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_media_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='generatedaudio',
+            name='genaudio_convo_user_active',
+        ),
+    ]
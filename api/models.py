@@ -1,18 +1,29 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 
+import os
 import uuid
 
-from .choices import StatusChoices, SenderTypeChoices
+from .choices import (
+    JobKindChoices,
+    JobStateChoices,
+    SenderTypeChoices,
+    StatusChoices,
+    UploadStateChoices,
+)
 from .managers import (
     AvatarManager,
     ChatHistoryManager,
+    ConversationManager,
     GeneratedAudioManager,
     MoodManager,
+    SynthesisJobManager,
     UserManager,
 )
-from .utils import avatar_video_upload_path
+from .utils import avatar_video_upload_path, stored_audio_metadata
 # Create your models here.
 
 
@@ -37,13 +48,46 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.email
 
 
+class Conversation(models.Model):
+    uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    conversation_id = models.CharField(max_length=255)
+    turn_count = models.PositiveIntegerField(default=0)
+    total_duration = models.FloatField(default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(
+        max_length=10, choices=StatusChoices, default=StatusChoices.ACTIVE
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="conversations", null=True)
+
+    objects = ConversationManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "conversation_id"], name="conversation_user_id_unique"
+            )
+        ]
+
+    def __str__(self):
+        return self.conversation_id
+
+
 class GeneratedAudio(models.Model):
     uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     conversation_id = models.CharField(max_length=255, blank=True)
+    # Named ``dialogue`` because ``conversation_id`` is already the string id column.
+    dialogue = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="turns", null=True, blank=True
+    )
+    turn_index = models.PositiveIntegerField(null=True, blank=True)
     text = models.TextField(blank=True)
     audio = models.FileField(upload_to="audio/")
+    duration = models.FloatField(null=True, blank=True)
+    size_bytes = models.PositiveBigIntegerField(null=True, blank=True)
     sender_type = models.CharField(max_length=10, choices=SenderTypeChoices)
     status = models.CharField(
         max_length=10, choices=StatusChoices, default=StatusChoices.ACTIVE
@@ -52,6 +96,18 @@ class GeneratedAudio(models.Model):
 
     objects = GeneratedAudioManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["conversation_id"]),
+            models.Index(fields=["status"]),
+            models.Index(fields=["sender_type"]),
+            models.Index(fields=["created_at"]),
+            models.Index(
+                fields=["dialogue", "turn_index"], name="genaudio_dialogue_turn"
+            ),
+            models.Index(fields=["audio"], name="genaudio_audio"),
+        ]
+
     def __str__(self):
         audio_str = str(self.audio)
         audio_file_name = audio_str.split("/")[1].strip()
@@ -59,15 +115,48 @@ class GeneratedAudio(models.Model):
 
         return audio_title
 
-    @property
-    def audio_length(self) -> float:
-        from mutagen.mp3 import MP3
+    def save(self, *args, **kwargs):
+        if self.duration is None and self.size_bytes is None:
+            self.fill_audio_metadata()
+        super().save(*args, **kwargs)
 
-        try:
-            audio = MP3("media/" + str(self.audio))
-            return f"{round(audio.info.length, 2)} seconds"
-        except Exception:
+    def fill_audio_metadata(self):
+        """Read duration and size from the stored audio file once, when it is written."""
+        if self.audio:
+            self.duration, self.size_bytes = stored_audio_metadata(self.audio.name)
+
+    @property
+    def audio_length(self):
+        """Display string such as ``"2.51 seconds"``, or -1 when the length is unknown."""
+        if self.duration is None:
             return -1
+        return f"{round(self.duration, 2)} seconds"
+
+
+class AudioVariant(models.Model):
+    """A lower-bitrate or alternative-codec rendition of a ``GeneratedAudio`` file."""
+
+    uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    audio = models.ForeignKey(
+        GeneratedAudio, on_delete=models.CASCADE, related_name="variants"
+    )
+    name = models.CharField(max_length=32)
+    content_type = models.CharField(max_length=64)
+    bitrate = models.PositiveIntegerField(help_text="kbit/s")
+    file = models.FileField()
+    size_bytes = models.PositiveBigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["audio", "name"], name="audiovariant_audio_name_unique"
+            )
+        ]
+        indexes = [models.Index(fields=["file"], name="audiovariant_file")]
+
+    def __str__(self):
+        return f"{self.audio_id} {self.name}"
 
 
 class ChatHistory(models.Model):
@@ -76,9 +165,8 @@ class ChatHistory(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     conversation_id = models.CharField(max_length=255, blank=True)
     title = models.CharField(max_length=255, unique=True)
-    chat = (
-        models.TextField()
-    )  # NOTE: should be a json with key value pair of sender type and message
+    # Transcript entries in turn order, appended as turns are created.
+    chat = models.JSONField(default=list, blank=True)
     # sender_type = models.CharField(max_length=10, choices=SenderTypeChoices)
     status = models.CharField(
         max_length=10, choices=StatusChoices, default=StatusChoices.ACTIVE
@@ -87,6 +175,18 @@ class ChatHistory(models.Model):
 
     objects = ChatHistoryManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["conversation_id"]),
+            models.Index(fields=["status"]),
+            models.Index(fields=["created_at"]),
+            models.Index(
+                fields=["user", "id"],
+                condition=models.Q(status=StatusChoices.ACTIVE),
+                name="chathistory_user_active",
+            ),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -100,6 +200,9 @@ class Avatar(models.Model):
     voice_name = models.CharField(max_length=255)
     elevenlabs_voice_id = models.CharField(max_length=100)
     video = models.FileField(upload_to=avatar_video_upload_path)
+    # Derived from ``video`` by a PROCESS_AVATAR job; empty until it has run.
+    poster = models.FileField(blank=True)
+    faststart_video = models.FileField(blank=True)
     status = models.CharField(
         max_length=10, choices=StatusChoices, default=StatusChoices.ACTIVE
     )
@@ -107,10 +210,50 @@ class Avatar(models.Model):
 
     objects = AvatarManager()
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["voice_name", "side", "created_at"],
+                name="avatar_voice_side_created",
+            ),
+            models.Index(
+                fields=["user", "id"],
+                condition=models.Q(status=StatusChoices.ACTIVE),
+                name="avatar_user_active",
+            ),
+            models.Index(fields=["video"], name="avatar_video"),
+            models.Index(fields=["poster"], name="avatar_poster"),
+            models.Index(fields=["faststart_video"], name="avatar_faststart_video"),
+        ]
+
     def __str__(self):
         return f"Avatar: {self.avatar_name} - Voice: {self.voice_name}"
 
 
+class AvatarUpload(models.Model):
+    """A chunked avatar video upload; the ``Avatar`` row is created on finalize."""
+
+    uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    state = models.CharField(
+        max_length=10, choices=UploadStateChoices, default=UploadStateChoices.UPLOADING
+    )
+    avatar = models.ForeignKey(Avatar, models.SET_NULL, related_name="uploads", null=True)
+    user = models.ForeignKey(User, models.CASCADE, related_name="avatar_uploads")
+
+    def __str__(self):
+        return f"Upload {self.uid}: {self.offset}/{self.size} ({self.state})"
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.AVATAR_UPLOAD_DIR, f"{self.uid}.part")
+
+
 class Mood(models.Model):
     uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -124,9 +267,53 @@ class Mood(models.Model):
 
     objects = MoodManager()
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["mood_name", "created_at"],
+                condition=models.Q(status=StatusChoices.ACTIVE),
+                name="mood_name_active",
+            ),
+            models.Index(
+                fields=["user", "id"],
+                condition=models.Q(status=StatusChoices.ACTIVE),
+                name="mood_user_active",
+            ),
+        ]
+
     def save(self, *args, **kwargs):
         self.mood_name = self.mood_name.lower()
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.mood_name
+
+
+class SynthesisJob(models.Model):
+    uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    kind = models.CharField(
+        max_length=32, choices=JobKindChoices, default=JobKindChoices.SPEAK
+    )
+    payload = models.JSONField(default=dict)
+    result = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    state = models.CharField(
+        max_length=10, choices=JobStateChoices, default=JobStateChoices.PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=255, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="synthesis_jobs", null=True)
+
+    objects = SynthesisJobManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["state", "run_after"])]
+
+    def __str__(self):
+        return f"{self.kind} job {self.uid} ({self.state})"
+
@@ -0,0 +1,249 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+from openai import AsyncOpenAI, OpenAI
+
+# Upstream provider clients, created lazily once per process (and per event loop
+# for async clients) so every call reuses pooled keep-alive connections.
+
+_lock = threading.Lock()
+_clients = {}
+_transports = {}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class TransportStats:
+    """
+    Connection counters of one client's transport. httpcore reports the network
+    stream a response was read from; a stream that has not been seen before
+    means the request paid for a new connection (and TLS handshake). Open, busy
+    and idle connections are read from the httpcore pool itself.
+    """
+
+    def __init__(self, pool):
+        self._lock = threading.Lock()
+        self._streams = weakref.WeakSet()
+        self._pool = pool
+        self.requests = 0
+        self.connections_opened = 0
+        self.in_flight = 0
+
+    def request_started(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+
+    def response_received(self, response):
+        stream = response.extensions.get("network_stream")
+        if stream is None:
+            return
+        with self._lock:
+            if stream not in self._streams:
+                self._streams.add(stream)
+                self.connections_opened += 1
+
+    def request_finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def snapshot(self):
+        connections = [
+            connection
+            for connection in self._pool.connections
+            if not connection.is_closed()
+        ]
+        idle = sum(1 for connection in connections if connection.is_idle())
+        with self._lock:
+            return {
+                "open_connections": len(connections),
+                "in_use": len(connections) - idle,
+                "idle": idle,
+                "in_flight": self.in_flight,
+                "max_size": settings.PROVIDER_POOL_MAXSIZE,
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "handshakes_avoided": max(self.requests - self.connections_opened, 0),
+            }
+
+
+class CountedStream(httpx.SyncByteStream):
+    def __init__(self, stream, stats):
+        self._stream = stream
+        self._stats = stats
+        self._closed = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._stats.request_finished()
+
+
+class AsyncCountedStream(httpx.AsyncByteStream):
+    def __init__(self, stream, stats):
+        self._stream = stream
+        self._stats = stats
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._stats.request_finished()
+
+
+class InstrumentedTransport(httpx.BaseTransport):
+    """Pooled ``httpx.HTTPTransport`` whose requests are counted in ``stats``."""
+
+    def __init__(self, **kwargs):
+        self._transport = httpx.HTTPTransport(**kwargs)
+        # httpx keeps its httpcore pool in ``_pool``; its ``connections`` are public.
+        self.stats = TransportStats(self._transport._pool)
+
+    def handle_request(self, request):
+        self.stats.request_started()
+        try:
+            response = self._transport.handle_request(request)
+        except BaseException:
+            self.stats.request_finished()
+            raise
+        self.stats.response_received(response)
+        # The connection goes back to the pool when the body is closed.
+        response.stream = CountedStream(response.stream, self.stats)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class InstrumentedAsyncTransport(httpx.AsyncBaseTransport):
+    """Pooled ``httpx.AsyncHTTPTransport`` whose requests are counted in ``stats``."""
+
+    def __init__(self, **kwargs):
+        self._transport = httpx.AsyncHTTPTransport(**kwargs)
+        # httpx keeps its httpcore pool in ``_pool``; its ``connections`` are public.
+        self.stats = TransportStats(self._transport._pool)
+
+    async def handle_async_request(self, request):
+        self.stats.request_started()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self.stats.request_finished()
+            raise
+        self.stats.response_received(response)
+        response.stream = AsyncCountedStream(response.stream, self.stats)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def httpx_timeout():
+    return httpx.Timeout(
+        settings.PROVIDER_READ_TIMEOUT, connect=settings.PROVIDER_CONNECT_TIMEOUT
+    )
+
+
+def httpx_limits():
+    return httpx.Limits(
+        max_connections=settings.PROVIDER_POOL_MAXSIZE,
+        max_keepalive_connections=settings.PROVIDER_POOL_MAXSIZE,
+        keepalive_expiry=settings.PROVIDER_KEEPALIVE_EXPIRY,
+    )
+
+
+def _get_or_create(name, factory):
+    """
+    Build a client with ``factory(transport)`` once per process. Transports are
+    kept next to their clients so ``pool_stats`` never reaches into a client.
+    """
+    # Keyed by pid so a forked worker never reuses its parent's sockets.
+    key = (os.getpid(), name)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                transport = InstrumentedTransport(limits=httpx_limits())
+                client = _clients[key] = factory(transport)
+                _transports[key] = transport
+    return client
+
+
+def _get_or_create_async(name, factory):
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    if name not in clients:
+        transport = InstrumentedAsyncTransport(limits=httpx_limits())
+        clients[name] = (factory(transport), transport)
+    return clients[name][0]
+
+
+def get_elevenlabs_client():
+    return _get_or_create(
+        "elevenlabs",
+        lambda transport: httpx.Client(transport=transport, timeout=httpx_timeout()),
+    )
+
+
+def get_async_elevenlabs_client():
+    return _get_or_create_async(
+        "elevenlabs",
+        lambda transport: httpx.AsyncClient(
+            transport=transport, timeout=httpx_timeout()
+        ),
+    )
+
+
+def get_openai_client():
+    return _get_or_create(
+        "openai",
+        lambda transport: OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.Client(transport=transport, timeout=httpx_timeout()),
+        ),
+    )
+
+
+def get_async_openai_client():
+    return _get_or_create_async(
+        "openai",
+        lambda transport: AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.AsyncClient(
+                transport=transport, timeout=httpx_timeout()
+            ),
+        ),
+    )
+
+
+def pool_stats():
+    pid = os.getpid()
+    stats = {"pid": pid}
+
+    for (owner, name), transport in list(_transports.items()):
+        if owner == pid:
+            stats[name] = transport.stats.snapshot()
+
+    for loop, clients in list(_async_clients.items()):
+        if loop.is_closed():
+            continue
+        for name, (_client, transport) in list(clients.items()):
+            stats[f"{name}_async"] = transport.stats.snapshot()
+    return stats
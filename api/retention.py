@@ -0,0 +1,212 @@
+import os
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils import timezone
+
+from .avatar_processing import AVATAR_FILE_FIELDS
+from .choices import StatusChoices, UploadStateChoices
+from .models import AudioVariant, Avatar, AvatarUpload, GeneratedAudio
+from .services import REPLAY_AUDIO_DIR
+
+
+class MediaSweeper:
+    """
+    Reclaims media storage in three passes, each returning ``(files, bytes)``:
+
+    ``sweep_removed`` deletes the files of rows soft-deleted (directly or through
+    their owner) more than ``MEDIA_RETENTION_GRACE`` seconds ago and clears the
+    file field, so a row is only swept once. Audio variants go with their audio.
+
+    ``sweep_orphans`` walks the storage listing one directory at a time and checks
+    each batch of names against the database, so neither side is ever loaded
+    whole. Unreferenced files younger than the grace period are kept: synthesis
+    publishes a file just before inserting its row. Stitched replays are derived
+    data and are dropped once older than ``MEDIA_REPLAY_RETENTION``.
+
+    ``sweep_scratch`` removes files left in ``MEDIA_SCRATCH_DIR`` by syntheses
+    that failed before publishing.
+
+    ``sweep_uploads`` drops chunked avatar uploads idle for longer than
+    ``AVATAR_UPLOAD_EXPIRY`` together with their partial files.
+    """
+
+    # Top-level media directory -> (model, file fields) that own its files.
+    OWNERS = {
+        "audio": (GeneratedAudio, ["audio"]),
+        "variants": (AudioVariant, ["file"]),
+        "video": (Avatar, AVATAR_FILE_FIELDS),
+    }
+
+    def __init__(self, storage=default_storage, chunk_size=500, dry_run=False, log=None):
+        self.storage = storage
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.log = log or (lambda message: None)
+        now = timezone.now()
+        self.cutoff = now - timedelta(seconds=settings.MEDIA_RETENTION_GRACE)
+        self.replay_cutoff = now - timedelta(seconds=settings.MEDIA_REPLAY_RETENTION)
+
+    def removed_queryset(self, model):
+        return model.objects.filter(
+            Q(status=StatusChoices.REMOVED, updated_at__lt=self.cutoff)
+            | Q(user__status=StatusChoices.REMOVED, user__updated_at__lt=self.cutoff)
+        )
+
+    def sweep_removed(self):
+        files = reclaimed = 0
+        for model, fields in (self.OWNERS["audio"], self.OWNERS["video"]):
+            # The first field is the original; derivatives only exist alongside it.
+            queryset = (
+                self.removed_queryset(model).exclude(**{fields[0]: ""}).order_by("pk")
+            )
+            last_pk = 0
+            while True:
+                chunk = list(
+                    queryset.filter(pk__gt=last_pk).only("pk", *fields)[: self.chunk_size]
+                )
+                if not chunk:
+                    break
+                last_pk = chunk[-1].pk
+
+                names = [
+                    getattr(obj, field).name
+                    for obj in chunk
+                    for field in fields
+                    if getattr(obj, field)
+                ]
+                variants = []
+                if model is GeneratedAudio:
+                    variants = list(
+                        AudioVariant.objects.filter(audio__in=chunk).only("pk", "file")
+                    )
+                    names += [variant.file.name for variant in variants]
+                for name in names:
+                    size = self.delete(name)
+                    if size is not None:
+                        files += 1
+                        reclaimed += size
+
+                if not self.dry_run:
+                    for obj in chunk:
+                        for field in fields:
+                            setattr(obj, field, "")
+                    model.objects.bulk_update(chunk, fields)
+                    AudioVariant.objects.filter(pk__in=[v.pk for v in variants]).delete()
+        return files, reclaimed
+
+    def sweep_orphans(self):
+        files = reclaimed = 0
+        for top, (model, fields) in self.OWNERS.items():
+            for directory, names in self.walk(top):
+                if directory == REPLAY_AUDIO_DIR or directory.startswith(
+                    REPLAY_AUDIO_DIR + "/"
+                ):
+                    candidates = names
+                    cutoff = self.replay_cutoff
+                else:
+                    matches = Q()
+                    for field in fields:
+                        matches |= Q(**{f"{field}__in": names})
+                    referenced = {
+                        name
+                        for row in model.objects.filter(matches).values_list(*fields)
+                        for name in row
+                    }
+                    candidates = [name for name in names if name not in referenced]
+                    cutoff = self.cutoff
+
+                for name in candidates:
+                    try:
+                        if self.storage.get_modified_time(name) >= cutoff:
+                            continue
+                    except OSError:
+                        continue
+                    size = self.delete(name)
+                    if size is not None:
+                        self.log(f"orphan {name} ({size} bytes)")
+                        files += 1
+                        reclaimed += size
+        return files, reclaimed
+
+    def sweep_scratch(self):
+        files = reclaimed = 0
+        cutoff = self.cutoff.timestamp()
+        try:
+            entries = list(os.scandir(settings.MEDIA_SCRATCH_DIR))
+        except FileNotFoundError:
+            return files, reclaimed
+
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if not entry.is_file() or stat.st_mtime >= cutoff:
+                continue
+            if not self.dry_run:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+            files += 1
+            reclaimed += stat.st_size
+        return files, reclaimed
+
+    def sweep_uploads(self):
+        files = reclaimed = 0
+        expired = AvatarUpload.objects.filter(
+            state=UploadStateChoices.UPLOADING,
+            updated_at__lt=timezone.now()
+            - timedelta(seconds=settings.AVATAR_UPLOAD_EXPIRY),
+        ).order_by("pk")
+        last_pk = 0
+        while True:
+            chunk = list(
+                expired.filter(pk__gt=last_pk).only("pk", "uid")[: self.chunk_size]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            for upload in chunk:
+                try:
+                    size = os.path.getsize(upload.part_path)
+                except FileNotFoundError:
+                    continue
+                if not self.dry_run:
+                    os.remove(upload.part_path)
+                files += 1
+                reclaimed += size
+            if not self.dry_run:
+                AvatarUpload.objects.filter(
+                    pk__in=[upload.pk for upload in chunk]
+                ).delete()
+        return files, reclaimed
+
+    def walk(self, directory):
+        """Yield ``(directory, names)`` with at most ``chunk_size`` stored file names per batch."""
+        try:
+            subdirectories, filenames = self.storage.listdir(directory)
+        except FileNotFoundError:
+            return
+
+        for start in range(0, len(filenames), self.chunk_size):
+            yield directory, [
+                f"{directory}/{filename}"
+                for filename in filenames[start : start + self.chunk_size]
+            ]
+        for subdirectory in subdirectories:
+            yield from self.walk(f"{directory}/{subdirectory}")
+
+    def delete(self, name):
+        """Delete one stored file and return its size, or None if it was already gone."""
+        try:
+            size = self.storage.size(name)
+        except OSError:
+            return None
+        if not self.dry_run:
+            self.storage.delete(name)
+        return size
@@ -1,6 +1,21 @@
-import json
+import os
+import re
+
+from django.conf import settings
+from django.utils.text import get_valid_filename
 from rest_framework import serializers
-from .models import GeneratedAudio, ChatHistory, Avatar, Mood, User
+
+from .choices import SenderTypeChoices
+from .models import (
+    Avatar,
+    AvatarUpload,
+    ChatHistory,
+    GeneratedAudio,
+    Mood,
+    SynthesisJob,
+    User,
+)
+from .transcoding import pick_audio
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -47,6 +62,7 @@ class UserLiteSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = [
+            "uid",
             "username",
             "first_name",
             "last_name",
@@ -93,7 +109,7 @@ class GeneratedAudioSerializer(serializers.ModelSerializer):
     user_voice_name = serializers.CharField(write_only=True)
     ai_voice_name = serializers.CharField(write_only=True)
     reply_as = serializers.CharField(write_only=True)
-    user = UserSerializer(read_only=True)
+    user = UserLiteSerializer(read_only=True)
 
     class Meta:
         model = GeneratedAudio
@@ -107,6 +123,8 @@ class GeneratedAudioSerializer(serializers.ModelSerializer):
             "reply_as",
             "audio",
             "audio_length",
+            "duration",
+            "size_bytes",
             "sender_type",
             "created_at",
             "updated_at",
@@ -118,14 +136,25 @@ class GeneratedAudioSerializer(serializers.ModelSerializer):
             "uid",
             "audio",
             "audio_length",
+            "duration",
+            "size_bytes",
             "created_at",
             "updated_at",
             "user"
         ]
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        audio_accept = self.context.get("audio_accept")
+        if audio_accept and instance.audio:
+            data["audio"] = self.fields["audio"].to_representation(
+                pick_audio(instance, audio_accept)
+            )
+        return data
+
 
 class ChatHistorySerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+    user = UserLiteSerializer(read_only=True)
     class Meta:
         model = ChatHistory
         fields = [
@@ -182,34 +211,14 @@ class ChatHistorySerializer(serializers.ModelSerializer):
     #     return value
 
     def create(self, validated_data):
-        convo_id = validated_data.get("conversation_id")
-        gen_audios = GeneratedAudio.objects.IS_ACTIVE().filter(conversation_id=convo_id)
-        # chat=""
-        # for gen_audio in gen_audios:
-        #     sender_type = gen_audio.sender_type
-        #     chat_prefix = ""
-        #     if sender_type == "USER":
-        #         chat_prefix = "user:"
-        #     else:
-        #         chat_prefix = "ai:"
-        #     chat = chat + (f"{chat_prefix}"+f"{gen_audio.text}"+", ")
-
-        # return ChatHistory.objects.create(chat=chat, **validated_data)
-
-        chat_data = []
-        for gen_audio in gen_audios:
-            sender_type = gen_audio.sender_type
-            if sender_type == "USER":
-                chat_data.append({"user": gen_audio.text})
-            else:
-                chat_data.append({"ai": gen_audio.text})
-
-        chat_str = json.dumps(chat_data, ensure_ascii=False)
-        return ChatHistory.objects.create(chat=chat_str, **validated_data)
+        chat = ChatHistory.objects.build_transcript(
+            validated_data.get("conversation_id"), validated_data.get("user")
+        )
+        return ChatHistory.objects.create(chat=chat, **validated_data)
 
 
 class AvatarSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+    user = UserLiteSerializer(read_only=True)
     class Meta:
         model = Avatar
         fields = [
@@ -220,6 +229,8 @@ class AvatarSerializer(serializers.ModelSerializer):
             "voice_name",
             "elevenlabs_voice_id",
             "video",
+            "poster",
+            "faststart_video",
             "created_at",
             "updated_at",
             "status",
@@ -228,6 +239,8 @@ class AvatarSerializer(serializers.ModelSerializer):
         read_only_fields = [
             "id",
             "uid",
+            "poster",
+            "faststart_video",
             "created_at",
             "updated_at",
             "user"
@@ -244,8 +257,49 @@ class AvatarSerializer(serializers.ModelSerializer):
         
         
 
+class AvatarUploadSerializer(serializers.ModelSerializer):
+    avatar = serializers.SlugRelatedField(slug_field="uid", read_only=True)
+
+    class Meta:
+        model = AvatarUpload
+        fields = [
+            "uid",
+            "filename",
+            "size",
+            "sha256",
+            "offset",
+            "state",
+            "avatar",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = [
+            "uid",
+            "offset",
+            "state",
+            "avatar",
+            "created_at",
+            "updated_at",
+        ]
+
+    def validate_filename(self, value):
+        return get_valid_filename(os.path.basename(value))
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.AVATAR_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"Size must be between 1 and {settings.AVATAR_UPLOAD_MAX_SIZE} bytes."
+            )
+        return value
+
+    def validate_sha256(self, value):
+        if value and not re.fullmatch(r"[0-9a-fA-F]{64}", value):
+            raise serializers.ValidationError("Expected a hex SHA-256 digest.")
+        return value.lower()
+
+
 class MoodSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+    user = UserLiteSerializer(read_only=True)
     class Meta:
         model = Mood
         fields = [
@@ -267,3 +321,40 @@ class MoodSerializer(serializers.ModelSerializer):
             "status",
             "user"
         ]
+
+
+class SynthesisJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SynthesisJob
+        fields = [
+            "uid",
+            "kind",
+            "state",
+            "attempts",
+            "max_attempts",
+            "result",
+            "error",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = fields
+
+
+class BatchSpeakTurnSerializer(serializers.Serializer):
+    text = serializers.CharField()
+    sender_type = serializers.ChoiceField(choices=SenderTypeChoices.choices)
+    voice_name = serializers.CharField()
+
+
+class BatchSpeakSerializer(serializers.Serializer):
+    conversation_id = serializers.CharField(max_length=255, required=False)
+    concurrency = serializers.IntegerField(min_value=1, required=False)
+    turns = BatchSpeakTurnSerializer(many=True, allow_empty=False)
+
+    def validate_turns(self, value):
+        if len(value) > settings.BATCH_SPEAK_MAX_TURNS:
+            raise serializers.ValidationError(
+                f"A batch can contain at most {settings.BATCH_SPEAK_MAX_TURNS} turns."
+            )
+        return value
+
@@ -0,0 +1,550 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .choices import SenderTypeChoices, StatusChoices
+from .lookups import get_mood_prompt, get_voice_id
+from .models import Avatar, Conversation, GeneratedAudio, SynthesisJob
+from .providers import get_async_openai_client, get_openai_client
+from .storage import PendingAudio, publish_file, sharded_name
+from .transcoding import TranscodeError, get_transcoder
+from .utils import (
+    agenerate_audio_with_fallback,
+    atimed_call,
+    clean_text,
+    generate_audio_with_fallback,
+    mp3_frames,
+    stored_audio_metadata,
+    timed_call,
+    write_file,
+)
+
+speak_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SPEAK_EXECUTOR_WORKERS", 16)),
+    thread_name_prefix="speak",
+)
+
+
+REPLY_SYSTEM_PROMPT = "You are not an AI character. You will act like another person and reply in a conversation."
+ANALYZE_SYSTEM_PROMPT = "You are a helpful assistant that summarizes content."
+
+
+def discard_after(future, audio):
+    """Discard ``audio`` once ``future``, which writes it, has finished or been cancelled."""
+    future.cancel()
+    future.add_done_callback(lambda _future: audio.discard())
+
+
+class ReplyGenerationError(Exception):
+    pass
+
+
+class ReplayStitchError(Exception):
+    pass
+
+
+def reply_messages(prompt):
+    return [
+        {"role": "system", "content": REPLY_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def generate_ai_reply(prompt):
+    response = get_openai_client().chat.completions.create(
+        model="gpt-4o", messages=reply_messages(prompt)
+    )
+    return clean_text(response.choices[0].message.content.strip())
+
+
+async def agenerate_ai_reply(prompt):
+    response = await get_async_openai_client().chat.completions.create(
+        model="gpt-4o", messages=reply_messages(prompt)
+    )
+    return clean_text(response.choices[0].message.content.strip())
+
+
+def generate_ai_reply_stream(prompt):
+    response = get_openai_client().chat.completions.create(
+        model="gpt-4o", messages=reply_messages(prompt), stream=True
+    )
+    for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def analysis_messages(text):
+    # prompt = f"Analyze the following conversation and give a short summary or insight in 4-5 sentences:\n\nText: {text}"
+    prompt = (
+        f"Analyze the emotional tone and mood of the following text or conversation. "
+        f"Describe how the speaker(s) might be feeling, and provide a short summary of the overall emotional context "
+        f"in 2-3 sentences:\n\nText: {text}"
+    )
+    return [
+        {"role": "system", "content": ANALYZE_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def analyze_text(text):
+    """Short emotional analysis of ``text``; empty when the model returned nothing."""
+    response = get_openai_client().chat.completions.create(
+        model="gpt-4o", messages=analysis_messages(text)
+    )
+    return clean_text(response.choices[0].message.content.strip())
+
+
+async def aanalyze_text(text):
+    response = await get_async_openai_client().chat.completions.create(
+        model="gpt-4o", messages=analysis_messages(text)
+    )
+    return clean_text(response.choices[0].message.content.strip())
+
+
+def speak_params(validated_data, data):
+    """Plain, JSON-serializable description of one /api/speak turn."""
+    return {
+        "text": validated_data.get("text"),
+        "mode": data.get("mode", "friendly"),
+        "conversation_id": data.get("conversation_id", str(uuid.uuid4())),
+        "user_voice_name": validated_data.get("user_voice_name"),
+        "ai_voice_name": validated_data.get("ai_voice_name"),
+        "reply_as": validated_data.get("reply_as", "AI"),
+        "sender_type": data.get("sender_type"),
+        "reply_text": data.get("reply_text"),
+    }
+
+
+def resolve_speak_context(params):
+    user_voice_id = get_voice_id(params["user_voice_name"], SenderTypeChoices.USER)
+    ai_voice_id = get_voice_id(params["ai_voice_name"], SenderTypeChoices.AI)
+    mood_prompt = get_mood_prompt(params["mode"].lower())
+    prompt = f"{mood_prompt}\nUser: {params['text']}\nAI:"
+
+    return user_voice_id, ai_voice_id, prompt
+
+
+def speak_audio():
+    """Scratch files for the user and AI side of one speak turn."""
+    audio_id = uuid.uuid4().hex
+    return PendingAudio("user", audio_id), PendingAudio("ai", audio_id)
+
+
+def manual_speak_turn(params, user_voice_id, ai_voice_id):
+    """
+    The single side synthesized when replying as the user: returns
+    ``(sender_type, text, voice_id)`` and the cleaned reply text.
+    """
+    reply_text = params.get("reply_text")
+    if not reply_text:
+        raise serializers.ValidationError("User must provide a reply text")
+    ai_reply = clean_text(reply_text)
+
+    if params["sender_type"] == SenderTypeChoices.USER:
+        return (SenderTypeChoices.USER, params["text"], user_voice_id), ai_reply
+    if params["sender_type"] == SenderTypeChoices.AI:
+        return (SenderTypeChoices.AI, ai_reply, ai_voice_id), ai_reply
+
+    raise serializers.ValidationError(
+        "sender_type must be USER or AI when replying as USER"
+    )
+
+
+def save_speak(user, params, ai_reply, sides, timings=None, job=None):
+    """
+    Publish the synthesized ``sides`` (``(sender_type, text, PendingAudio)``
+    tuples) and append them to the conversation. Returns the response payload
+    and the ``GeneratedAudio`` rows.
+
+    For a background ``job`` the payload is recorded as its result in the same
+    transaction as the turns. A retried or reclaimed run of a job whose turns
+    were already saved discards its audio and returns the recorded result
+    instead of appending the turns twice.
+    """
+    convo_id = params["conversation_id"]
+    with transaction.atomic():
+        if job is not None:
+            recorded = (
+                SynthesisJob.objects.select_for_update()
+                .values_list("result", flat=True)
+                .get(pk=job.pk)
+            )
+            if recorded:
+                for _sender_type, _text, audio in sides:
+                    audio.discard()
+                return recorded, []
+
+        payload = {"reply": ai_reply}
+        generated = []
+        for sender_type, text, audio in sides:
+            audio.publish()
+            payload[f"{sender_type.lower()}_audio"] = audio.name
+            generated.append(
+                GeneratedAudio(
+                    text=text,
+                    audio=audio.name,
+                    sender_type=sender_type,
+                    conversation_id=convo_id,
+                    user=user,
+                )
+            )
+        Conversation.objects.add_turns(convo_id, user, generated)
+
+        payload["conversation_id"] = convo_id
+        if timings is not None:
+            payload["timings"] = timings
+        if job is not None:
+            payload["audio_uids"] = [str(gen_audio.uid) for gen_audio in generated]
+            SynthesisJob.objects.filter(pk=job.pk).update(
+                result=payload, updated_at=timezone.now()
+            )
+    return payload, generated
+
+
+def run_speak(user, params, job=None):
+    """
+    Synthesize one dialogue turn and return the response payload together with
+    the ``GeneratedAudio`` rows that were created (see ``save_speak`` for ``job``).
+    """
+    user_voice_id, ai_voice_id, prompt = resolve_speak_context(params)
+    user_text = params["text"]
+    user_audio, ai_audio = speak_audio()
+
+    if params["reply_as"] == SenderTypeChoices.AI:
+        # User-side audio does not depend on the reply, so it is
+        # synthesized while the LLM call is in flight.
+        started = time.perf_counter()
+        user_future = speak_executor.submit(
+            timed_call,
+            generate_audio_with_fallback,
+            user_text,
+            user_voice_id,
+            user_audio.path,
+        )
+
+        try:
+            ai_reply, llm_ms = timed_call(generate_ai_reply, prompt)
+        except Exception as e:
+            discard_after(user_future, user_audio)
+            raise ReplyGenerationError(str(e)) from e
+
+        ai_future = speak_executor.submit(
+            timed_call,
+            generate_audio_with_fallback,
+            ai_reply,
+            ai_voice_id,
+            ai_audio.path,
+        )
+        try:
+            _, user_tts_ms = user_future.result()
+            _, ai_tts_ms = ai_future.result()
+        except Exception:
+            discard_after(user_future, user_audio)
+            discard_after(ai_future, ai_audio)
+            raise
+        timings = {
+            "llm_ms": llm_ms,
+            "user_tts_ms": user_tts_ms,
+            "ai_tts_ms": ai_tts_ms,
+            "total_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        return save_speak(
+            user,
+            params,
+            ai_reply,
+            [
+                (SenderTypeChoices.USER, user_text, user_audio),
+                (SenderTypeChoices.AI, ai_reply, ai_audio),
+            ],
+            timings,
+            job,
+        )
+
+    (sender_type, text, voice_id), ai_reply = manual_speak_turn(
+        params, user_voice_id, ai_voice_id
+    )
+    audio = user_audio if sender_type == SenderTypeChoices.USER else ai_audio
+    try:
+        generate_audio_with_fallback(text, voice_id, audio.path)
+    except Exception:
+        audio.discard()
+        raise
+    return save_speak(user, params, ai_reply, [(sender_type, text, audio)], job=job)
+
+
+async def arun_speak(user, params):
+    """``run_speak`` on the event loop, with the async LLM and TTS clients."""
+    user_voice_id, ai_voice_id, prompt = await sync_to_async(resolve_speak_context)(
+        params
+    )
+    user_text = params["text"]
+    user_audio, ai_audio = speak_audio()
+
+    if params["reply_as"] == SenderTypeChoices.AI:
+        started = time.perf_counter()
+        user_task = asyncio.create_task(
+            atimed_call(
+                agenerate_audio_with_fallback, user_text, user_voice_id, user_audio.path
+            )
+        )
+
+        try:
+            ai_reply, llm_ms = await atimed_call(agenerate_ai_reply, prompt)
+        except Exception as e:
+            user_task.cancel()
+            user_task.add_done_callback(lambda _task: user_audio.discard())
+            raise ReplyGenerationError(str(e)) from e
+
+        try:
+            _, ai_tts_ms = await atimed_call(
+                agenerate_audio_with_fallback, ai_reply, ai_voice_id, ai_audio.path
+            )
+            _, user_tts_ms = await user_task
+        except Exception:
+            user_task.cancel()
+            user_task.add_done_callback(lambda _task: user_audio.discard())
+            ai_audio.discard()
+            raise
+        timings = {
+            "llm_ms": llm_ms,
+            "user_tts_ms": user_tts_ms,
+            "ai_tts_ms": ai_tts_ms,
+            "total_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        return await sync_to_async(save_speak)(
+            user,
+            params,
+            ai_reply,
+            [
+                (SenderTypeChoices.USER, user_text, user_audio),
+                (SenderTypeChoices.AI, ai_reply, ai_audio),
+            ],
+            timings,
+        )
+
+    (sender_type, text, voice_id), ai_reply = manual_speak_turn(
+        params, user_voice_id, ai_voice_id
+    )
+    audio = user_audio if sender_type == SenderTypeChoices.USER else ai_audio
+    try:
+        await agenerate_audio_with_fallback(text, voice_id, audio.path)
+    except Exception:
+        audio.discard()
+        raise
+    return await sync_to_async(save_speak)(
+        user, params, ai_reply, [(sender_type, text, audio)]
+    )
+
+
+def conversation_turns(conversation_id, user):
+    """Active turns of one conversation in turn order, read from the (dialogue, turn_index) index."""
+    return GeneratedAudio.objects.filter(
+        dialogue__conversation_id=conversation_id,
+        dialogue__user=user,
+        status=StatusChoices.ACTIVE,
+    ).order_by("turn_index", "id")
+
+
+REPLAY_AUDIO_DIR = "audio/replay"
+
+
+def read_turn_frames(turn):
+    try:
+        with turn.audio.open("rb") as f:
+            audio_format, frames = mp3_frames(f.read())
+    except OSError:
+        raise ReplayStitchError(f"Audio for turn {turn.turn_index} is missing.")
+    if audio_format is None:
+        raise ReplayStitchError(f"Audio for turn {turn.turn_index} is not an MP3.")
+    return audio_format, frames
+
+
+def resample_frames(turn, frames, stitch_format, workdir, transcoder):
+    """Re-encode one turn's frames to the conversation's sample rate and channels."""
+    _version, sample_rate, channels = stitch_format
+    source = os.path.join(workdir, "resample-source.mp3")
+    target = os.path.join(workdir, "resample-target.mp3")
+    write_file(source, frames)
+    try:
+        transcoder.resample(source, target, sample_rate, channels)
+        with open(target, "rb") as f:
+            audio_format, frames = mp3_frames(f.read())
+    except (TranscodeError, OSError) as e:
+        raise ReplayStitchError(
+            f"Audio for turn {turn.turn_index} could not be re-encoded: {e}"
+        )
+    if audio_format != stitch_format:
+        raise ReplayStitchError(
+            f"Audio for turn {turn.turn_index} could not be re-encoded to "
+            f"{sample_rate} Hz/{channels}ch."
+        )
+    return frames
+
+
+def stitch_conversation_audio(turns, transcoder=None):
+    """
+    Concatenate the MP3 frames of ``turns`` into one file and return its
+    manifest: the audio path, total duration and a per-turn offset table. Turns
+    are joined without re-encoding; one whose sample rate or channel count
+    differs from the first turn's is re-encoded to match. Frames are streamed
+    to a scratch file one turn at a time. Results are cached in media storage
+    under ``REPLAY_AUDIO_DIR`` by a hash of the turn set, so a conversation is
+    only re-stitched after its turns change.
+    """
+    key = hashlib.sha256(
+        json.dumps([[str(turn.uid), turn.audio.name] for turn in turns]).encode()
+    ).hexdigest()
+    audio_name = sharded_name(REPLAY_AUDIO_DIR, f"{key}.mp3")
+    manifest_name = sharded_name(REPLAY_AUDIO_DIR, f"{key}.json")
+
+    try:
+        with default_storage.open(manifest_name, "rb") as f:
+            manifest = json.load(f)
+        # The retention sweep may have dropped the audio before the manifest.
+        if default_storage.exists(manifest["audio"]):
+            return manifest
+    except (OSError, ValueError):
+        pass
+
+    offsets = []
+    position = 0.0
+    for turn in turns:
+        duration = turn.duration
+        if duration is None:
+            duration = stored_audio_metadata(turn.audio.name)[0] or 0.0
+        offsets.append(
+            {
+                "turn_index": turn.turn_index,
+                "uid": str(turn.uid),
+                "sender_type": turn.sender_type,
+                "text": turn.text,
+                "start": round(position, 3),
+                "end": round(position + duration, 3),
+            }
+        )
+        position += duration
+
+    # The manifest is the cache marker, so it is only written once the audio exists.
+    # Concurrent stitches of the same turns produce identical bytes.
+    if not default_storage.exists(audio_name):
+        os.makedirs(settings.MEDIA_SCRATCH_DIR, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=settings.MEDIA_SCRATCH_DIR) as workdir:
+            stitched = os.path.join(workdir, "replay.mp3")
+            stitch_format = None
+            with open(stitched, "wb") as output:
+                for turn in turns:
+                    audio_format, frames = read_turn_frames(turn)
+                    if stitch_format is None:
+                        stitch_format = audio_format
+                    elif audio_format != stitch_format:
+                        transcoder = transcoder or get_transcoder()
+                        frames = resample_frames(
+                            turn, frames, stitch_format, workdir, transcoder
+                        )
+                    output.write(frames)
+            audio_name = publish_file(stitched, audio_name)
+
+    manifest = {
+        "audio": audio_name,
+        "duration": round(position, 3),
+        "turns": offsets,
+    }
+    default_storage.delete(manifest_name)
+    default_storage.save(manifest_name, ContentFile(json.dumps(manifest).encode()))
+    return manifest
+
+
+def resolve_voice_ids(turns):
+    """Map ``(voice_name, side)`` to the newest avatar's ElevenLabs voice id in one query."""
+    voice_names = {turn["voice_name"] for turn in turns}
+    voice_ids = {}
+    avatars = Avatar.objects.filter(voice_name__in=voice_names).order_by("created_at")
+    for voice_name, side, voice_id in avatars.values_list(
+        "voice_name", "side", "elevenlabs_voice_id"
+    ):
+        voice_ids[(voice_name, side)] = voice_id
+    return voice_ids
+
+
+def run_speak_batch(user, turns, conversation_id, concurrency):
+    """
+    Synthesize an ordered list of turns with at most ``concurrency`` TTS calls in
+    flight. A failing turn is reported in its own result entry and does not stop
+    the others; rows for the successful turns are appended to the conversation
+    in one transaction.
+    """
+    voice_ids = resolve_voice_ids(turns)
+    batch_id = uuid.uuid4().hex
+    results = []
+    jobs = []
+
+    for index, turn in enumerate(turns):
+        sender_type = turn["sender_type"]
+        text = turn["text"]
+        if sender_type == SenderTypeChoices.AI:
+            text = clean_text(text)
+        result = {
+            "index": index,
+            "sender_type": sender_type,
+            "voice_name": turn["voice_name"],
+            "text": text,
+        }
+        results.append(result)
+
+        voice_id = voice_ids.get((turn["voice_name"], sender_type))
+        if voice_id is None:
+            result["error"] = (
+                f"No {sender_type} avatar with voice name '{turn['voice_name']}'."
+            )
+            continue
+
+        audio = PendingAudio(sender_type.lower(), f"{batch_id}_{index}")
+        jobs.append((result, text, voice_id, audio))
+
+    def synthesize(job):
+        result, text, voice_id, audio = job
+        try:
+            generate_audio_with_fallback(text, voice_id, audio.path)
+            result["audio"] = audio.publish()
+        except Exception as e:
+            audio.discard()
+            result["error"] = str(e)
+
+    concurrency = max(1, min(concurrency, settings.BATCH_SPEAK_MAX_CONCURRENCY))
+    with ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="batch"
+    ) as pool:
+        list(pool.map(synthesize, jobs))
+
+    synthesized = [result for result in results if "audio" in result]
+    gen_audios = [
+        GeneratedAudio(
+            text=result["text"],
+            audio=result["audio"],
+            sender_type=result["sender_type"],
+            conversation_id=conversation_id,
+            user=user,
+        )
+        for result in synthesized
+    ]
+    if gen_audios:
+        Conversation.objects.add_turns(conversation_id, user, gen_audios)
+
+    for result, gen_audio in zip(synthesized, gen_audios):
+        result["uid"] = str(gen_audio.uid)
+    return results
+
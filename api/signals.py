@@ -1,10 +1,15 @@
-# from django.db.models.signals import post_save, post_delete
-# from django.dispatch import receiver
-# from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
-# from .models import Avatar
+from .lookups import bump_version
+from .models import Avatar, Mood
 
 
-# @receiver([post_save, post_delete], sender=Avatar)
-# def invalid_product_cache(sender, instance, **kwargs):
-#     cache.delete_pattern("*avatar_list_cache*")
+@receiver([post_save, post_delete], sender=Avatar)
+def invalidate_avatar_cache(sender, instance, **kwargs):
+    bump_version("avatar")
+
+
+@receiver([post_save, post_delete], sender=Mood)
+def invalidate_mood_cache(sender, instance, **kwargs):
+    bump_version("mood")
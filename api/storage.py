@@ -0,0 +1,97 @@
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+
+# Media names are sharded two levels deep by a hash of the file name
+# (``audio/3f/a9/ai_<id>.mp3``) so no directory grows past a few thousand
+# entries. Synthesis writes to local scratch space first; finished files are
+# published through ``default_storage`` (see STORAGES in settings), which may
+# be a shared backend when several app nodes serve the same media.
+
+
+def sharded_name(directory, filename):
+    digest = hashlib.sha1(filename.encode()).hexdigest()
+    return f"{directory}/{digest[:2]}/{digest[2:4]}/{filename}"
+
+
+def is_sharded(name):
+    parts = name.split("/")
+    return len(parts) >= 4 and sharded_name("/".join(parts[:-3]), parts[-1]) == name
+
+
+def is_local_storage(storage=default_storage):
+    return isinstance(storage, FileSystemStorage)
+
+
+def publish_file(local_path, name, storage=default_storage):
+    """
+    Move a finished local file into media storage and return its stored name.
+    On local storage the file appears under ``name`` in a single rename, so a
+    concurrent reader sees either nothing or the whole file.
+    """
+    if is_local_storage(storage):
+        target = storage.path(name)
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        try:
+            os.replace(local_path, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # Scratch space is on another filesystem: copy next to the target
+            # first, then rename within the target's filesystem.
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".publish-")
+            try:
+                with os.fdopen(fd, "wb") as temp, open(local_path, "rb") as source:
+                    shutil.copyfileobj(source, temp)
+                shutil.copymode(local_path, temp_path)
+                os.replace(temp_path, target)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            os.remove(local_path)
+        return name
+
+    with open(local_path, "rb") as f:
+        stored = storage.save(name, File(f, name=os.path.basename(name)))
+    os.remove(local_path)
+    return stored
+
+
+def move_file(old_name, new_name, storage=default_storage):
+    """Rename a stored file; returns the new stored name."""
+    if is_local_storage(storage):
+        target = storage.path(new_name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(storage.path(old_name), target)
+        return new_name
+
+    with storage.open(old_name, "rb") as f:
+        stored = storage.save(new_name, f)
+    storage.delete(old_name)
+    return stored
+
+
+class PendingAudio:
+    """A synthesized MP3: written to ``path`` in scratch space, then published as ``name``."""
+
+    def __init__(self, prefix, token):
+        filename = f"{prefix}_{token}.mp3"
+        self.name = sharded_name("audio", filename)
+        os.makedirs(settings.MEDIA_SCRATCH_DIR, exist_ok=True)
+        self.path = os.path.join(settings.MEDIA_SCRATCH_DIR, filename)
+
+    def publish(self):
+        self.name = publish_file(self.path, self.name)
+        return self.name
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,3 +1,2509 @@
-from django.test import TestCase
+import asyncio
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import SystemCheckError
+from django.db import connection
+from django.db.models import Q
+from django.test import (
+    AsyncClient,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .checks import check_throttle_cache_alias, check_throttle_cache_shared
+from .choices import JobKindChoices, JobStateChoices, SenderTypeChoices, StatusChoices
+from .health import CircuitBreaker
+from .jobs import JOB_HANDLERS, enqueue_job, process_job, run_speak_job
+from .lookups import get_mood_prompt, get_voice_id
+from .models import (
+    AudioVariant,
+    Avatar,
+    AvatarUpload,
+    ChatHistory,
+    Conversation,
+    GeneratedAudio,
+    Mood,
+    SynthesisJob,
+    User,
+)
+from .pagination import EstimatedCountPaginator
+from .providers import get_async_elevenlabs_client, get_elevenlabs_client, pool_stats
+from .services import conversation_turns
+from .storage import (
+    PendingAudio,
+    is_local_storage,
+    is_sharded,
+    publish_file,
+    sharded_name,
+)
+from .throttling import charge_request
+from .tts_cache import TTSCache
+from .utils import (
+    ElevenLabsError,
+    agenerate_audio_with_fallback,
+    generate_audio_with_fallback,
+    mp3_frames,
+    stream_audio_with_fallback,
+)
+
+
+# MPEG version byte, bitrate index and sample rate index of the test frames.
+MP3_TEST_FORMATS = {
+    44100: (0xFB, 9, 0),
+    48000: (0xFB, 9, 1),
+    22050: (0xF3, 8, 0),
+    24000: (0xF3, 8, 1),
+}
+
+
+def mp3_bytes(frames=40, sample_rate=44100, channels=2, vbr_header=False):
+    """
+    Silent Layer III frames (128 kbit/s MPEG-1 or 64 kbit/s MPEG-2), optionally
+    led by a Xing frame the way encoders write one.
+    """
+    version, bitrate_index, rate_index = MP3_TEST_FORMATS[sample_rate]
+    mpeg1 = version == 0xFB
+    length = (144 * 128000 if mpeg1 else 72 * 64000) // sample_rate
+    header = bytes(
+        [0xFF, version, bitrate_index << 4 | rate_index << 2, 0 if channels == 2 else 0xC0]
+    )
+    data = (header + bytes(length - 4)) * frames
+    if vbr_header:
+        side_info = (32 if channels == 2 else 17) if mpeg1 else (17 if channels == 2 else 9)
+        data = header + bytes(side_info) + b"Xing" + bytes(length - 8 - side_info) + data
+    return data
+
+
+def wait_for(condition, timeout=5):
+    """Poll ``condition`` until it holds; work handed to executors finishes asynchronously."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time.")
+        time.sleep(0.01)
+
+
+class LocalObjectStorage(Storage):
+    """
+    A remote-style storage backend kept on local disk: callers only get the
+    generic Storage API, never a filesystem path, as with S3 or GCS.
+    """
+
+    def __init__(self, location=None):
+        self.backend = FileSystemStorage(location=location)
+
+    def _open(self, name, mode="rb"):
+        return self.backend.open(name, mode)
+
+    def _save(self, name, content):
+        return self.backend.save(name, content)
+
+    def delete(self, name):
+        self.backend.delete(name)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def url(self, name):
+        return f"https://media.example.com/{name}"
+
+
+class TempMediaMixin:
+    """Media storage, scratch space and uploads in a throwaway local directory."""
+
+    media_settings = {}
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            MEDIA_SCRATCH_DIR=os.path.join(self.media_root, "scratch"),
+            AVATAR_UPLOAD_DIR=os.path.join(self.media_root, "uploads"),
+            TTS_CACHE_DIR=os.path.join(self.media_root, "tts_cache"),
+            **self.media_settings,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def patch(self, target, new):
+        patcher = mock.patch(target, new)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def scratch_files(self):
+        try:
+            return os.listdir(settings.MEDIA_SCRATCH_DIR)
+        except FileNotFoundError:
+            return []
+
+
+class SpeakTestMixin(TempMediaMixin):
+    """A user with avatars and a mood, and stubbed LLM and TTS upstreams."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="speaker@example.com", password="secret", username="speaker"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for side, name in (
+            (SenderTypeChoices.USER, "user-voice"),
+            (SenderTypeChoices.AI, "ai-voice"),
+        ):
+            Avatar.objects.create(
+                side=side,
+                avatar_name=name,
+                voice_name=name,
+                elevenlabs_voice_id=name,
+                video=f"video/{name}.mp4",
+            )
+        Mood.objects.create(mood_name="friendly", mood_prompt="Be friendly.")
+        self.synthesized = []
+        self.patch("api.services.generate_audio_with_fallback", self.fake_tts)
+        self.patch("api.services.generate_ai_reply", lambda prompt: "Pretty good.")
+
+    def fake_tts(self, text, voice_id, filename):
+        self.synthesized.append((text, voice_id))
+        with open(filename, "wb") as f:
+            f.write(mp3_bytes())
+
+    def speak_payload(self, **overrides):
+        return {
+            "text": "How was your day?",
+            "user_voice_name": "user-voice",
+            "ai_voice_name": "ai-voice",
+            "reply_as": SenderTypeChoices.AI,
+            "sender_type": SenderTypeChoices.USER,
+            **overrides,
+        }
+
+    def speak(self, **overrides):
+        return self.client.post("/api/speak", self.speak_payload(**overrides), format="json")
+
+
+class NestedUserQueryCountTests(TestCase):
+    """List and detail endpoints must not issue one user query per row."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="owner@example.com", password="secret", username="owner"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_avatars(self, count):
+        return Avatar.objects.bulk_create(
+            Avatar(
+                side=SenderTypeChoices.AI,
+                avatar_name=f"avatar-{index}",
+                voice_name=f"voice-{index}",
+                elevenlabs_voice_id=f"voice-{index}",
+                video=f"video/ai/{index}.mp4",
+                user=self.user,
+            )
+            for index in range(count)
+        )
+
+    def make_moods(self, count):
+        return Mood.objects.bulk_create(
+            Mood(mood_name=f"mood-{index}", mood_prompt="Be kind.", user=self.user)
+            for index in range(count)
+        )
+
+    def make_chat_histories(self, count):
+        # Titles are unique, so number them after the rows that already exist.
+        start = ChatHistory.objects.count()
+        return ChatHistory.objects.bulk_create(
+            ChatHistory(
+                title=f"chat-{index}",
+                conversation_id=f"conversation-{index}",
+                chat=[],
+                user=self.user,
+            )
+            for index in range(start, start + count)
+        )
+
+    def count_queries(self, url):
+        # List responses are cached; every measurement must hit the database.
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries)
+
+    def assertConstantQueries(self, url, make_rows):
+        make_rows(2)
+        few = self.count_queries(url)
+        make_rows(20)
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_avatar_list(self):
+        self.assertConstantQueries("/api/avatar", self.make_avatars)
+
+    def test_mood_list(self):
+        self.assertConstantQueries("/api/moods", self.make_moods)
+
+    def test_chat_history_list(self):
+        self.assertConstantQueries("/api/chat-history", self.make_chat_histories)
+
+    def test_avatar_detail(self):
+        avatar = self.make_avatars(1)[0]
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/avatar/{avatar.uid}")
+        self.assertEqual(response.data["user"]["email"], self.user.email)
+
+    def test_mood_detail(self):
+        mood = self.make_moods(1)[0]
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/mood/{mood.uid}")
+        self.assertEqual(response.data["user"]["email"], self.user.email)
+
+    def test_generated_audio_detail(self):
+        gen_audio = GeneratedAudio.objects.create(
+            text="hello",
+            audio="audio/missing.mp3",
+            sender_type=SenderTypeChoices.USER,
+            user=self.user,
+        )
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/speak/{gen_audio.uid}")
+        self.assertEqual(response.data["user"]["email"], self.user.email)
+
+    def test_chat_history_detail(self):
+        chat_history = self.make_chat_histories(1)[0]
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/chat-history/{chat_history.uid}")
+        self.assertEqual(
+            response.data["chat_history"]["user"]["email"], self.user.email
+        )
+
+
+class HotQueryIndexTests(TestCase):
+    """The hot lookups must be answered from the composite/partial indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email="owner@example.com", password="secret", username="owner"
+        )
+        # Rows are spread over many owners so the per-user lookups are selective.
+        users = [cls.user] + User.objects.bulk_create(
+            User(email=f"user-{index}@example.com", username=f"user-{index}")
+            for index in range(49)
+        )
+        statuses = [StatusChoices.ACTIVE, StatusChoices.INACTIVE, StatusChoices.REMOVED]
+        conversations = Conversation.objects.bulk_create(
+            Conversation(
+                conversation_id=f"conversation-{index}", user=users[index % 50]
+            )
+            for index in range(200)
+        )
+        GeneratedAudio.objects.bulk_create(
+            GeneratedAudio(
+                text="hello",
+                audio=f"audio/{index}.mp3",
+                sender_type=SenderTypeChoices.USER,
+                conversation_id=f"conversation-{index % 200}",
+                dialogue=conversations[index % 200],
+                turn_index=index // 200,
+                status=statuses[index % 3],
+                user=users[index % 50],
+            )
+            for index in range(2000)
+        )
+        Avatar.objects.bulk_create(
+            Avatar(
+                side=[SenderTypeChoices.USER, SenderTypeChoices.AI][index % 2],
+                avatar_name=f"avatar-{index}",
+                voice_name=f"voice-{index % 100}",
+                elevenlabs_voice_id=f"voice-{index}",
+                video=f"video/{index}.mp4",
+                poster=f"video/{index}.jpg",
+                faststart_video=f"video/{index}-faststart.mp4",
+                status=statuses[index % 3],
+                user=users[index % 50] if index % 97 else None,
+            )
+            for index in range(1000)
+        )
+        Mood.objects.bulk_create(
+            Mood(
+                mood_name=f"mood-{index % 100}",
+                mood_prompt="Be kind.",
+                status=statuses[index % 3],
+                user=users[index % 50] if index % 97 else None,
+            )
+            for index in range(1000)
+        )
+        ChatHistory.objects.bulk_create(
+            ChatHistory(
+                title=f"chat-{index}",
+                conversation_id=f"conversation-{index}",
+                chat=[],
+                status=statuses[index % 3],
+                user=users[index % 50],
+            )
+            for index in range(1000)
+        )
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("ANALYZE")
+                # The seeded tables are still small enough for a sequential
+                # scan to win on cost; only the index choice is under test.
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            elif connection.vendor == "sqlite":
+                cursor.execute("ANALYZE")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        if connection.vendor == "postgresql":
+            self.assertRegex(plan, r"Index (Only )?Scan|Bitmap Index Scan")
+            self.assertNotIn(f"Seq Scan on {queryset.model._meta.db_table}", plan)
+        elif connection.vendor == "sqlite":
+            self.assertIn("USING INDEX", plan)
+
+    def test_conversation_turns(self):
+        self.assertUsesIndex(
+            conversation_turns("conversation-0", self.user), "genaudio_dialogue_turn"
+        )
+
+    def test_chat_history_removal(self):
+        # The turns a deleted chat history takes with it, whatever their status.
+        # Either index leading with dialogue_id (the foreign key's own or
+        # genaudio_dialogue_turn) serves it.
+        self.assertUsesIndex(
+            GeneratedAudio.objects.filter(
+                dialogue__conversation_id="conversation-0", dialogue__user=self.user
+            ).exclude(status=StatusChoices.REMOVED),
+            "dialogue",
+        )
+
+    def test_latest_avatar_for_voice(self):
+        self.assertUsesIndex(
+            Avatar.objects.filter(
+                voice_name="voice-7", side=SenderTypeChoices.AI
+            ).order_by("-created_at")[:1],
+            "avatar_voice_side_created",
+        )
+
+    def test_latest_active_mood(self):
+        self.assertUsesIndex(
+            Mood.objects.filter(
+                mood_name="mood-7", status=StatusChoices.ACTIVE
+            ).order_by("-created_at")[:1],
+            "mood_name_active",
+        )
+
+    def test_active_chat_histories(self):
+        self.assertUsesIndex(
+            ChatHistory.objects.IS_ACTIVE().filter(user=self.user).order_by("id"),
+            "chathistory_user_active",
+        )
+
+    def test_active_avatars(self):
+        self.assertUsesIndex(
+            Avatar.objects.IS_ACTIVE()
+            .filter(Q(user=self.user) | Q(user__isnull=True))
+            .order_by("id"),
+            "avatar_user_active",
+        )
+
+    def test_active_moods(self):
+        self.assertUsesIndex(
+            Mood.objects.IS_ACTIVE()
+            .filter(Q(user=self.user) | Q(user__isnull=True))
+            .order_by("id"),
+            "mood_user_active",
+        )
+
+    def test_media_permission_lookups(self):
+        self.assertUsesIndex(
+            GeneratedAudio.objects.filter(audio="audio/7.mp3", user=self.user),
+            "genaudio_audio",
+        )
+        path = "video/7.mp4"
+        plan = Avatar.objects.filter(
+            Q(video=path) | Q(poster=path) | Q(faststart_video=path)
+        ).explain()
+        for index_name in ("avatar_video", "avatar_poster", "avatar_faststart_video"):
+            self.assertIn(index_name, plan)
+
+    def test_sweep_reference_lookups(self):
+        names = [f"audio/{index}.mp3" for index in range(0, 100, 10)]
+        self.assertUsesIndex(
+            GeneratedAudio.objects.filter(audio__in=names), "genaudio_audio"
+        )
+        names = [f"video/{index}.mp4" for index in range(0, 100, 10)]
+        plan = Avatar.objects.filter(
+            Q(video__in=names) | Q(poster__in=names) | Q(faststart_video__in=names)
+        ).explain()
+        for index_name in ("avatar_video", "avatar_poster", "avatar_faststart_video"):
+            self.assertIn(index_name, plan)
+
+
+class AudioVariantTests(TempMediaMixin, TestCase):
+    """Variants are transcoded by the job queue and negotiated per request."""
+
+    media_settings = {"AUDIO_TRANSCODER": "api.transcoding.StubTranscoder"}
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email="listener@example.com", password="secret", username="listener"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        name = default_storage.save("audio/ai_turn.mp3", ContentFile(b"\xff" * 12800))
+        self.gen_audio = GeneratedAudio(
+            text="Hello",
+            audio=name,
+            sender_type=SenderTypeChoices.AI,
+            conversation_id="variants",
+            user=self.user,
+            duration=1.0,
+            size_bytes=12800,
+        )
+        Conversation.objects.add_turns("variants", self.user, [self.gen_audio])
+
+    def run_transcode_jobs(self):
+        while job := SynthesisJob.objects.claim(
+            "test", 60, kinds=[JobKindChoices.TRANSCODE]
+        ):
+            process_job(job)
+
+    def audio_for(self, accept=None):
+        headers = {"HTTP_X_AUDIO_ACCEPT": accept} if accept else {}
+        response = self.client.get(f"/api/speak/{self.gen_audio.uid}", **headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data["audio"]
+
+    def test_saving_a_turn_queues_transcoding(self):
+        job = SynthesisJob.objects.get(kind=JobKindChoices.TRANSCODE)
+        self.assertEqual(job.payload, {"audio_ids": [self.gen_audio.pk]})
+
+        self.run_transcode_jobs()
+        variants = {v.name: v for v in self.gen_audio.variants.all()}
+        self.assertEqual(set(variants), {"mp3-48k", "opus-24k"})
+        self.assertEqual(variants["opus-24k"].size_bytes, 12800 * 24 // 128)
+        self.assertTrue(default_storage.exists(variants["opus-24k"].file.name))
+
+    def test_smallest_accepted_variant_is_returned(self):
+        self.run_transcode_jobs()
+        self.assertTrue(self.audio_for().endswith("/audio/ai_turn.mp3"))
+        self.assertTrue(self.audio_for("audio/mpeg").endswith(".mp3-48k.mp3"))
+        self.assertTrue(self.audio_for("audio/*").endswith(".opus-24k.ogg"))
+        self.assertTrue(
+            self.audio_for("audio/ogg;q=0, audio/mpeg").endswith(".mp3-48k.mp3")
+        )
+        self.assertTrue(self.audio_for("video/mp4").endswith("/audio/ai_turn.mp3"))
+
+
+class AvatarProcessingTests(TempMediaMixin, TestCase):
+    """Avatar videos get a poster and fast-start rendition off the request path."""
+
+    media_settings = {"AVATAR_PROCESSOR": "api.avatar_processing.StubAvatarProcessor"}
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email="maker@example.com", password="secret", username="maker"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def run_avatar_jobs(self):
+        while job := SynthesisJob.objects.claim(
+            "test", 60, kinds=[JobKindChoices.PROCESS_AVATAR]
+        ):
+            process_job(job)
+
+    def test_derivatives_are_stored_next_to_the_video(self):
+        response = self.client.post(
+            "/api/avatar",
+            {
+                "side": SenderTypeChoices.AI,
+                "avatar_name": "Ava",
+                "voice_name": "ava",
+                "elevenlabs_voice_id": "voice",
+                "video": SimpleUploadedFile("ava.mp4", b"video-bytes"),
+            },
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertIsNone(response.data["poster"])
+
+        self.run_avatar_jobs()
+        avatar = Avatar.objects.get(uid=response.data["uid"])
+        directory = avatar.video.name.rsplit("/", 1)[0]
+        self.assertEqual(avatar.poster.name, f"{directory}/ava.poster.jpg")
+        self.assertEqual(avatar.faststart_video.name, f"{directory}/ava.faststart.mp4")
+        with avatar.faststart_video.open("rb") as f:
+            self.assertEqual(f.read(), b"video-bytes")
+
+        response = self.client.get(f"/api/avatar/{avatar.uid}")
+        self.assertTrue(response.data["poster"].endswith("/ava.poster.jpg"))
+
+    def test_replacing_the_video_reprocesses_it(self):
+        avatar = Avatar.objects.create(
+            side=SenderTypeChoices.AI,
+            avatar_name="Ava",
+            voice_name="ava",
+            elevenlabs_voice_id="voice",
+            video=SimpleUploadedFile("old.mp4", b"old"),
+            poster="video/ai/old.poster.jpg",
+            user=self.user,
+        )
+        response = self.client.patch(
+            f"/api/avatar/{avatar.uid}",
+            {"video": SimpleUploadedFile("new.mp4", b"new")},
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIsNone(response.data["poster"])
+
+        self.run_avatar_jobs()
+        avatar.refresh_from_db()
+        self.assertTrue(avatar.poster.name.endswith("/new.poster.jpg"))
+
+
+@override_settings(
+    THROTTLE_BUDGETS={
+        "default": "3/min",
+        "anon": "1/min",
+        "auth": "2/min",
+        "speak": "100/min",
+    }
+)
+class CostBudgetThrottleTests(TestCase):
+    """Requests are charged by estimated cost against per-scope budgets."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(
+            email="talker@example.com", password="secret", username="talker"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def speak(self, **overrides):
+        # Replying as the user with a written reply: 1 + 40 characters of text +
+        # 49 of reply = 90 units. The charge happens before validation, so an
+        # incomplete payload is enough.
+        payload = {"text": "x" * 40, "reply_text": "y" * 49, "reply_as": "USER"}
+        return self.client.post("/api/speak", {**payload, **overrides}, format="json")
+
+    def test_speak_is_charged_by_text_length(self):
+        response = self.speak()
+        self.assertNotEqual(response.status_code, 429)
+        self.assertEqual(response["X-RateLimit-Scope"], "speak")
+        self.assertEqual(response["X-RateLimit-Cost"], "90")
+        self.assertEqual(response["X-RateLimit-Remaining"], "10")
+
+        response = self.speak()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 0)
+
+    @override_settings(THROTTLE_REPLY_COST=30)
+    def test_generated_replies_are_priced_as_llm_calls(self):
+        # A reply_text sent along does not replace the price of generating one.
+        response = self.speak(reply_as=SenderTypeChoices.AI)
+        self.assertEqual(response["X-RateLimit-Cost"], "71")
+        cache.clear()
+        response = self.speak(reply_as=SenderTypeChoices.AI, reply_text="")
+        self.assertEqual(response["X-RateLimit-Cost"], "71")
+
+    def test_scopes_are_budgeted_separately(self):
+        self.speak()
+        for _ in range(3):
+            response = self.client.get("/api/moods")
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-RateLimit-Scope"], "default")
+        self.assertEqual(self.client.get("/api/moods").status_code, 429)
+
+    def test_anonymous_clients_share_the_anon_budget(self):
+        request = RequestFactory().get("/")
+        self.assertEqual(charge_request(request, None, "default", 1), (True, 0))
+        self.assertEqual(request.throttle_headers["X-RateLimit-Scope"], "anon")
+        self.assertFalse(charge_request(request, None, "speak", 1)[0])
+
+    def test_sign_in_has_its_own_anonymous_budget(self):
+        # Anonymous traffic elsewhere has used up the address's "anon" budget.
+        charge_request(RequestFactory().get("/"), None, "default", 1)
+
+        client = APIClient()
+        credentials = {"email": "a@example.com", "password": "x"}
+        for _ in range(2):
+            response = client.post("/api/login", credentials)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response["X-RateLimit-Scope"], "auth")
+        response = client.post("/api/token/", credentials)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["X-RateLimit-Scope"], "auth")
+
+
+class ThrottleCacheCheckTests(TestCase):
+    def test_per_process_cache_fails_only_the_deploy_check(self):
+        call_command("check", stdout=StringIO(), stderr=StringIO())
+        with self.assertRaisesMessage(SystemCheckError, "api.E001"):
+            call_command("check", "--deploy", stdout=StringIO(), stderr=StringIO())
+
+    def test_shared_cache_passes(self):
+        caches = {
+            **settings.CACHES,
+            "throttle": {"BACKEND": "django.core.cache.backends.redis.RedisCache"},
+        }
+        with override_settings(CACHES=caches, THROTTLE_CACHE="throttle"):
+            self.assertEqual(check_throttle_cache_shared(None), [])
+
+    def test_unknown_alias(self):
+        with override_settings(THROTTLE_CACHE="missing"):
+            errors = check_throttle_cache_alias(None)
+        self.assertEqual([error.id for error in errors], ["api.E002"])
+
+
+class SpeakExecutorTests(SpeakTestMixin, TestCase):
+    """User-side TTS runs while the LLM writes the reply."""
+
+    def test_user_audio_is_synthesized_during_the_llm_call(self):
+        user_tts_started = threading.Event()
+
+        def fake_tts(text, voice_id, filename):
+            if voice_id == "user-voice":
+                user_tts_started.set()
+            self.fake_tts(text, voice_id, filename)
+
+        def slow_reply(prompt):
+            # Only returns if the user-side synthesis started while it ran.
+            self.assertTrue(user_tts_started.wait(5))
+            self.assertIn("Be friendly.", prompt)
+            return "Pretty good."
+
+        self.patch("api.services.generate_audio_with_fallback", fake_tts)
+        self.patch("api.services.generate_ai_reply", slow_reply)
+
+        response = self.speak()
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data["reply"], "Pretty good.")
+        self.assertEqual(
+            set(response.data["timings"]), {"llm_ms", "user_tts_ms", "ai_tts_ms", "total_ms"}
+        )
+
+        turns = GeneratedAudio.objects.filter(user=self.user).order_by("turn_index")
+        self.assertEqual(
+            [(turn.sender_type, turn.text) for turn in turns],
+            [
+                (SenderTypeChoices.USER, "How was your day?"),
+                (SenderTypeChoices.AI, "Pretty good."),
+            ],
+        )
+        for turn in turns:
+            self.assertTrue(default_storage.exists(turn.audio.name))
+        self.assertEqual(self.scratch_files(), [])
+
+    def test_llm_failure_discards_the_user_audio(self):
+        def failing_reply(prompt):
+            wait_for(lambda: self.synthesized)
+            raise RuntimeError("LLM down")
+
+        self.patch("api.services.generate_ai_reply", failing_reply)
+
+        response = self.speak()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.data["error"], "LLM down")
+        self.assertFalse(GeneratedAudio.objects.exists())
+        wait_for(lambda: not self.scratch_files())
+
+
+class TTSCacheTests(TempMediaMixin, TestCase):
+    """Content-addressed synthesis cache shared by the workers of a node."""
+
+    def setUp(self):
+        super().setUp()
+        self.tts_cache = TTSCache(settings.TTS_CACHE_DIR, max_bytes=10_000)
+        self.source = os.path.join(self.media_root, "source.mp3")
+        with open(self.source, "wb") as f:
+            f.write(b"a" * 1000)
+        self.target = os.path.join(self.media_root, "target.mp3")
+
+    def key(self, text):
+        return TTSCache.make_key(text, "voice", "model", {"stability": 0.5})
+
+    def test_key_normalizes_whitespace(self):
+        self.assertEqual(self.key("Hello   there "), self.key("Hello there"))
+        self.assertNotEqual(self.key("Hello there"), self.key("Hello there!"))
+
+    def test_lookups_are_counted_without_taking_the_lock(self):
+        key = self.key("hello")
+        with mock.patch.object(TTSCache, "_locked", side_effect=AssertionError):
+            self.assertFalse(self.tts_cache.fetch(key, self.target))
+        self.tts_cache.store(key, self.source)
+        with mock.patch.object(TTSCache, "_locked", side_effect=AssertionError):
+            self.assertTrue(self.tts_cache.fetch(key, self.target))
+            self.assertTrue(self.tts_cache.fetch(key, self.target))
+        with open(self.target, "rb") as f:
+            self.assertEqual(f.read(), b"a" * 1000)
+
+        stats = self.tts_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 1))
+        self.assertEqual(stats["hit_rate"], 0.6667)
+
+    def test_counts_are_flushed_every_n_lookups(self):
+        other = TTSCache(settings.TTS_CACHE_DIR, max_bytes=10_000)
+        with mock.patch.object(TTSCache, "STATS_FLUSH_EVERY", 3):
+            for _ in range(3):
+                self.tts_cache.fetch(self.key("missing"), self.target)
+        # Another process sees the flushed counts.
+        self.assertEqual(other.stats()["misses"], 3)
+
+    def test_concurrent_stores_of_one_key_count_its_bytes_once(self):
+        key = self.key("hello")
+        barrier = threading.Barrier(8)
+
+        def store():
+            barrier.wait()
+            self.tts_cache.store(key, self.source)
+
+        threads = [threading.Thread(target=store) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.tts_cache.stats()["bytes"], 1000)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        keys = [self.key(f"line {index}") for index in range(9)]
+        for age, key in enumerate(keys):
+            self.tts_cache.store(key, self.source)
+            # Oldest first; the first entry is then read and becomes the newest.
+            os.utime(self.tts_cache.entry_path(key), (1000 + age, 1000 + age))
+        self.tts_cache.fetch(keys[0], self.target)
+
+        for key in ("line 9", "line 10"):
+            self.tts_cache.store(self.key(key), self.source)
+
+        stats = self.tts_cache.stats()
+        self.assertEqual(stats["bytes"], 9000)
+        self.assertEqual(stats["evictions"], 2)
+        self.assertTrue(os.path.exists(self.tts_cache.entry_path(keys[0])))
+        self.assertFalse(os.path.exists(self.tts_cache.entry_path(keys[1])))
+        self.assertFalse(os.path.exists(self.tts_cache.entry_path(keys[2])))
+
+    def test_eviction_is_skipped_while_another_process_evicts(self):
+        with self.tts_cache._locked(TTSCache.EVICT_LOCK_FILE):
+            # flock is per open file description, so a second open contends.
+            self.assertEqual(self.tts_cache.evict(), 0)
+
+
+class StreamedSpeakTests(SpeakTestMixin, TestCase):
+    """stream=audio sends the MP3 as it is synthesized; rows follow the audio."""
+
+    def setUp(self):
+        super().setUp()
+        self.patch("api.views.generate_audio_with_fallback", self.fake_tts)
+        self.patch("api.views.generate_ai_reply", lambda prompt: "Pretty good.")
+
+    def fake_stream(self, text, voice_id, filename, chunk_size=8192):
+        data = mp3_bytes()
+        with open(filename, "wb") as f:
+            f.write(data)
+        return iter([data[:1000], data[1000:]])
+
+    def test_audio_is_streamed_and_turns_published(self):
+        self.patch("api.views.stream_audio_with_fallback", self.fake_stream)
+        response = self.client.post(
+            "/api/speak",
+            self.speak_payload(stream="audio"),
+            format="json",
+            HTTP_ORIGIN="https://app.example.com",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "audio/mpeg")
+        exposed = response["Access-Control-Expose-Headers"]
+        for header in ("X-Audio", "X-Audio-Uid", "X-Reply", "X-User-Audio"):
+            self.assertIn(header, exposed)
+        self.assertEqual(response["X-Reply"], "Pretty%20good.")
+
+        # Rows exist, hidden, while the body is still streaming.
+        turns = GeneratedAudio.objects.filter(user=self.user).order_by("turn_index")
+        self.assertEqual(
+            [turn.status for turn in turns], [StatusChoices.INACTIVE] * 2
+        )
+
+        self.assertEqual(b"".join(response.streaming_content), mp3_bytes())
+        turns = turns.all()
+        self.assertEqual([turn.status for turn in turns], [StatusChoices.ACTIVE] * 2)
+        ai_turn = turns.get(uid=response["X-Audio-Uid"])
+        self.assertEqual(ai_turn.audio.name, response["X-Audio"])
+        self.assertEqual(ai_turn.size_bytes, len(mp3_bytes()))
+        self.assertTrue(default_storage.exists(response["X-User-Audio"]))
+        self.assertEqual(self.scratch_files(), [])
+
+    def test_failed_stream_removes_the_turns(self):
+        def failing_stream(text, voice_id, filename, chunk_size=8192):
+            open(filename, "wb").close()
+            yield b"partial"
+            raise RuntimeError("upstream closed")
+
+        self.patch("api.views.stream_audio_with_fallback", failing_stream)
+        response = self.client.post(
+            "/api/speak", self.speak_payload(stream="audio"), format="json"
+        )
+        with self.assertRaises(RuntimeError):
+            b"".join(response.streaming_content)
+
+        self.assertEqual(
+            set(GeneratedAudio.objects.values_list("status", flat=True)),
+            {StatusChoices.REMOVED},
+        )
+        self.assertFalse(default_storage.exists(response["X-Audio"]))
+        wait_for(lambda: not self.scratch_files())
+
+
+class SentenceStreamTests(SpeakTestMixin, TestCase):
+    """stream=sentences pipelines LLM sentences into TTS and reports them over SSE."""
+
+    def setUp(self):
+        super().setUp()
+        self.patch("api.views.generate_audio_with_fallback", self.fake_segment_tts)
+
+    def fake_segment_tts(self, text, voice_id, filename):
+        # Real encoders lead every file with a Xing/Info frame.
+        with open(filename, "wb") as f:
+            f.write(mp3_bytes(frames=10, vbr_header=True))
+
+    def stream(self, deltas):
+        self.patch("api.views.generate_ai_reply_stream", lambda prompt: iter(deltas))
+        response = self.client.post(
+            "/api/speak", self.speak_payload(stream="sentences"), format="json"
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = []
+        for block in b"".join(response.streaming_content).decode().split("\n\n"):
+            if block:
+                event, data = block.split("\n")
+                events.append((event[len("event: ") :], json.loads(data[len("data: ") :])))
+        return events
+
+    def test_segments_are_merged_without_their_vbr_headers(self):
+        events = self.stream(["Hello there. How", " are you? Fine", "."])
+        self.assertEqual(
+            [(event, data.get("text")) for event, data in events],
+            [
+                ("segment", "Hello there."),
+                ("segment", "How are you?"),
+                ("segment", "Fine."),
+                ("done", None),
+            ],
+        )
+        done = events[-1][1]
+        self.assertEqual(done["reply"], "Hello there. How are you? Fine.")
+
+        with default_storage.open(done["ai_audio"], "rb") as f:
+            merged = f.read()
+        self.assertEqual(merged, mp3_bytes(frames=30))
+        ai_turn = GeneratedAudio.objects.get(audio=done["ai_audio"])
+        self.assertEqual(ai_turn.duration, round(30 * 1152 / 44100, 2))
+        self.assertEqual(self.scratch_files(), [])
+
+    def test_llm_failure_reports_an_error_and_cleans_up(self):
+        def failing_stream(prompt):
+            yield "Hello there. "
+            raise RuntimeError("LLM down")
+
+        self.patch("api.views.generate_ai_reply_stream", failing_stream)
+        response = self.client.post(
+            "/api/speak", self.speak_payload(stream="sentences"), format="json"
+        )
+        body = b"".join(response.streaming_content).decode()
+        self.assertIn('event: error\ndata: {"error": "LLM down"}', body)
+        self.assertFalse(GeneratedAudio.objects.exists())
+        wait_for(lambda: not self.scratch_files())
+
+
+class ElevenLabsClientTests(TempMediaMixin, TestCase):
+    media_settings = {"TTS_CACHE_ENABLED": False}
+
+    def setUp(self):
+        super().setUp()
+        self.breaker = CircuitBreaker(
+            "elevenlabs", failure_threshold=5, latency_threshold=10, reset_timeout=30
+        )
+        self.patch("api.utils.get_breaker", lambda name: self.breaker)
+        self.patch("api.utils.generate_gtts_audio", self.fake_gtts)
+        self.requests = []
+        self.status_code = 200
+
+    def fake_gtts(self, text, filename):
+        with open(filename, "wb") as f:
+            f.write(b"gtts")
+
+    def respond(self, url, headers, json, **kwargs):
+        self.requests.append((url, headers, json))
+        return SimpleNamespace(status_code=self.status_code, content=b"elevenlabs")
+
+    def synthesize_sync(self, filename):
+        client = SimpleNamespace(post=self.respond)
+        with mock.patch("api.utils.get_elevenlabs_client", lambda: client):
+            generate_audio_with_fallback("Hello.", "voice", filename)
+
+    def synthesize_async(self, filename):
+        async def post(url, headers, json):
+            return self.respond(url, headers, json)
+
+        client = SimpleNamespace(post=post)
+        with mock.patch("api.utils.get_async_elevenlabs_client", lambda: client):
+            asyncio.run(agenerate_audio_with_fallback("Hello.", "voice", filename))
+
+    def read(self, filename):
+        with open(filename, "rb") as f:
+            return f.read()
+
+    def test_sync_and_async_send_the_same_request(self):
+        sync_file = os.path.join(self.media_root, "sync.mp3")
+        async_file = os.path.join(self.media_root, "async.mp3")
+        self.synthesize_sync(sync_file)
+        self.synthesize_async(async_file)
+
+        self.assertEqual(self.requests[0], self.requests[1])
+        self.assertEqual(
+            self.requests[0][0], "https://api.elevenlabs.io/v1/text-to-speech/voice"
+        )
+        self.assertEqual(self.read(sync_file), b"elevenlabs")
+        self.assertEqual(self.read(async_file), b"elevenlabs")
+        self.assertEqual(self.breaker.snapshot()["calls"], 2)
+
+    def test_upstream_errors_fall_back_and_count_against_the_breaker(self):
+        self.status_code = 500
+        sync_file = os.path.join(self.media_root, "sync.mp3")
+        async_file = os.path.join(self.media_root, "async.mp3")
+        self.synthesize_sync(sync_file)
+        self.synthesize_async(async_file)
+
+        self.assertEqual(self.read(sync_file), b"gtts")
+        self.assertEqual(self.read(async_file), b"gtts")
+        self.assertEqual(self.breaker.snapshot()["failures"], 2)
+
+
+class AsyncSpeakTests(SpeakTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.patch("api.services.agenerate_audio_with_fallback", self.afake_tts)
+        self.patch("api.services.agenerate_ai_reply", self.afake_reply)
+        token = RefreshToken.for_user(self.user).access_token
+        self.auth_headers = {"Authorization": f"Bearer {token}"}
+
+    async def afake_tts(self, text, voice_id, filename):
+        self.fake_tts(text, voice_id, filename)
+
+    async def afake_reply(self, prompt):
+        return "Pretty good."
+
+    def aspeak(self, **overrides):
+        return async_to_sync(AsyncClient().post)(
+            "/api/speak/async",
+            self.speak_payload(**overrides),
+            content_type="application/json",
+            headers=self.auth_headers,
+        )
+
+    def test_async_view_matches_the_sync_view(self):
+        sync_body = self.speak(conversation_id="sync").json()
+        async_response = self.aspeak(conversation_id="async")
+        self.assertEqual(async_response.status_code, 201)
+        async_body = async_response.json()
+
+        self.assertEqual(list(async_body), list(sync_body))
+        self.assertEqual(list(async_body["timings"]), list(sync_body["timings"]))
+        for conversation_id in ("sync", "async"):
+            self.assertEqual(
+                list(
+                    GeneratedAudio.objects.filter(
+                        dialogue__conversation_id=conversation_id
+                    )
+                    .order_by("turn_index")
+                    .values_list("sender_type", "text")
+                ),
+                [
+                    (SenderTypeChoices.USER, "How was your day?"),
+                    (SenderTypeChoices.AI, "Pretty good."),
+                ],
+            )
+
+    def test_manual_turn_is_validated_like_the_sync_view(self):
+        response = self.aspeak(reply_as=SenderTypeChoices.USER)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), ["User must provide a reply text"])
+
+        response = self.aspeak(
+            reply_as=SenderTypeChoices.USER,
+            sender_type=SenderTypeChoices.AI,
+            reply_text="Fine, thanks!",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(set(response.json()), {"reply", "ai_audio", "conversation_id"})
+        self.assertEqual(self.synthesized, [("Fine, thanks!", "ai-voice")])
+
+    def test_llm_failure_discards_the_user_audio(self):
+        async def failing_reply(prompt):
+            raise RuntimeError("LLM down")
+
+        self.patch("api.services.agenerate_ai_reply", failing_reply)
+        response = self.aspeak()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {"error": "LLM down"})
+        self.assertFalse(GeneratedAudio.objects.exists())
+        wait_for(lambda: not self.scratch_files())
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ProviderPoolTests(TestCase):
+    def setUp(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = f"http://127.0.0.1:{server.server_address[1]}/"
+        for registry in ("_clients", "_transports"):
+            patcher = mock.patch.dict(f"api.providers.{registry}", clear=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_sync_client_reuses_its_connection(self):
+        client = get_elevenlabs_client()
+        self.addCleanup(client.close)
+        for _ in range(3):
+            self.assertEqual(client.get(self.url).content, b"ok")
+
+        stats = pool_stats()["elevenlabs"]
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["connections_opened"], 1)
+        self.assertEqual(stats["handshakes_avoided"], 2)
+        self.assertEqual(
+            (stats["open_connections"], stats["in_use"], stats["idle"]), (1, 0, 1)
+        )
+
+    def test_streamed_responses_are_in_use_until_closed(self):
+        client = get_elevenlabs_client()
+        self.addCleanup(client.close)
+        with client.stream("GET", self.url) as first:
+            with client.stream("GET", self.url) as second:
+                stats = pool_stats()["elevenlabs"]
+                self.assertEqual(stats["in_flight"], 2)
+                self.assertEqual(
+                    (stats["open_connections"], stats["in_use"], stats["idle"]),
+                    (2, 2, 0),
+                )
+                # Fully read bodies hand their connections back for reuse.
+                first.read()
+                second.read()
+        stats = pool_stats()["elevenlabs"]
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual(
+            (stats["open_connections"], stats["in_use"], stats["idle"]), (2, 0, 2)
+        )
+
+        client.close()
+        stats = pool_stats()["elevenlabs"]
+        self.assertEqual((stats["open_connections"], stats["idle"]), (0, 0))
+
+    def test_async_client_reuses_its_connection(self):
+        async def fetch():
+            client = get_async_elevenlabs_client()
+            for _ in range(3):
+                await client.get(self.url)
+            stats = pool_stats()["elevenlabs_async"]
+            await client.aclose()
+            return stats
+
+        stats = asyncio.run(fetch())
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["connections_opened"], 1)
+        self.assertEqual(
+            (stats["open_connections"], stats["in_use"], stats["idle"]), (1, 0, 1)
+        )
+
+
+@override_settings(JOB_RETRY_BACKOFF=10, AUDIO_VARIANTS_ENABLED=False)
+class SynthesisJobQueueTests(SpeakTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.replies = 0
+        self.patch("api.services.generate_ai_reply", self.counting_reply)
+
+    def counting_reply(self, prompt):
+        self.replies += 1
+        return "Pretty good."
+
+    def enqueue(self):
+        return enqueue_job(
+            JobKindChoices.SPEAK,
+            {**self.speak_payload(), "mode": "friendly", "conversation_id": "job"},
+            user=self.user,
+        )
+
+    def claim(self, worker="worker-a"):
+        return SynthesisJob.objects.claim(worker, visibility_timeout=60)
+
+    def expire_lease(self, job):
+        SynthesisJob.objects.filter(pk=job.pk).update(
+            locked_until=timezone.now() - timedelta(seconds=1)
+        )
+
+    def fail_with(self, error):
+        def failing(job):
+            raise error
+
+        return mock.patch.dict(JOB_HANDLERS, {JobKindChoices.SPEAK: failing})
+
+    def test_failures_are_retried_with_exponential_backoff(self):
+        job = self.enqueue()
+        with self.fail_with(RuntimeError("TTS down")):
+            for attempt, backoff in ((1, 10), (2, 20)):
+                before = timezone.now()
+                process_job(self.claim())
+                job.refresh_from_db()
+                self.assertEqual(job.state, JobStateChoices.PENDING)
+                self.assertEqual(job.attempts, attempt)
+                self.assertEqual(job.error, "TTS down")
+                delay = (job.run_after - before).total_seconds()
+                self.assertTrue(backoff <= delay < backoff + 5, delay)
+                SynthesisJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+
+            process_job(self.claim())
+        job.refresh_from_db()
+        self.assertEqual(job.state, JobStateChoices.FAILED)
+        self.assertEqual(job.attempts, 3)
+
+    def test_permanent_errors_are_not_retried(self):
+        job = self.enqueue()
+        with self.fail_with(serializers.ValidationError("bad input")):
+            process_job(self.claim())
+        job.refresh_from_db()
+        self.assertEqual(job.state, JobStateChoices.FAILED)
+        self.assertEqual(job.attempts, 1)
+
+    def test_expired_lease_is_reclaimed_and_the_old_worker_is_ignored(self):
+        job = self.enqueue()
+        stale = self.claim("worker-a")
+        self.expire_lease(stale)
+        reclaimed = self.claim("worker-b")
+        self.assertEqual(reclaimed.pk, job.pk)
+        self.assertEqual(reclaimed.attempts, 2)
+
+        self.assertEqual(process_job(stale), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.state, JobStateChoices.RUNNING)
+        self.assertEqual(job.locked_by, "worker-b")
+
+        self.assertEqual(process_job(reclaimed), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.state, JobStateChoices.SUCCEEDED)
+
+    def test_reclaimed_job_does_not_speak_twice(self):
+        job = self.enqueue()
+        # The first worker saves the turns, then dies before recording success.
+        crashed = self.claim("worker-a")
+        run_speak_job(crashed)
+        self.expire_lease(crashed)
+
+        process_job(self.claim("worker-b"))
+        job.refresh_from_db()
+        self.assertEqual(job.state, JobStateChoices.SUCCEEDED)
+        self.assertEqual(self.replies, 1)
+        self.assertEqual(GeneratedAudio.objects.count(), 2)
+        uids = GeneratedAudio.objects.values_list("uid", flat=True)
+        self.assertEqual(
+            sorted(job.result["audio_uids"]), sorted(str(uid) for uid in uids)
+        )
+
+    def test_concurrent_run_of_a_finished_job_discards_its_audio(self):
+        job = self.enqueue()
+        first = self.claim("worker-a")
+        self.expire_lease(first)
+        second = self.claim("worker-b")
+
+        # Both workers hold an in-memory job without a result.
+        result = run_speak_job(second)
+        self.assertEqual(run_speak_job(first), result)
+        self.assertEqual(GeneratedAudio.objects.count(), 2)
+        self.assertEqual(Conversation.objects.get(conversation_id="job").turn_count, 2)
+        self.assertEqual(self.scratch_files(), [])
+        job.refresh_from_db()
+        self.assertEqual(job.result, result)
+
+
+@override_settings(BATCH_SPEAK_MAX_CONCURRENCY=2, AUDIO_VARIANTS_ENABLED=False)
+class BatchSpeakTests(SpeakTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        self.patch("api.services.generate_audio_with_fallback", self.slow_tts)
+
+    def slow_tts(self, text, voice_id, filename):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            time.sleep(0.05)
+            if text == "boom":
+                raise RuntimeError("TTS down")
+            self.fake_tts(text, voice_id, filename)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def batch(self, turns, **data):
+        return self.client.post(
+            "/api/speak/batch",
+            {"conversation_id": "batch", "turns": turns, **data},
+            format="json",
+        )
+
+    def test_turns_are_saved_in_order_with_bounded_concurrency(self):
+        texts = [f"Line {index}." for index in range(6)]
+        turns = [
+            {"text": text, "sender_type": "USER", "voice_name": "user-voice"}
+            for text in texts
+        ]
+        response = self.batch(turns, concurrency=10)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["failed"], 0)
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(
+            list(
+                GeneratedAudio.objects.order_by("turn_index").values_list(
+                    "turn_index", "text"
+                )
+            ),
+            list(enumerate(texts)),
+        )
+
+    def test_failed_turns_are_reported_without_stopping_the_batch(self):
+        turns = [
+            {"text": "Hello.", "sender_type": "USER", "voice_name": "user-voice"},
+            {"text": "boom", "sender_type": "AI", "voice_name": "ai-voice"},
+            {"text": "Who?", "sender_type": "AI", "voice_name": "nobody"},
+            {"text": "Bye.", "sender_type": "USER", "voice_name": "user-voice"},
+        ]
+        response = self.batch(turns)
+
+        self.assertEqual(response.status_code, 207)
+        body = response.json()
+        self.assertEqual(body["failed"], 2)
+        self.assertEqual(
+            [("error" in result, "uid" in result) for result in body["results"]],
+            [(False, True), (True, False), (True, False), (False, True)],
+        )
+        self.assertEqual(body["results"][1]["error"], "TTS down")
+        self.assertEqual(
+            list(
+                GeneratedAudio.objects.order_by("turn_index").values_list(
+                    "turn_index", "text"
+                )
+            ),
+            [(0, "Hello."), (1, "Bye.")],
+        )
+        self.assertEqual(self.scratch_files(), [])
+
+
+class CircuitBreakerTests(TestCase):
+    def make_breaker(self, **overrides):
+        options = {"failure_threshold": 2, "latency_threshold": 1, "reset_timeout": 60}
+        return CircuitBreaker("test", **{**options, **overrides})
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = self.make_breaker()
+        breaker.record_failure("boom")
+        breaker.record_success(0.1)
+        breaker.record_failure("boom")
+        self.assertTrue(breaker.allow_request())
+
+        breaker.record_failure("boom again")
+        self.assertFalse(breaker.allow_request())
+        snapshot = breaker.snapshot()
+        self.assertEqual(snapshot["state"], CircuitBreaker.OPEN)
+        self.assertEqual(snapshot["last_trip_reason"], "boom again")
+        self.assertEqual(snapshot["short_circuited"], 1)
+
+    def test_slow_calls_count_as_failures(self):
+        breaker = self.make_breaker()
+        breaker.record_success(2)
+        breaker.record_success(3)
+        snapshot = breaker.snapshot()
+        self.assertEqual(snapshot["state"], CircuitBreaker.OPEN)
+        self.assertEqual(snapshot["slow_calls"], 2)
+
+    def test_a_single_probe_is_let_through_after_the_reset_timeout(self):
+        breaker = self.make_breaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure("boom")
+        self.assertFalse(breaker.allow_request())
+        time.sleep(0.06)
+
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_failure("probe failed")
+        self.assertEqual(breaker.snapshot()["state"], CircuitBreaker.OPEN)
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success(0.1)
+        self.assertEqual(breaker.snapshot()["state"], CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+
+class HedgedSynthesisTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.breaker = CircuitBreaker(
+            "elevenlabs", failure_threshold=5, latency_threshold=10, reset_timeout=30
+        )
+        self.patch("api.utils.get_breaker", lambda name: self.breaker)
+        self.patch("api.utils.generate_gtts_audio", self.fake_gtts)
+        self.patch("api.utils.generate_elevenlabs_audio", self.fake_elevenlabs)
+        self.elevenlabs_delay = 0
+        self.elevenlabs_calls = 0
+        self.filename = os.path.join(self.media_root, "turn.mp3")
+
+    def fake_gtts(self, text, filename):
+        with open(filename, "wb") as f:
+            f.write(b"gtts")
+
+    def fake_elevenlabs(self, text, voice_id, filename):
+        self.elevenlabs_calls += 1
+        time.sleep(self.elevenlabs_delay)
+        with open(filename, "wb") as f:
+            f.write(b"elevenlabs")
+
+    def synthesized(self):
+        with open(self.filename, "rb") as f:
+            return f.read()
+
+    def test_open_breaker_goes_straight_to_gtts(self):
+        for _ in range(5):
+            self.breaker.record_failure("boom")
+        generate_audio_with_fallback("Hello.", "voice", self.filename)
+        self.assertEqual(self.synthesized(), b"gtts")
+        self.assertEqual(self.elevenlabs_calls, 0)
+
+    @override_settings(TTS_HEDGE_AFTER=0.05)
+    def test_fast_primary_wins_without_hedging(self):
+        generate_audio_with_fallback("Hello.", "voice", self.filename)
+        self.assertEqual(self.synthesized(), b"elevenlabs")
+        self.assertEqual(os.listdir(self.media_root), ["turn.mp3"])
+
+    @override_settings(TTS_HEDGE_AFTER=0.05)
+    def test_slow_primary_is_hedged_with_gtts(self):
+        self.elevenlabs_delay = 0.3
+        generate_audio_with_fallback("Hello.", "voice", self.filename)
+        self.assertEqual(self.synthesized(), b"gtts")
+        # The losing primary's file is dropped once it finishes.
+        wait_for(lambda: os.listdir(self.media_root) == ["turn.mp3"])
+        self.assertEqual(self.synthesized(), b"gtts")
+
+    @override_settings(TTS_HEDGE_AFTER=0.05)
+    def test_async_slow_primary_is_hedged_with_gtts(self):
+        async def slow_elevenlabs(text, voice_id, filename):
+            await asyncio.sleep(0.3)
+            self.fake_elevenlabs(text, voice_id, filename)
+
+        self.patch("api.utils.agenerate_elevenlabs_audio", slow_elevenlabs)
+        asyncio.run(agenerate_audio_with_fallback("Hello.", "voice", self.filename))
+        self.assertEqual(self.synthesized(), b"gtts")
+        self.assertEqual(os.listdir(self.media_root), ["turn.mp3"])
+
+    def fake_stream(self, *chunks, error=None):
+        def stream(text, voice_id, filename, chunk_size):
+            yield from chunks
+            if error is not None:
+                raise error
+
+        self.patch("api.utils.stream_elevenlabs_audio", stream)
+
+    def test_failures_mid_stream_are_recorded(self):
+        self.fake_stream(b"one", b"two", error=ElevenLabsError("Connection reset."))
+        chunks = stream_audio_with_fallback("Hello.", "voice", self.filename)
+        self.assertEqual(next(chunks), b"one")
+        self.assertEqual(self.breaker.snapshot()["calls"], 0)
+        with self.assertRaises(ElevenLabsError):
+            list(chunks)
+        self.assertEqual(self.breaker.snapshot()["failures"], 1)
+
+    def test_streams_are_recorded_once_finished(self):
+        self.fake_stream(b"one", b"two")
+        chunks = stream_audio_with_fallback("Hello.", "voice", self.filename)
+        self.assertEqual(next(chunks), b"one")
+        self.assertEqual(self.breaker.snapshot()["calls"], 0)
+        self.assertEqual(list(chunks), [b"two"])
+        snapshot = self.breaker.snapshot()
+        self.assertEqual((snapshot["calls"], snapshot["failures"]), (1, 0))
+
+        # A client hanging up is not the upstream's fault.
+        chunks = stream_audio_with_fallback("Hello.", "voice", self.filename)
+        next(chunks)
+        chunks.close()
+        snapshot = self.breaker.snapshot()
+        self.assertEqual((snapshot["calls"], snapshot["failures"]), (2, 0))
+
+    def test_failures_before_the_first_chunk_fall_back_to_gtts(self):
+        self.fake_stream(error=ElevenLabsError("Service unavailable."))
+        chunks = stream_audio_with_fallback("Hello.", "voice", self.filename)
+        self.assertEqual(b"".join(chunks), b"gtts")
+        self.assertEqual(self.breaker.snapshot()["failures"], 1)
+
+
+class LookupCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="lookup@example.com", password="secret", username="lookup"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.avatar = Avatar.objects.create(
+            side=SenderTypeChoices.AI,
+            avatar_name="ai",
+            voice_name="ai-voice",
+            elevenlabs_voice_id="voice-1",
+            video="video/ai.mp4",
+        )
+        self.mood = Mood.objects.create(mood_name="calm", mood_prompt="Be calm.")
+
+    def test_repeated_lookups_skip_the_database(self):
+        self.assertEqual(get_voice_id("ai-voice", SenderTypeChoices.AI), "voice-1")
+        self.assertEqual(get_mood_prompt("calm"), "Be calm.")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_voice_id("ai-voice", SenderTypeChoices.AI), "voice-1")
+            self.assertEqual(get_mood_prompt("calm"), "Be calm.")
+
+    def test_saving_or_deleting_invalidates_lookups(self):
+        get_voice_id("ai-voice", SenderTypeChoices.AI)
+        get_mood_prompt("calm")
+
+        self.avatar.elevenlabs_voice_id = "voice-2"
+        self.avatar.save()
+        self.assertEqual(get_voice_id("ai-voice", SenderTypeChoices.AI), "voice-2")
+
+        Mood.objects.create(mood_name="calm", mood_prompt="Be very calm.")
+        self.assertEqual(get_mood_prompt("calm"), "Be very calm.")
+        Mood.objects.filter(mood_prompt="Be very calm.").get().delete()
+        self.assertEqual(get_mood_prompt("calm"), "Be calm.")
+
+    def test_cached_lists_are_invalidated_by_writes(self):
+        def mood_names():
+            moods = self.client.get("/api/moods").json()["results"]
+            return [mood["mood_name"] for mood in moods]
+
+        self.assertEqual(mood_names(), ["calm"])
+        with self.assertNumQueries(0):
+            self.assertEqual(mood_names(), ["calm"])
+
+        self.client.post(
+            "/api/moods", {"mood_name": "cheerful", "mood_prompt": "Smile."}
+        )
+        self.assertEqual(mood_names(), ["calm", "cheerful"])
+
+
+class AudioMetadataTests(TempMediaMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email="meta@example.com", password="secret", username="meta"
+        )
+
+    def make_turn(self, name, frames):
+        name = default_storage.save(name, ContentFile(mp3_bytes(frames=frames)))
+        return GeneratedAudio.objects.create(
+            text="Hi.",
+            audio=name,
+            sender_type=SenderTypeChoices.USER,
+            conversation_id="meta",
+            user=self.user,
+        )
+
+    def test_metadata_is_stored_when_the_turn_is_written(self):
+        turn = self.make_turn("audio/user/one.mp3", frames=40)
+        self.assertEqual(turn.size_bytes, len(mp3_bytes(frames=40)))
+        self.assertAlmostEqual(turn.duration, 40 * 1152 / 44100, delta=0.01)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch("api.models.stored_audio_metadata") as read_file:
+            response = client.get(f"/api/speak/{turn.uid}")
+        read_file.assert_not_called()
+        self.assertEqual(response.json()["audio_length"], "1.04 seconds")
+
+    def test_backfill_fills_rows_written_before_the_columns(self):
+        turns = [
+            self.make_turn(f"audio/user/{index}.mp3", frames=20 * (index + 1))
+            for index in range(3)
+        ]
+        GeneratedAudio.objects.update(duration=None, size_bytes=None)
+        default_storage.delete(turns[2].audio.name)
+
+        out = StringIO()
+        call_command("backfill_audio_metadata", processes=2, chunk_size=2, stdout=out)
+
+        self.assertIn("2 updated, 1 missing", out.getvalue())
+        for index, turn in enumerate(turns[:2]):
+            turn.refresh_from_db()
+            self.assertEqual(turn.size_bytes, len(mp3_bytes(frames=20 * (index + 1))))
+            self.assertIsNotNone(turn.duration)
+        turns[2].refresh_from_db()
+        self.assertIsNone(turns[2].size_bytes)
+
+
+@override_settings(ADMIN_EXACT_COUNT_THRESHOLD=100)
+class EstimatedCountPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(
+            email="admin@example.com", password="secret", username="admin"
+        )
+        GeneratedAudio.objects.bulk_create(
+            GeneratedAudio(
+                text=f"Line {index}.",
+                audio=f"audio/user/{index}.mp3",
+                sender_type=SenderTypeChoices.USER,
+                conversation_id="admin",
+                user=cls.user,
+                duration=1.0,
+            )
+            for index in range(5)
+        )
+
+    def paginator(self):
+        return EstimatedCountPaginator(GeneratedAudio.objects.order_by("id"), 2)
+
+    def test_counts_exactly_without_an_estimate(self):
+        self.assertEqual(self.paginator().count, 5)
+
+    def test_large_estimates_skip_the_exact_count(self):
+        paginator = self.paginator()
+        with mock.patch.object(paginator, "estimated_count", return_value=10**7):
+            with self.assertNumQueries(0):
+                self.assertEqual(paginator.count, 10**7)
+        self.assertEqual(paginator.num_pages, 5 * 10**6)
+
+    def test_small_estimates_are_counted_exactly(self):
+        paginator = self.paginator()
+        with mock.patch.object(paginator, "estimated_count", return_value=50):
+            self.assertEqual(paginator.count, 5)
+
+    def test_changelist_renders(self):
+        self.client.force_login(self.user)
+        url = reverse("admin:api_generatedaudio_changelist")
+        response = self.client.get(url, {"q": "admin"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Line 4.")
+
+
+@override_settings(AUDIO_VARIANTS_ENABLED=False)
+class ConversationTurnTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email="turns@example.com", password="secret", username="turns"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_turns(self, *frame_counts):
+        turns = []
+        for frames in frame_counts:
+            name = default_storage.save(
+                "audio/user/turn.mp3", ContentFile(mp3_bytes(frames=frames))
+            )
+            turns.append(
+                GeneratedAudio(
+                    text=f"{frames} frames",
+                    audio=name,
+                    sender_type=SenderTypeChoices.USER,
+                    conversation_id="turns",
+                    user=self.user,
+                )
+            )
+        return turns
+
+    def conversation(self):
+        return Conversation.objects.get(conversation_id="turns")
+
+    def test_turns_are_inserted_in_one_statement(self):
+        turns = self.make_turns(40, 80, 120)
+        with CaptureQueriesContext(connection) as queries:
+            Conversation.objects.add_turns("turns", self.user, turns)
+        inserts = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith('INSERT INTO "api_generatedaudio"')
+        ]
+        self.assertEqual(len(inserts), 1)
+
+        Conversation.objects.add_turns("turns", self.user, self.make_turns(40))
+        self.assertEqual(
+            list(
+                GeneratedAudio.objects.order_by("turn_index").values_list(
+                    "turn_index", "text"
+                )
+            ),
+            [(0, "40 frames"), (1, "80 frames"), (2, "120 frames"), (3, "40 frames")],
+        )
+        conversation = self.conversation()
+        self.assertEqual(conversation.turn_count, 4)
+        self.assertAlmostEqual(
+            conversation.total_duration,
+            sum(GeneratedAudio.objects.values_list("duration", flat=True)),
+        )
+
+    def test_removed_turns_leave_the_total_duration(self):
+        first, second = self.make_turns(40, 80)
+        Conversation.objects.add_turns("turns", self.user, [first, second])
+        chat_history = ChatHistory.objects.create(
+            conversation_id="turns", title="Turns", user=self.user
+        )
+
+        response = self.client.delete(f"/api/speak/{first.uid}")
+        self.assertEqual(response.status_code, 204)
+        self.assertAlmostEqual(self.conversation().total_duration, second.duration)
+        # Removing an already removed turn does not subtract it twice.
+        Conversation.objects.remove_turns(GeneratedAudio.objects.filter(pk=first.pk))
+        self.assertAlmostEqual(self.conversation().total_duration, second.duration)
+
+        response = self.client.delete(f"/api/chat-history/{chat_history.uid}")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.conversation().total_duration, 0)
+        self.assertEqual(self.conversation().turn_count, 2)
+        self.assertFalse(GeneratedAudio.objects.IS_ACTIVE().exists())
+
+
+@override_settings(AUDIO_VARIANTS_ENABLED=False)
+class StitchedReplayTests(TempMediaMixin, TestCase):
+    media_settings = {"AUDIO_TRANSCODER": "api.transcoding.StubTranscoder"}
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email="replay@example.com", password="secret", username="replay"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_turns(self, *audios):
+        turns = []
+        for index, audio in enumerate(audios):
+            name = default_storage.save(f"audio/user/{index}.mp3", ContentFile(audio))
+            turns.append(
+                GeneratedAudio(
+                    text=f"Turn {index}.",
+                    audio=name,
+                    sender_type=SenderTypeChoices.USER,
+                    conversation_id="replay",
+                    user=self.user,
+                )
+            )
+        Conversation.objects.add_turns("replay", self.user, turns)
+        return turns
+
+    def replay(self):
+        return self.client.post(
+            "/api/replay-dialogue/audio", {"conversation_id": "replay"}, format="json"
+        )
+
+    def stitched(self, manifest):
+        with default_storage.open(manifest["audio"], "rb") as f:
+            return f.read()
+
+    def test_frames_are_joined_with_an_offset_table(self):
+        turns = self.add_turns(
+            mp3_bytes(frames=40, vbr_header=True), mp3_bytes(frames=20)
+        )
+        response = self.replay()
+        self.assertEqual(response.status_code, 200)
+        manifest = response.json()
+
+        self.assertEqual(self.stitched(manifest), mp3_bytes(frames=60))
+        self.assertEqual(
+            [(turn["start"], turn["end"]) for turn in manifest["turns"]],
+            [
+                (0.0, turns[0].duration),
+                (turns[0].duration, round(turns[0].duration + turns[1].duration, 3)),
+            ],
+        )
+        self.assertEqual(self.scratch_files(), [])
+
+        # The stored manifest is reused without reading the turns again.
+        with mock.patch("api.services.read_turn_frames") as read_turn_frames:
+            self.assertEqual(self.replay().json(), manifest)
+        read_turn_frames.assert_not_called()
+
+    def test_turns_in_another_format_are_re_encoded(self):
+        self.add_turns(
+            mp3_bytes(frames=40),
+            mp3_bytes(frames=40, sample_rate=22050, channels=1),
+            mp3_bytes(frames=10),
+        )
+        response = self.replay()
+        self.assertEqual(response.status_code, 200)
+
+        audio_format, frames = mp3_frames(self.stitched(response.json()))
+        self.assertEqual(audio_format, (1, 44100, 2))
+        # 576-sample frames at 22.05 kHz last as long as 1152-sample ones at 44.1 kHz.
+        self.assertEqual(frames, mp3_bytes(frames=90))
+        self.assertEqual(self.scratch_files(), [])
+
+    def test_missing_audio_is_reported(self):
+        turns = self.add_turns(mp3_bytes(frames=40), mp3_bytes(frames=20))
+        default_storage.delete(turns[1].audio.name)
+        response = self.replay()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), {"error": "Audio for turn 1 is missing."})
+        self.assertEqual(self.scratch_files(), [])
+
+
+class MediaServingTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email="listener@example.com", password="secret", username="listener"
+        )
+        self.other = User.objects.create_user(
+            email="other@example.com", password="secret", username="other"
+        )
+        self.body = mp3_bytes(frames=10)
+        name = default_storage.save("audio/user/mine.mp3", ContentFile(self.body))
+        GeneratedAudio.objects.create(
+            text="Mine.", audio=name, sender_type=SenderTypeChoices.USER, user=self.user
+        )
+        name = default_storage.save("audio/user/theirs.mp3", ContentFile(self.body))
+        GeneratedAudio.objects.create(
+            text="Theirs.", audio=name, sender_type=SenderTypeChoices.USER, user=self.other
+        )
+        self.client.force_login(self.user)
+
+    def get(self, path, **headers):
+        return self.client.get(f"/media/{path}", headers=headers)
+
+    def test_owner_gets_the_file_with_validators(self):
+        response = self.get("audio/user/mine.mp3")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.body)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+        response = self.get("audio/user/mine.mp3", if_none_match=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.get("audio/user/mine.mp3", range="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), self.body[10:20])
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.body)}")
+
+        response = self.get("audio/user/mine.mp3", range=f"bytes={len(self.body)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.body)}")
+
+    def test_existence_is_not_revealed_without_permission(self):
+        forbidden = self.get("audio/user/theirs.mp3")
+        missing = self.get("audio/user/nothing-here.mp3")
+        self.assertEqual(forbidden.status_code, 403)
+        self.assertEqual(missing.status_code, 403)
+        self.assertEqual(forbidden.content, missing.content)
+
+        self.client.logout()
+        self.assertEqual(self.get("audio/user/mine.mp3").status_code, 403)
+
+    def test_jwt_bearer_token_is_accepted(self):
+        self.client.logout()
+        token = RefreshToken.for_user(self.user).access_token
+        response = self.get("audio/user/mine.mp3", authorization=f"Bearer {token}")
+        self.assertEqual(response.status_code, 200)
+
+    def test_traversal_is_refused_before_any_lookup(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get("audio/../../etc/passwd")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(queries), 0)
+
+    def test_staff_see_missing_files_as_not_found(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.get("audio/user/theirs.mp3").status_code, 200)
+        self.assertEqual(self.get("audio/user/nothing-here.mp3").status_code, 404)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="pager@example.com", password="secret", username="pager"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        ChatHistory.objects.bulk_create(
+            ChatHistory(
+                title=f"chat-{index}",
+                conversation_id=f"pager-{index}",
+                chat=[],
+                user=self.user,
+            )
+            for index in range(7)
+        )
+
+    def walk(self, url, between_pages=None):
+        titles = []
+        while url:
+            body = self.client.get(url).json()
+            titles += [row["title"] for row in body["results"]]
+            url = body["next"]
+            if between_pages:
+                between_pages()
+        return titles
+
+    def test_next_links_cover_every_row_once(self):
+        titles = self.walk("/api/chat-history?page_size=3")
+        self.assertEqual(titles, [f"chat-{index}" for index in range(7)])
+
+    def test_concurrent_inserts_never_shift_pages(self):
+        inserted = []
+
+        def insert():
+            inserted.append(
+                ChatHistory.objects.create(
+                    title=f"late-{len(inserted)}",
+                    conversation_id=f"late-{len(inserted)}",
+                    chat=[],
+                    user=self.user,
+                )
+            )
+
+        titles = self.walk("/api/chat-history?page_size=3", between_pages=insert)
+        self.assertEqual(len(titles), len(set(titles)))
+        self.assertEqual(titles[:7], [f"chat-{index}" for index in range(7)])
+        self.assertTrue(titles[7:])
+
+    def test_deep_pages_seek_on_the_primary_key(self):
+        body = self.client.get("/api/chat-history?page_size=3").json()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(body["next"])
+        sql = next(q["sql"] for q in queries if "api_chathistory" in q["sql"])
+        self.assertIn('"api_chathistory"."id" >', sql)
+        self.assertNotIn("OFFSET", sql)
+
+    def test_page_size_is_capped(self):
+        with mock.patch("api.pagination.IdCursorPagination.max_page_size", 4):
+            body = self.client.get("/api/chat-history?page_size=1000").json()
+        self.assertEqual(len(body["results"]), 4)
+        self.assertIsNotNone(body["next"])
+
+    def test_cached_mood_pages_are_keyed_by_cursor(self):
+        Mood.objects.bulk_create(
+            Mood(mood_name=f"mood-{index}", mood_prompt="Be kind.") for index in range(5)
+        )
+        first = self.client.get("/api/moods?page_size=2").json()
+        second = self.client.get(first["next"]).json()
+        self.assertNotEqual(first["results"], second["results"])
+        self.assertEqual(self.client.get(first["next"]).json(), second)
+
+
+class ChatTranscriptTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email="transcript@example.com", password="secret", username="transcript"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.chat_history = ChatHistory.objects.create(
+            conversation_id="transcript", title="Transcript", user=self.user
+        )
+
+    def make_turn(self, text, sender_type=SenderTypeChoices.USER):
+        name = default_storage.save("audio/user/turn.mp3", ContentFile(mp3_bytes()))
+        return GeneratedAudio(
+            text=text,
+            audio=name,
+            sender_type=sender_type,
+            conversation_id="transcript",
+            user=self.user,
+        )
+
+    def transcript(self):
+        self.chat_history.refresh_from_db()
+        return [(entry["turn_index"], entry["text"]) for entry in self.chat_history.chat]
+
+    def test_added_turns_are_appended(self):
+        Conversation.objects.add_turns(
+            "transcript",
+            self.user,
+            [self.make_turn("Hi."), self.make_turn("Hello.", SenderTypeChoices.AI)],
+        )
+        Conversation.objects.add_turns("transcript", self.user, [self.make_turn("Bye.")])
+        self.assertEqual(self.transcript(), [(0, "Hi."), (1, "Hello."), (2, "Bye.")])
+        self.assertEqual(
+            self.transcript(),
+            [
+                (entry["turn_index"], entry["text"])
+                for entry in ChatHistory.objects.build_transcript("transcript", self.user)
+            ],
+        )
+
+        response = self.client.get(f"/api/chat-history/{self.chat_history.uid}")
+        self.assertEqual(
+            response.json()["chat_dict"],
+            [{"user": "Hi."}, {"ai": "Hello."}, {"user": "Bye."}],
+        )
+
+    def test_late_appends_keep_turn_order(self):
+        first, second = self.make_turn("First."), self.make_turn("Second.")
+        for index, turn in enumerate((first, second)):
+            turn.turn_index = index
+            turn.save()
+        # A streamed turn finishes after the one queued behind it.
+        ChatHistory.objects.append_turns("transcript", self.user, [second])
+        ChatHistory.objects.append_turns("transcript", self.user, [first])
+        self.assertEqual(self.transcript(), [(0, "First."), (1, "Second.")])
+
+    def test_removing_a_turn_rebuilds_the_transcript(self):
+        turns = [self.make_turn("Hi."), self.make_turn("Hello."), self.make_turn("Bye.")]
+        Conversation.objects.add_turns("transcript", self.user, turns)
+
+        response = self.client.delete(f"/api/speak/{turns[1].uid}")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.transcript(), [(0, "Hi."), (2, "Bye.")])
+
+    def test_repair_rewrites_drifted_transcripts(self):
+        Conversation.objects.add_turns(
+            "transcript", self.user, [self.make_turn("Hi."), self.make_turn("Bye.")]
+        )
+        ChatHistory.objects.filter(pk=self.chat_history.pk).update(chat=[])
+
+        out = StringIO()
+        call_command("repair_chat_histories", "--dry-run", stdout=out)
+        self.assertIn("found 1", out.getvalue())
+        self.assertEqual(self.transcript(), [])
+
+        out = StringIO()
+        call_command("repair_chat_histories", stdout=out)
+        self.assertIn("repaired 1", out.getvalue())
+        self.assertEqual(self.transcript(), [(0, "Hi."), (1, "Bye.")])
+
+        out = StringIO()
+        call_command("repair_chat_histories", stdout=out)
+        self.assertIn("repaired 0", out.getvalue())
+
+
+class ShardedStorageTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email="shards@example.com", password="secret", username="shards"
+        )
+
+    def use_object_storage(self):
+        settings_override = override_settings(
+            STORAGES={
+                **settings.STORAGES,
+                "default": {
+                    "BACKEND": "api.tests.LocalObjectStorage",
+                    "OPTIONS": {"location": self.media_root},
+                },
+            }
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.assertFalse(is_local_storage())
+
+    def pending_audio(self, body=b"audio"):
+        pending = PendingAudio("ai", "token")
+        with open(pending.path, "wb") as f:
+            f.write(body)
+        return pending
+
+    def read(self, name):
+        with default_storage.open(name, "rb") as f:
+            return f.read()
+
+    def test_local_publish_is_a_single_rename(self):
+        pending = self.pending_audio()
+        real_replace = os.replace
+        with mock.patch("api.storage.os.replace", side_effect=real_replace) as replace:
+            name = pending.publish()
+        self.assertTrue(is_sharded(name))
+        replace.assert_called_once_with(pending.path, default_storage.path(name))
+        self.assertEqual(self.read(name), b"audio")
+        self.assertFalse(os.path.exists(pending.path))
+
+    def test_cross_device_publish_renames_a_copy_in_place(self):
+        pending = self.pending_audio()
+        real_replace = os.replace
+        renames = []
+
+        def replace(source, target):
+            renames.append((source, target))
+            if source == pending.path:
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            return real_replace(source, target)
+
+        with mock.patch("api.storage.os.replace", side_effect=replace):
+            name = pending.publish()
+        target = default_storage.path(name)
+        copy, final = renames[-1]
+        self.assertEqual(final, target)
+        self.assertEqual(os.path.dirname(copy), os.path.dirname(target))
+        self.assertEqual(self.read(name), b"audio")
+        self.assertEqual(os.listdir(os.path.dirname(target)), [os.path.basename(name)])
+        self.assertFalse(os.path.exists(pending.path))
+
+    def test_failed_cross_device_publish_leaves_no_partial_file(self):
+        pending = self.pending_audio()
+
+        def replace(source, target):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+        with mock.patch("api.storage.os.replace", side_effect=replace):
+            with self.assertRaises(OSError):
+                pending.publish()
+        directory = os.path.dirname(default_storage.path(pending.name))
+        self.assertEqual(os.listdir(directory), [])
+        self.assertTrue(os.path.exists(pending.path))
+
+    def test_object_storage_publish(self):
+        self.use_object_storage()
+        pending = self.pending_audio()
+        name = pending.publish()
+        self.assertEqual(name, sharded_name("audio", "ai_token.mp3"))
+        self.assertEqual(self.read(name), b"audio")
+        self.assertFalse(os.path.exists(pending.path))
+
+        # An existing name is never overwritten in place.
+        other = publish_file(self.pending_audio(b"other").path, name)
+        self.assertNotEqual(other, name)
+        self.assertEqual(self.read(name), b"audio")
+
+    def make_flat_media(self):
+        names = [
+            default_storage.save(f"audio/turn-{index}.mp3", ContentFile(str(index)))
+            for index in range(3)
+        ]
+        turns = [
+            GeneratedAudio(
+                text=f"Turn {index}.",
+                audio=name,
+                sender_type=SenderTypeChoices.USER,
+                conversation_id="shards",
+                user=self.user,
+                duration=1.0,
+                size_bytes=1,
+            )
+            for index, name in enumerate(names)
+        ]
+        Conversation.objects.add_turns("shards", self.user, turns)
+        video = default_storage.save("video/ai/avatar.mp4", ContentFile(b"video"))
+        avatar = Avatar.objects.create(
+            side=SenderTypeChoices.AI,
+            avatar_name="avatar",
+            voice_name="voice",
+            elevenlabs_voice_id="voice",
+            video=video,
+        )
+        chat_history = ChatHistory.objects.create(
+            conversation_id="shards", title="Shards", user=self.user
+        )
+        ChatHistory.objects.rebuild("shards", self.user)
+        return turns, avatar, chat_history
+
+    def assertShardedConsistently(self, turns, avatar, chat_history):
+        for index, turn in enumerate(turns):
+            old_name = turn.audio.name
+            turn.refresh_from_db()
+            self.assertTrue(is_sharded(turn.audio.name))
+            self.assertEqual(self.read(turn.audio.name), f"{index}".encode())
+            self.assertFalse(default_storage.exists(old_name))
+        avatar.refresh_from_db()
+        self.assertEqual(avatar.video.name, sharded_name("video/ai", "avatar.mp4"))
+        self.assertEqual(self.read(avatar.video.name), b"video")
+        chat_history.refresh_from_db()
+        self.assertEqual(
+            [entry["audio"] for entry in chat_history.chat],
+            [turn.audio.name for turn in turns],
+        )
+
+    def shard_media(self, *args):
+        out = StringIO()
+        call_command("shard_media", *args, stdout=out)
+        return out.getvalue()
+
+    def test_shard_media_moves_files_and_rewrites_rows(self):
+        turns, avatar, chat_history = self.make_flat_media()
+
+        output = self.shard_media("--dry-run")
+        self.assertIn("Audio: would move 3, 0 missing. Video: would move 1", output)
+        self.assertFalse(any(is_sharded(turn.audio.name) for turn in turns))
+        self.assertTrue(default_storage.exists(turns[0].audio.name))
+
+        output = self.shard_media("--chunk-size", "2")
+        self.assertIn("Audio: moved 3, 0 missing. Video: moved 1, 0 missing.", output)
+        self.assertShardedConsistently(turns, avatar, chat_history)
+
+        output = self.shard_media()
+        self.assertIn("Audio: moved 0, 0 missing. Video: moved 0, 0 missing.", output)
+
+    def test_shard_media_on_object_storage(self):
+        self.use_object_storage()
+        turns, avatar, chat_history = self.make_flat_media()
+        self.shard_media()
+        self.assertShardedConsistently(turns, avatar, chat_history)
+
+    def test_interrupted_moves_are_picked_up_again(self):
+        turns, avatar, chat_history = self.make_flat_media()
+        with mock.patch.object(GeneratedAudio.objects, "bulk_update") as bulk_update:
+            bulk_update.side_effect = RuntimeError("Interrupted.")
+            with self.assertRaises(RuntimeError):
+                self.shard_media()
+
+        # The files moved but the rows still hold the flat names.
+        self.assertFalse(default_storage.exists(turns[0].audio.name))
+        output = self.shard_media()
+        self.assertIn("Audio: moved 3, 0 missing.", output)
+        self.assertShardedConsistently(turns, avatar, chat_history)
+
+    def test_missing_files_are_reported_and_left_alone(self):
+        turns, avatar, chat_history = self.make_flat_media()
+        default_storage.delete(turns[1].audio.name)
+        output = self.shard_media()
+        self.assertIn("Audio: moved 2, 1 missing.", output)
+        turns[1].refresh_from_db()
+        self.assertEqual(turns[1].audio.name, "audio/turn-1.mp3")
+
+
+class MediaSweepTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email="sweep@example.com", password="secret", username="sweep"
+        )
+        self.long_ago = timezone.now() - timedelta(
+            seconds=settings.MEDIA_RETENTION_GRACE + 60
+        )
+
+    def store(self, name, size=10, old=True):
+        name = default_storage.save(name, ContentFile(b"x" * size))
+        if old:
+            timestamp = self.long_ago.timestamp()
+            os.utime(default_storage.path(name), (timestamp, timestamp))
+        return name
+
+    def make_audio(self, name, status=StatusChoices.ACTIVE, size=10):
+        audio = GeneratedAudio.objects.create(
+            text="Hi.",
+            audio=self.store(name, size),
+            sender_type=SenderTypeChoices.USER,
+            status=status,
+            user=self.user,
+        )
+        AudioVariant.objects.create(
+            audio=audio,
+            name="low",
+            content_type="audio/mpeg",
+            bitrate=64,
+            file=self.store(f"variants/{os.path.basename(name)}", size // 2),
+            size_bytes=size // 2,
+        )
+        return audio
+
+    def age(self, queryset):
+        queryset.update(updated_at=self.long_ago)
+
+    def sweep(self, *args):
+        out = StringIO()
+        call_command("sweep_media", *args, stdout=out)
+        return out.getvalue()
+
+    def test_removed_rows_are_swept_after_the_grace_period(self):
+        kept = self.make_audio("audio/kept.mp3")
+        removed = self.make_audio("audio/removed.mp3", StatusChoices.REMOVED, size=40)
+        audio_name, variant_name = removed.audio.name, removed.variants.get().file.name
+
+        self.assertIn("removed: 0 files", self.sweep())
+        self.assertTrue(default_storage.exists(audio_name))
+
+        self.age(GeneratedAudio.objects.filter(pk=removed.pk))
+        self.assertIn("removed: 2 files, 60\xa0bytes (60 bytes)", self.sweep())
+        self.assertFalse(default_storage.exists(audio_name))
+        self.assertFalse(default_storage.exists(variant_name))
+        removed.refresh_from_db()
+        self.assertEqual(removed.audio.name, "")
+        self.assertFalse(removed.variants.exists())
+        self.assertTrue(default_storage.exists(kept.audio.name))
+
+        # Swept rows are not visited again.
+        self.assertIn("removed: 0 files", self.sweep())
+
+    def test_removed_users_take_their_media(self):
+        audio = self.make_audio("audio/owned.mp3")
+        self.user.status = StatusChoices.REMOVED
+        self.user.save()
+        self.age(User.objects.filter(pk=self.user.pk))
+        self.assertIn("removed: 2 files", self.sweep())
+        self.assertFalse(default_storage.exists(audio.audio.name))
+
+    def test_dry_run_reports_what_a_real_run_reclaims(self):
+        self.age(
+            GeneratedAudio.objects.filter(
+                pk=self.make_audio("audio/removed.mp3", StatusChoices.REMOVED).pk
+            )
+        )
+        self.store("audio/orphan.mp3", size=7)
+        self.store("scratch/leftover.mp3", size=3)
+
+        dry_run = self.sweep("--dry-run")
+        self.assertIn("Would reclaim 25\xa0bytes from 4 files.", dry_run)
+        self.assertTrue(default_storage.exists("audio/orphan.mp3"))
+        self.assertTrue(default_storage.exists("audio/removed.mp3"))
+        self.assertEqual(self.scratch_files(), ["leftover.mp3"])
+
+        self.assertEqual(dry_run.replace("Would reclaim", "Reclaimed"), self.sweep())
+        self.assertIn("Would reclaim 0\xa0bytes from 0 files.", self.sweep("--dry-run"))
+
+    def test_orphans_are_swept_once_older_than_the_grace_period(self):
+        referenced = self.make_audio("audio/referenced.mp3")
+        poster = self.store("video/ai/poster.jpg")
+        Avatar.objects.create(
+            side=SenderTypeChoices.AI,
+            avatar_name="avatar",
+            voice_name="voice",
+            elevenlabs_voice_id="voice",
+            video=self.store("video/ai/avatar.mp4"),
+            poster=poster,
+        )
+        old_orphan = self.store("audio/ab/cd/orphan.mp3")
+        new_orphan = self.store("audio/ab/cd/new.mp3", old=False)
+        video_orphan = self.store("video/ai/stale.mp4")
+
+        self.assertIn("orphaned: 2 files", self.sweep("--chunk-size", "1"))
+        self.assertFalse(default_storage.exists(old_orphan))
+        self.assertFalse(default_storage.exists(video_orphan))
+        for name in (
+            referenced.audio.name,
+            referenced.variants.get().file.name,
+            poster,
+            new_orphan,
+        ):
+            self.assertTrue(default_storage.exists(name), name)
+
+    @override_settings(MEDIA_REPLAY_RETENTION=60)
+    def test_stale_replays_are_dropped(self):
+        stale = self.store("audio/replay/stale.mp3")
+        fresh = self.store("audio/replay/fresh.mp3", old=False)
+        self.sweep("--skip-orphans")
+        self.assertTrue(default_storage.exists(stale))
+        self.sweep()
+        self.assertFalse(default_storage.exists(stale))
+        self.assertTrue(default_storage.exists(fresh))
+
+
+class CorsHeaderTests(TestCase):
+    def preflight(self, path, request_headers):
+        return self.client.options(
+            path,
+            headers={
+                "origin": "https://app.example.com",
+                "access-control-request-method": "GET",
+                "access-control-request-headers": request_headers,
+            },
+        )
+
+    def test_audio_accept_may_be_sent(self):
+        response = self.preflight("/api/speak", "authorization, x-audio-accept")
+        allowed = response["Access-Control-Allow-Headers"].lower()
+        self.assertIn("x-audio-accept", allowed)
+        self.assertIn("authorization", allowed)
+
+    def test_upload_headers_may_be_sent_and_read(self):
+        response = self.preflight(
+            "/api/avatar/uploads/00000000-0000-0000-0000-000000000000",
+            "upload-offset, upload-checksum",
+        )
+        allowed = response["Access-Control-Allow-Headers"].lower()
+        self.assertIn("upload-offset", allowed)
+        self.assertIn("upload-checksum", allowed)
+
+        response = self.client.get(
+            "/api/avatar/uploads", headers={"origin": "https://app.example.com"}
+        )
+        self.assertIn("Upload-Offset", response["Access-Control-Expose-Headers"])
+
+    def test_budget_headers_may_be_read(self):
+        response = self.client.get(
+            "/api/avatar/uploads", headers={"origin": "https://app.example.com"}
+        )
+        exposed = response["Access-Control-Expose-Headers"]
+        for header in (
+            "X-RateLimit-Scope",
+            "X-RateLimit-Limit",
+            "X-RateLimit-Remaining",
+            "X-RateLimit-Cost",
+            "Retry-After",
+        ):
+            self.assertIn(header, exposed)
+
+
+@override_settings(AVATAR_PROCESSING_ENABLED=False)
+class ChunkedUploadTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            email="uploader@example.com", password="secret", username="uploader"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.video = os.urandom(3000)
+
+    def start(self, sha256=None):
+        response = self.client.post(
+            "/api/avatar/uploads",
+            {
+                "filename": "clip.mp4",
+                "size": len(self.video),
+                "sha256": sha256 or hashlib.sha256(self.video).hexdigest(),
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.url = f"/api/avatar/uploads/{response.json()['uid']}"
+
+    def send(self, offset, chunk, checksum=None):
+        """PATCH a chunk; ``checksum="sha256"`` sends the chunk's real digest."""
+        headers = {"upload-offset": str(offset)}
+        if checksum == "sha256":
+            checksum = hashlib.sha256(chunk).hexdigest()
+        if checksum is not None:
+            headers["upload-checksum"] = checksum
+        return self.client.generic(
+            "PATCH",
+            self.url,
+            chunk,
+            content_type="application/offset+octet-stream",
+            headers=headers,
+        )
+
+    def finalize(self):
+        return self.client.post(
+            f"{self.url}/finalize",
+            {
+                "side": SenderTypeChoices.AI,
+                "avatar_name": "clip",
+                "voice_name": "voice",
+            },
+            format="json",
+        )
+
+    def test_resume_and_finalize(self):
+        self.start()
+        response = self.send(0, self.video[:1000])
+        self.assertEqual(response.json(), {"offset": 1000, "size": 3000})
+        self.assertEqual(response["Upload-Offset"], "1000")
+
+        # After a dropped connection the client asks where to resume.
+        response = self.client.get(self.url)
+        self.assertEqual(response["Upload-Offset"], "1000")
+        offset = response.json()["offset"]
+        self.send(offset, self.video[offset:2000])
+        self.send(2000, self.video[2000:], "sha256")
+
+        response = self.finalize()
+        self.assertEqual(response.status_code, 201)
+        avatar = Avatar.objects.get(uid=response.json()["uid"])
+        self.assertEqual(avatar.user, self.user)
+        with default_storage.open(avatar.video.name, "rb") as f:
+            self.assertEqual(f.read(), self.video)
+        self.assertEqual(os.listdir(settings.AVATAR_UPLOAD_DIR), [])
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_offset_mismatch_is_a_conflict(self):
+        self.start()
+        self.send(0, self.video[:1000])
+        for offset in (0, 1500):
+            response = self.send(offset, self.video[offset : offset + 500])
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.json()["offset"], 1000)
+            self.assertEqual(response["Upload-Offset"], "1000")
+        self.assertEqual(self.client.get(self.url).json()["offset"], 1000)
+
+    def test_chunk_checksum_mismatch_rolls_back(self):
+        self.start()
+        self.send(0, self.video[:1000])
+        response = self.send(1000, self.video[1000:2000], "0" * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(self.url).json()["offset"], 1000)
+        upload = AvatarUpload.objects.get()
+        self.assertEqual(os.path.getsize(upload.part_path), 1000)
+
+        response = self.send(1000, self.video[1000:2000], "sha256")
+        self.assertEqual(response.status_code, 200)
+
+    def test_incomplete_or_corrupt_uploads_are_not_finalized(self):
+        self.start(sha256="0" * 64)
+        self.send(0, self.video[:1000])
+        response = self.finalize()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Avatar.objects.exists())
+
+        self.send(1000, self.video[1000:])
+        response = self.finalize()
+        self.assertEqual(response.status_code, 400)
+        # The whole file failed verification, so the upload starts over.
+        self.assertEqual(self.client.get(self.url).json()["offset"], 0)
+        self.assertFalse(Avatar.objects.exists())
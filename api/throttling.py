@@ -0,0 +1,207 @@
+import math
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from rest_framework.throttling import BaseThrottle
+
+from .choices import SenderTypeChoices
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# Scopes that keep their own budget for unauthenticated clients instead of
+# sharing "anon", so anonymous traffic cannot lock an address out of signing in.
+ANON_SCOPES = {"auth"}
+
+
+def parse_budget(budget):
+    """``"20000/min"`` -> ``(20000, 60)``."""
+    units, period = budget.split("/")
+    return int(units), PERIODS[period[0]]
+
+
+def text_cost(value):
+    return len(value) if isinstance(value, str) else 0
+
+
+def speak_cost(data):
+    """
+    Characters synthesized. When the LLM writes the reply (``reply_as`` AI, the
+    default) it is priced at ``THROTTLE_REPLY_COST`` whatever ``reply_text`` was
+    sent; a client-written ``reply_text`` is only priced when nothing is generated.
+    """
+    if data.get("reply_as", SenderTypeChoices.AI) == SenderTypeChoices.AI:
+        reply_cost = settings.THROTTLE_REPLY_COST
+    else:
+        reply_cost = text_cost(data.get("reply_text"))
+    return 1 + text_cost(data.get("text")) + reply_cost
+
+
+def batch_speak_cost(data):
+    turns = data.get("turns")
+    if not isinstance(turns, list):
+        return 1
+    return 1 + sum(
+        text_cost(turn.get("text")) for turn in turns if isinstance(turn, dict)
+    )
+
+
+def analyze_cost(data):
+    return 1 + text_cost(data.get("text")) + settings.THROTTLE_REPLY_COST
+
+
+class CostBudget:
+    """
+    A budget of cost units per period for one (scope, client), kept in the shared
+    ``THROTTLE_CACHE``. Usage is a sliding window estimated from two fixed-window
+    counters, so every charge is a single atomic ``incr``; a charge that would
+    overrun the budget is refunded and refused.
+    """
+
+    def __init__(self, scope, ident):
+        self.scope = scope
+        self.budget, self.period = parse_budget(settings.THROTTLE_BUDGETS[scope])
+        self.key_prefix = f"throttle:{scope}:{ident}"
+        self.cache = caches[settings.THROTTLE_CACHE]
+
+    def charge(self, cost):
+        """Return ``(allowed, remaining, retry_after_seconds)``."""
+        # A request dearer than the whole budget could never pass otherwise.
+        cost = max(1, min(int(cost), self.budget))
+        now = time.time()
+        window, offset = divmod(now, self.period)
+        elapsed = offset / self.period
+        current_key = f"{self.key_prefix}:{int(window)}"
+        previous = self.cache.get(f"{self.key_prefix}:{int(window) - 1}", 0)
+
+        self.cache.add(current_key, 0, timeout=self.period * 2)
+        try:
+            current = self.cache.incr(current_key, cost)
+        except ValueError:
+            # Evicted between add() and incr().
+            self.cache.set(current_key, cost, timeout=self.period * 2)
+            current = cost
+
+        used = previous * (1 - elapsed) + current
+        if used <= self.budget:
+            return True, int(self.budget - used), 0
+
+        try:
+            current = self.cache.decr(current_key, cost)
+        except ValueError:
+            current = 0
+        used = previous * (1 - elapsed) + current
+        return False, max(0, int(self.budget - used)), self.retry_after(
+            previous, current, elapsed, cost
+        )
+
+    def retry_after(self, previous, current, elapsed, cost):
+        allowance = self.budget - cost
+        if current <= allowance and previous:
+            # Wait for the previous window's share to decay.
+            needed = 1 - (allowance - current) / previous
+            return max(1, math.ceil((needed - elapsed) * self.period))
+        # Wait for the window to roll over, then for this window's share to decay.
+        needed = max(0.0, 1 - allowance / current) if current else 0.0
+        return max(1, math.ceil((1 - elapsed + needed) * self.period))
+
+    def headers(self, cost, remaining):
+        return {
+            "X-RateLimit-Scope": self.scope,
+            "X-RateLimit-Limit": f"{self.budget};w={self.period}",
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Cost": str(cost),
+        }
+
+
+def charge_request(request, user, scope, cost):
+    """
+    Charge ``cost`` units to the client's ``scope`` budget. Unauthenticated
+    clients share the per-address ``anon`` budget, except in ``ANON_SCOPES``,
+    which are budgeted per address on their own. The budget headers are left on
+    ``request.throttle_headers`` for ``ThrottleHeadersMiddleware``. Returns
+    ``(allowed, retry_after)``.
+    """
+    if user is not None and user.is_authenticated:
+        ident = f"user:{user.pk}"
+    else:
+        if scope not in ANON_SCOPES:
+            scope = "anon"
+        ident = f"addr:{client_address(request)}"
+    if scope not in settings.THROTTLE_BUDGETS:
+        return True, 0
+
+    budget = CostBudget(scope, ident)
+    allowed, remaining, retry_after = budget.charge(cost)
+    request.throttle_headers = budget.headers(cost, remaining)
+    if not allowed:
+        request.throttle_headers["Retry-After"] = str(retry_after)
+    return allowed, retry_after
+
+
+def client_address(request):
+    # Same resolution as DRF's throttles, including NUM_PROXIES.
+    return BaseThrottle().get_ident(request)
+
+
+def throttled_response(retry_after):
+    """429 for the plain Django views that cannot raise DRF's ``Throttled``."""
+    response = JsonResponse(
+        {
+            "detail": f"Request was throttled. Expected available in {retry_after} seconds."
+        },
+        status=429,
+    )
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+class CostBudgetThrottle(BaseThrottle):
+    """
+    DRF throttle charging each request against its view's budget. Views pick a
+    bucket with ``throttle_scope`` (default ``"default"``) and price requests with
+    ``estimate_throttle_cost(request)`` (default one unit, without reading the
+    body).
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, "throttle_scope", "default")
+        estimate = getattr(view, "estimate_throttle_cost", None)
+        cost = estimate(request) if estimate is not None else 1
+        # Charge the Django request so the middleware sees the headers.
+        allowed, self.retry_after = charge_request(
+            request._request, request.user, scope, cost
+        )
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class ThrottleHeadersMiddleware:
+    """Copy the budget headers left by ``charge_request`` onto the response."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.add_headers(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.add_headers(request, await self.get_response(request))
+
+    @staticmethod
+    def add_headers(request, response):
+        for header, value in getattr(request, "throttle_headers", {}).items():
+            response.headers.setdefault(header, value)
+        return response
@@ -0,0 +1,209 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import AudioVariant
+from .storage import publish_file, sharded_name
+from .utils import audio_file_metadata, silent_mp3_frames
+
+# format -> (content type, file extension)
+FORMATS = {
+    "mp3": ("audio/mpeg", "mp3"),
+    "opus": ("audio/ogg", "ogg"),
+}
+
+VARIANT_DIR = "variants"
+
+# Request header listing the audio types a client can play, in Accept syntax.
+# A separate header because Accept itself negotiates the JSON response.
+AUDIO_ACCEPT_HEADER = "X-Audio-Accept"
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def run_ffmpeg(*args):
+    command = [settings.FFMPEG_BINARY, "-nostdin", "-loglevel", "error", "-y", *args]
+    try:
+        subprocess.run(
+            command, check=True, capture_output=True, timeout=settings.FFMPEG_TIMEOUT
+        )
+    except subprocess.CalledProcessError as e:
+        raise TranscodeError(e.stderr.decode(errors="replace").strip())
+
+
+class FFmpegTranscoder:
+    CODEC_ARGS = {
+        "mp3": ["-c:a", "libmp3lame"],
+        "opus": ["-c:a", "libopus", "-f", "ogg"],
+    }
+
+    def transcode(self, source, target, audio_format, bitrate):
+        run_ffmpeg(
+            "-i",
+            source,
+            "-vn",
+            "-b:a",
+            f"{bitrate}k",
+            *self.CODEC_ARGS[audio_format],
+            target,
+        )
+
+    def resample(self, source, target, sample_rate, channels):
+        """Re-encode an MP3 to ``sample_rate`` and ``channels`` for joining."""
+        run_ffmpeg(
+            "-i",
+            source,
+            "-vn",
+            "-ar",
+            str(sample_rate),
+            "-ac",
+            str(channels),
+            "-b:a",
+            "128k" if sample_rate >= 32000 else "64k",
+            *self.CODEC_ARGS["mp3"],
+            "-write_xing",
+            "0",
+            target,
+        )
+
+
+class StubTranscoder:
+    """
+    Pure-Python stand-in for tests and machines without ffmpeg. The output is not
+    playable; it is the source truncated in proportion to the target bitrate, so
+    variant sizes still compare the way real encodes would.
+    """
+
+    SOURCE_BITRATE = 128
+
+    def transcode(self, source, target, audio_format, bitrate):
+        with open(source, "rb") as f:
+            data = f.read()
+        with open(target, "wb") as f:
+            f.write(data[: len(data) * bitrate // self.SOURCE_BITRATE])
+
+    def resample(self, source, target, sample_rate, channels):
+        """Silence in the requested format, as long as the source."""
+        duration, _size_bytes = audio_file_metadata(source)
+        if duration is None:
+            raise TranscodeError(f"{source} is not an MP3.")
+        samples_per_frame = 1152 if sample_rate >= 32000 else 576
+        with open(target, "wb") as f:
+            f.write(
+                silent_mp3_frames(
+                    round(duration * sample_rate / samples_per_frame),
+                    sample_rate,
+                    channels,
+                )
+            )
+
+
+def get_transcoder():
+    return import_string(settings.AUDIO_TRANSCODER)()
+
+
+def transcode_variants(gen_audio, transcoder=None):
+    """
+    Produce the ``AUDIO_VARIANTS`` renditions ``gen_audio`` does not have yet and
+    return the new ``AudioVariant`` rows. Renditions that come out no smaller than
+    the original are not kept.
+    """
+    existing = set(gen_audio.variants.values_list("name", flat=True))
+    missing = {
+        name: spec
+        for name, spec in settings.AUDIO_VARIANTS.items()
+        if name not in existing
+    }
+    if not missing or not gen_audio.audio:
+        return []
+
+    transcoder = transcoder or get_transcoder()
+    stem = os.path.splitext(os.path.basename(gen_audio.audio.name))[0]
+    created = []
+
+    os.makedirs(settings.MEDIA_SCRATCH_DIR, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=settings.MEDIA_SCRATCH_DIR) as workdir:
+        source = os.path.join(workdir, "source.mp3")
+        with gen_audio.audio.open("rb") as src, open(source, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        source_size = os.path.getsize(source)
+
+        for name, spec in missing.items():
+            content_type, extension = FORMATS[spec["format"]]
+            target = os.path.join(workdir, f"{name}.{extension}")
+            transcoder.transcode(source, target, spec["format"], spec["bitrate"])
+            size_bytes = os.path.getsize(target)
+            if size_bytes >= source_size:
+                continue
+
+            stored = publish_file(
+                target, sharded_name(VARIANT_DIR, f"{stem}.{name}.{extension}")
+            )
+            created.append(
+                AudioVariant.objects.create(
+                    audio=gen_audio,
+                    name=name,
+                    content_type=content_type,
+                    bitrate=spec["bitrate"],
+                    file=stored,
+                    size_bytes=size_bytes,
+                )
+            )
+    return created
+
+
+def parse_accept(header):
+    """Return ``{media_range: q}`` for an Accept-style header."""
+    ranges = {}
+    for item in (header or "").split(","):
+        media_range, *params = [part.strip() for part in item.split(";")]
+        if not media_range:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        ranges[media_range.lower()] = q
+    return ranges
+
+
+def accepts(ranges, content_type):
+    major = content_type.split("/")[0]
+    for media_range in (content_type, f"{major}/*", "*/*"):
+        if media_range in ranges:
+            return ranges[media_range] > 0
+    return False
+
+
+def pick_audio(gen_audio, accept_header):
+    """
+    The smallest of ``gen_audio``'s file and its variants whose type the client
+    accepts, as a ``FieldFile``. Falls back to the original file. Prefetch
+    ``variants`` when calling this for many rows.
+    """
+    ranges = parse_accept(accept_header)
+    candidates = [
+        (variant.size_bytes, variant.content_type, variant.file)
+        for variant in gen_audio.variants.all()
+    ]
+    if gen_audio.size_bytes is not None:
+        candidates.append((gen_audio.size_bytes, FORMATS["mp3"][0], gen_audio.audio))
+
+    acceptable = [
+        (size_bytes, file)
+        for size_bytes, content_type, file in candidates
+        if accepts(ranges, content_type)
+    ]
+    if not acceptable:
+        return gen_audio.audio
+    return min(acceptable, key=lambda candidate: candidate[0])[1]
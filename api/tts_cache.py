@@ -0,0 +1,215 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unicodedata
+
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class TTSCache:
+    """
+    Content-addressed store of synthesized audio shared by every worker on a node.
+
+    Entries live at ``<directory>/<key[:2]>/<key>.mp3`` and are published with an
+    atomic rename, so readers never see a partial file. Recency is tracked through
+    the entry mtime. Lookups take no lock: hit/miss counts are kept per process
+    and folded into ``stats.json`` every ``STATS_FLUSH_EVERY`` lookups. The byte
+    total is updated under an ``flock`` on ``.lock`` together with the rename that
+    adds an entry, so every entry is counted once; eviction walks and deletes
+    outside that lock, one evictor at a time.
+    """
+
+    STATS_FILE = "stats.json"
+    LOCK_FILE = ".lock"
+    EVICT_LOCK_FILE = ".evict.lock"
+    STATS_FLUSH_EVERY = 100
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._counts_lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(text, voice_id, model_id, voice_settings):
+        normalized = " ".join(unicodedata.normalize("NFC", text).split())
+        raw = json.dumps(
+            [normalized, voice_id, model_id, voice_settings],
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    def fetch(self, key, filename):
+        path = self.entry_path(key)
+        try:
+            shutil.copyfile(path, filename)
+        except FileNotFoundError:
+            self._count("misses")
+            return False
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # Evicted after the copy; the copy is still good.
+        self._count("hits")
+        return True
+
+    def store(self, key, filename):
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(filename, tmp_path)
+            size = os.path.getsize(tmp_path)
+            with self._locked():
+                existed = os.path.exists(path)
+                os.replace(tmp_path, path)
+                if not existed:
+                    stats = self._read_stats()
+                    stats["bytes"] += size
+                    self._write_stats(stats)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if not existed and stats["bytes"] > self.max_bytes:
+            self.evict()
+
+    def evict(self, target_ratio=0.9):
+        """
+        Drop least recently used entries until the cache fits under ``target_ratio``
+        of the limit. Returns the number of entries removed, or 0 when another
+        process is already evicting.
+        """
+        with self._locked(self.EVICT_LOCK_FILE, blocking=False) as acquired:
+            if not acquired:
+                return 0
+
+            with self._locked():
+                bytes_before = self._read_stats()["bytes"]
+            entries = []
+            total = 0
+            for root, _dirs, files in os.walk(self.directory):
+                for name in files:
+                    if not name.endswith(".mp3"):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+            entries.sort()
+            evicted = removed = 0
+            target = self.max_bytes * target_ratio
+            for _mtime, size, path in entries:
+                if total - removed <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed += size
+                evicted += 1
+
+            with self._locked():
+                stats = self._read_stats()
+                if stats["bytes"] == bytes_before:
+                    # Nothing was stored during the walk, so it is an exact count.
+                    stats["bytes"] = total - removed
+                else:
+                    stats["bytes"] = max(stats["bytes"] - removed, 0)
+                stats["evictions"] += evicted
+                self._write_stats(stats)
+        return evicted
+
+    def stats(self):
+        self.flush_counts()
+        with self._locked():
+            stats = self._read_stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+    def flush_counts(self):
+        """Add this process's unrecorded hit/miss counts to ``stats.json``."""
+        with self._counts_lock:
+            counts = dict(self._counts)
+            self._counts = {"hits": 0, "misses": 0}
+        if not any(counts.values()):
+            return
+        with self._locked():
+            stats = self._read_stats()
+            for name, count in counts.items():
+                stats[name] += count
+            self._write_stats(stats)
+
+    def _count(self, name):
+        with self._counts_lock:
+            self._counts[name] += 1
+            pending = self._counts["hits"] + self._counts["misses"]
+        if pending >= self.STATS_FLUSH_EVERY:
+            self.flush_counts()
+
+    @contextmanager
+    def _locked(self, lock_file=LOCK_FILE, blocking=True):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, lock_file), "a") as lock:
+            try:
+                flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+                fcntl.flock(lock, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_stats(self):
+        stats = {"hits": 0, "misses": 0, "bytes": 0, "evictions": 0}
+        try:
+            with open(os.path.join(self.directory, self.STATS_FILE)) as f:
+                stats.update(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+        return stats
+
+    def _write_stats(self, stats):
+        path = os.path.join(self.directory, self.STATS_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(stats, f)
+        os.replace(path + ".tmp", path)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """This process's ``TTSCache``, which holds its unflushed counts; None when disabled."""
+    if not settings.TTS_CACHE_ENABLED:
+        return None
+    directory, max_bytes = str(settings.TTS_CACHE_DIR), settings.TTS_CACHE_MAX_BYTES
+    # Keyed by pid so a forked worker starts with its own counts.
+    key = (os.getpid(), directory, max_bytes)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = TTSCache(directory, max_bytes)
+        return _caches[key]
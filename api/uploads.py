@@ -0,0 +1,138 @@
+import fcntl
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .choices import UploadStateChoices
+from .models import Avatar, AvatarUpload, SynthesisJob
+from .storage import publish_file
+from .utils import avatar_video_upload_path
+
+READ_SIZE = 64 * 1024
+
+
+class UploadConflict(Exception):
+    """The client's offset is stale; it should resume from ``offset``."""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}.")
+        self.offset = offset
+
+
+def start_upload(upload):
+    os.makedirs(settings.AVATAR_UPLOAD_DIR, exist_ok=True)
+    open(upload.part_path, "wb").close()
+
+
+def append_chunk(upload, stream, offset, length, checksum=""):
+    """
+    Write ``length`` bytes from ``stream`` at ``offset`` of the part file, reading
+    ``READ_SIZE`` at a time. A short read (dropped connection) or a SHA-256
+    mismatch rolls the file back to ``offset`` so the chunk can simply be resent.
+    Returns the new offset.
+    """
+    if length is None:
+        raise serializers.ValidationError("Content-Length is required.")
+    if length > settings.AVATAR_UPLOAD_MAX_CHUNK:
+        raise serializers.ValidationError(
+            f"Chunks may be at most {settings.AVATAR_UPLOAD_MAX_CHUNK} bytes."
+        )
+
+    with open(upload.part_path, "r+b") as f:
+        # One writer per upload; a concurrent append sees the current offset.
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict(upload.offset)
+
+        upload.refresh_from_db(fields=["offset", "state"])
+        if upload.state != UploadStateChoices.UPLOADING or offset != upload.offset:
+            raise UploadConflict(upload.offset)
+        if offset + length > upload.size:
+            raise serializers.ValidationError(
+                f"Chunk ends past the declared size of {upload.size} bytes."
+            )
+
+        digest = hashlib.sha256()
+        received = 0
+        f.seek(offset)
+        try:
+            while received < length:
+                block = stream.read(min(READ_SIZE, length - received))
+                if not block:
+                    break
+                f.write(block)
+                digest.update(block)
+                received += len(block)
+        except OSError:
+            pass
+
+        if received != length:
+            f.truncate(offset)
+            raise serializers.ValidationError(
+                f"Received {received} of {length} bytes; resend the chunk."
+            )
+        if checksum and checksum.lower() != digest.hexdigest():
+            f.truncate(offset)
+            raise serializers.ValidationError("Chunk checksum mismatch; resend the chunk.")
+        f.flush()
+        os.fsync(f.fileno())
+
+    upload.offset = offset + length
+    upload.save(update_fields=["offset", "updated_at"])
+    return upload.offset
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(READ_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finalize_upload(upload, serializer):
+    """
+    Publish a fully received upload as the video of a new ``Avatar`` built from
+    ``serializer`` (a validated ``AvatarSerializer``) and return the avatar.
+    """
+    if upload.offset != upload.size:
+        raise serializers.ValidationError(
+            f"Upload is incomplete: {upload.offset} of {upload.size} bytes received."
+        )
+    if upload.sha256 and file_sha256(upload.part_path) != upload.sha256.lower():
+        # The bytes on disk are wrong; the client has to start over.
+        with open(upload.part_path, "wb"):
+            pass
+        AvatarUpload.objects.filter(pk=upload.pk).update(
+            offset=0, updated_at=timezone.now()
+        )
+        raise serializers.ValidationError(
+            "File checksum mismatch; the upload was reset to offset 0."
+        )
+
+    side = serializer.validated_data["side"]
+    name = default_storage.get_available_name(
+        avatar_video_upload_path(Avatar(side=side), upload.filename)
+    )
+    with transaction.atomic():
+        upload = AvatarUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.state != UploadStateChoices.UPLOADING:
+            raise UploadConflict(upload.offset)
+        avatar = serializer.save(user=upload.user, video=publish_file(upload.part_path, name))
+        upload.state = UploadStateChoices.COMPLETE
+        upload.avatar = avatar
+        upload.save(update_fields=["state", "avatar", "updated_at"])
+        SynthesisJob.objects.enqueue_avatar_processing(avatar)
+    return avatar
+
+
+def discard_upload(upload):
+    if os.path.exists(upload.part_path):
+        os.remove(upload.part_path)
+    upload.delete()
@@ -1,24 +1,32 @@
 from django.urls import path
 
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
-
 from .views import (
     AnalyzeTextView,
+    AsyncAnalyzeTextView,
+    AsyncGenerateAudioView,
+    AuthTokenObtainPairView,
+    AuthTokenRefreshView,
+    AvatarUploadAPIView,
+    BatchGenerateAudioAPIView,
+    CreateAvatarUploadAPIView,
+    FinalizeAvatarUploadAPIView,
     GenerateAudioAPIView,
     ListCreateAvatarAPIView,
     ListCreateChatHistorySerializer,
     ListCreateMoodAPIView,
     ListCreateUserAPIView,
     LoginUserView,
+    LookupCacheStatsAPIView,
+    ProviderHealthAPIView,
+    ProviderStatsAPIView,
     RetrieveDestroyGenericAudioAPIView,
+    RetrieveSynthesisJobAPIView,
     RetrieveUpdatedDestroyAvatarAPIView,
     RetrieveUpdatedDestroyChatHistoryAPIView,
     RetrieveUpdateDestroyMeUserAPIView,
     RetrieveUpdateDestroyMoodAPIView,
     ReplayDialogeAPIView,
+    StitchedReplayDialogueAPIView,
 )
 
 
@@ -27,15 +35,28 @@ urlpatterns = [
     path("login", LoginUserView.as_view()),
     path("me", RetrieveUpdateDestroyMeUserAPIView.as_view()),
     path("speak", GenerateAudioAPIView.as_view()),
+    path("speak/batch", BatchGenerateAudioAPIView.as_view()),
+    path("speak/async", AsyncGenerateAudioView.as_view()),
+    path("speak/jobs/<uuid:uid>", RetrieveSynthesisJobAPIView.as_view()),
     path("speak/<uuid:uid>", RetrieveDestroyGenericAudioAPIView.as_view()),
     path("avatar", ListCreateAvatarAPIView.as_view()),
     path("avatar/<uuid:uid>", RetrieveUpdatedDestroyAvatarAPIView.as_view()),
+    path("avatar/uploads", CreateAvatarUploadAPIView.as_view()),
+    path("avatar/uploads/<uuid:uid>", AvatarUploadAPIView.as_view()),
+    path(
+        "avatar/uploads/<uuid:uid>/finalize", FinalizeAvatarUploadAPIView.as_view()
+    ),
     path("chat-history", ListCreateChatHistorySerializer.as_view()),
     path("chat-history/<uuid:uid>", RetrieveUpdatedDestroyChatHistoryAPIView.as_view()),
     path("replay-dialogue", ReplayDialogeAPIView.as_view()),
+    path("replay-dialogue/audio", StitchedReplayDialogueAPIView.as_view()),
     path("analyze", AnalyzeTextView.as_view()),
+    path("analyze/async", AsyncAnalyzeTextView.as_view()),
     path("moods", ListCreateMoodAPIView.as_view()),
     path("mood/<uuid:uid>", RetrieveUpdateDestroyMoodAPIView.as_view()),
-    path("token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
-    path("token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
+    path("internal/providers", ProviderStatsAPIView.as_view()),
+    path("internal/provider-health", ProviderHealthAPIView.as_view()),
+    path("internal/lookup-cache", LookupCacheStatsAPIView.as_view()),
+    path("token/", AuthTokenObtainPairView.as_view(), name="token_obtain_pair"),
+    path("token/refresh/", AuthTokenRefreshView.as_view(), name="token_refresh"),
 ]
@@ -1,40 +1,485 @@
+import asyncio
+import itertools
 import os
 import json
 import re
 import time
 import uuid
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
 import google.generativeai as genai
-import requests
+from django.conf import settings
+from django.core.files.storage import default_storage
 from dotenv import load_dotenv
 
+from .health import get_breaker
+from .providers import get_async_elevenlabs_client, get_elevenlabs_client
+from .storage import sharded_name
+
 # from .models import Avatar
 
 load_dotenv()
 
+# Separate from the request-level pools so hedged calls never wait on their own caller.
+hedge_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("TTS_HEDGE_EXECUTOR_WORKERS", 16)),
+    thread_name_prefix="tts-hedge",
+)
+
 
 def avatar_video_upload_path(instance, filename):
     # Determine folder based on side
     folder = "user" if instance.side == "USER" else "ai"
-    # Optional: include avatar name or UUID to avoid filename collisions
-    return os.path.join(f"video/{folder}", filename)
+    return sharded_name(f"video/{folder}", filename)
 
 
-def generate_elevenlabs_audio(text, voice_id, filename):
-    ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-    headers = {"xi-api-key": ELEVENLABS_API_KEY, "Content-Type": "application/json"}
+ELEVENLABS_API_URL = "https://api.elevenlabs.io/v1"
+ELEVENLABS_MODEL_ID = "eleven_multilingual_v2"
+ELEVENLABS_VOICE_SETTINGS = {"stability": 0.5, "similarity_boost": 0.7}
+
+
+class ElevenLabsError(Exception):
+    pass
+
+
+# The sync, async and streaming ElevenLabs paths below differ only in the HTTP
+# client they use; the request, response check, cache and breaker handling are
+# shared so they cannot drift apart.
+
+
+def elevenlabs_request(text, voice_id, stream=False):
+    """URL, headers and JSON body of one text-to-speech call."""
+    url = f"{ELEVENLABS_API_URL}/text-to-speech/{voice_id}"
+    if stream:
+        url += "/stream"
+    headers = {
+        "xi-api-key": os.getenv("ELEVENLABS_API_KEY"),
+        "Content-Type": "application/json",
+    }
     payload = {
         "text": text,
-        "model_id": "eleven_multilingual_v2",
-        "voice_settings": {"stability": 0.5, "similarity_boost": 0.7},
+        "model_id": ELEVENLABS_MODEL_ID,
+        "voice_settings": ELEVENLABS_VOICE_SETTINGS,
     }
-    res = requests.post(url, headers=headers, json=payload)
-    if res.status_code == 200:
-        with open(filename, "wb") as f:
-            f.write(res.content)
+    return url, headers, payload
+
+
+def check_elevenlabs_response(status_code):
+    if status_code != 200:
+        raise ElevenLabsError(f"ElevenLabs error (HTTP {status_code})")
+
+
+def tts_cache_entry(text, voice_id):
+    """The TTS cache and this synthesis' key, or ``(None, None)`` when disabled."""
+    from .tts_cache import get_tts_cache
+
+    cache = get_tts_cache()
+    if cache is None:
+        return None, None
+    return cache, cache.make_key(
+        text, voice_id, ELEVENLABS_MODEL_ID, ELEVENLABS_VOICE_SETTINGS
+    )
+
+
+def generate_elevenlabs_audio(text, voice_id, filename):
+    cache, cache_key = tts_cache_entry(text, voice_id)
+    if cache is not None and cache.fetch(cache_key, filename):
+        return
+
+    url, headers, payload = elevenlabs_request(text, voice_id)
+    res = get_elevenlabs_client().post(url, headers=headers, json=payload)
+    check_elevenlabs_response(res.status_code)
+    write_file(filename, res.content)
+
+    if cache is not None:
+        cache.store(cache_key, filename)
+
+
+async def agenerate_elevenlabs_audio(text, voice_id, filename):
+    cache, cache_key = tts_cache_entry(text, voice_id)
+    if cache is not None and await asyncio.to_thread(cache.fetch, cache_key, filename):
+        return
+
+    url, headers, payload = elevenlabs_request(text, voice_id)
+    res = await get_async_elevenlabs_client().post(url, headers=headers, json=payload)
+    check_elevenlabs_response(res.status_code)
+    await asyncio.to_thread(write_file, filename, res.content)
+
+    if cache is not None:
+        await asyncio.to_thread(cache.store, cache_key, filename)
+
+
+def stream_elevenlabs_audio(text, voice_id, filename, chunk_size=8192):
+    """Yield MP3 chunks as ElevenLabs produces them while writing them to ``filename``."""
+    cache, cache_key = tts_cache_entry(text, voice_id)
+    if cache is not None and cache.fetch(cache_key, filename):
+        yield from iter_file(filename, chunk_size)
+        return
+
+    url, headers, payload = elevenlabs_request(text, voice_id, stream=True)
+    with get_elevenlabs_client().stream(
+        "POST", url, headers=headers, json=payload
+    ) as res:
+        check_elevenlabs_response(res.status_code)
+
+        try:
+            with open(filename, "wb") as f:
+                for chunk in res.iter_bytes(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        yield chunk
+        except BaseException:
+            discard_file(filename)
+            raise
+
+    if cache is not None:
+        cache.store(cache_key, filename)
+
+
+def generate_gtts_audio(text, filename):
+    from gtts import gTTS
+
+    gTTS(text).save(filename)
+
+
+@contextmanager
+def breaker_call(breaker):
+    """Report the outcome and latency of the upstream call made in the block to ``breaker``."""
+    started = time.monotonic()
+    try:
+        yield
+    except Exception as e:
+        breaker.record_failure(e)
+        raise
+    breaker.record_success(time.monotonic() - started)
+
+
+def call_elevenlabs(breaker, text, voice_id, filename):
+    with breaker_call(breaker):
+        generate_elevenlabs_audio(text, voice_id, filename)
+
+
+async def acall_elevenlabs(breaker, text, voice_id, filename):
+    with breaker_call(breaker):
+        await agenerate_elevenlabs_audio(text, voice_id, filename)
+
+
+def stream_audio_with_fallback(text, voice_id, filename, chunk_size=8192):
+    breaker = get_breaker("elevenlabs")
+    if not breaker.allow_request():
+        generate_gtts_audio(text, filename)
+        return iter_file(filename, chunk_size)
+
+    # Pull the first chunk eagerly so upstream failures surface before the
+    # response has started and gTTS can still take over.
+    chunks = stream_elevenlabs_audio(text, voice_id, filename, chunk_size)
+    started = time.monotonic()
+    try:
+        first = next(chunks, None)
+    except Exception as e:
+        breaker.record_failure(e)
+        generate_gtts_audio(text, filename)
+        return iter_file(filename, chunk_size)
+    first_byte_latency = time.monotonic() - started
+    if first is None:
+        breaker.record_success(first_byte_latency)
+        return iter(())
+    return breaker_stream(
+        breaker, first_byte_latency, itertools.chain([first], chunks)
+    )
+
+
+def breaker_stream(breaker, first_byte_latency, chunks):
+    """
+    Yield a started upstream stream and report it to ``breaker`` once it ends. An
+    error mid-stream is a failure; finishing, or the client hanging up, is a
+    success timed to the first byte, so long clips do not count as slow calls.
+    """
+    try:
+        yield from chunks
+    except Exception as e:
+        breaker.record_failure(e)
+        raise
+    except GeneratorExit:
+        breaker.record_success(first_byte_latency)
+        raise
+    breaker.record_success(first_byte_latency)
+
+
+def iter_file(filename, chunk_size=8192):
+    with open(filename, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def settle_race(done, candidates, filename):
+    """
+    Resolve finished attempts of a hedged synthesis. ``candidates`` maps each
+    pending future or task to the file it writes; finished ones are removed from
+    it. The first successful file becomes ``filename``; the files of failed and
+    still-running attempts are discarded. Returns whether a winner was found.
+    """
+    winner = next((attempt for attempt in done if attempt.exception() is None), None)
+    for attempt in done:
+        if attempt is not winner:
+            discard_file(candidates.pop(attempt))
+    if winner is None:
+        return False
+
+    os.replace(candidates.pop(winner), filename)
+    for attempt, path in candidates.items():
+        attempt.add_done_callback(lambda _attempt, path=path: discard_file(path))
+    return True
+
+
+def generate_audio_with_fallback(text, voice_id, filename):
+    """
+    Synthesize with ElevenLabs, falling back to gTTS when it fails, when its
+    circuit breaker is open, or (with TTS_HEDGE_AFTER set) when it has not
+    answered within the hedge budget, in which case the first result wins.
+    """
+    breaker = get_breaker("elevenlabs")
+    if not breaker.allow_request():
+        generate_gtts_audio(text, filename)
+        return
+
+    hedge_after = settings.TTS_HEDGE_AFTER
+    if not hedge_after:
+        try:
+            call_elevenlabs(breaker, text, voice_id, filename)
+        except Exception:
+            generate_gtts_audio(text, filename)
+        return
+
+    primary_path = f"{filename}.primary"
+    primary = hedge_executor.submit(
+        call_elevenlabs, breaker, text, voice_id, primary_path
+    )
+    done, _ = wait([primary], timeout=hedge_after)
+    if not done:
+        fallback_path = f"{filename}.fallback"
+        fallback = hedge_executor.submit(generate_gtts_audio, text, fallback_path)
+        candidates = {primary: primary_path, fallback: fallback_path}
+        while candidates:
+            done, _ = wait(candidates, return_when=FIRST_COMPLETED)
+            if settle_race(done, candidates, filename):
+                return
+        raise Exception("ElevenLabs and gTTS both failed")
+
+    if not settle_race(done, {primary: primary_path}, filename):
+        generate_gtts_audio(text, filename)
+
+
+async def agenerate_audio_with_fallback(text, voice_id, filename):
+    """``generate_audio_with_fallback`` for the event loop."""
+    breaker = get_breaker("elevenlabs")
+    if not breaker.allow_request():
+        await asyncio.to_thread(generate_gtts_audio, text, filename)
+        return
+
+    hedge_after = settings.TTS_HEDGE_AFTER
+    if not hedge_after:
+        try:
+            await acall_elevenlabs(breaker, text, voice_id, filename)
+        except Exception:
+            await asyncio.to_thread(generate_gtts_audio, text, filename)
+        return
+
+    primary_path = f"{filename}.primary"
+    primary = asyncio.create_task(
+        acall_elevenlabs(breaker, text, voice_id, primary_path)
+    )
+    done, _ = await asyncio.wait([primary], timeout=hedge_after)
+    if not done:
+        fallback_path = f"{filename}.fallback"
+        fallback = asyncio.create_task(
+            asyncio.to_thread(generate_gtts_audio, text, fallback_path)
+        )
+        candidates = {primary: primary_path, fallback: fallback_path}
+        while candidates:
+            done, _ = await asyncio.wait(
+                candidates, return_when=asyncio.FIRST_COMPLETED
+            )
+            if settle_race(done, candidates, filename):
+                return
+        raise Exception("ElevenLabs and gTTS both failed")
+
+    if not settle_race(done, {primary: primary_path}, filename):
+        await asyncio.to_thread(generate_gtts_audio, text, filename)
+
+
+def discard_file(filename):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
+def write_file(filename, content):
+    with open(filename, "wb") as f:
+        f.write(content)
+
+
+def timed_call(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, round((time.perf_counter() - started) * 1000, 2)
+
+
+async def atimed_call(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = await func(*args, **kwargs)
+    return result, round((time.perf_counter() - started) * 1000, 2)
+
+
+SENTENCE_BOUNDARY_RE = re.compile(r"[.!?]+[\"')\]]*\s+")
+
+
+def split_sentences(buffer):
+    """Split finished sentences off ``buffer`` and return them with the unfinished remainder."""
+    sentences = []
+    start = 0
+    for match in SENTENCE_BOUNDARY_RE.finditer(buffer):
+        sentence = buffer[start : match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    return sentences, buffer[start:]
+
+
+def strip_id3_tags(data):
+    """Return the raw MPEG frames of an MP3 so several files can be concatenated."""
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        data = data[10 + size + footer :]
+    if len(data) >= 128 and data[-128:-125] == b"TAG":
+        data = data[:-128]
+    return data
+
+
+MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    2.5: [11025, 12000, 8000],
+}
+MP3_VBR_TAGS = (b"Xing", b"Info", b"VBRI")
+
+
+def parse_mp3_frame_header(data, offset=0):
+    """Return ``(version, sample_rate, channels, frame_length)`` of the Layer III frame at ``offset``, or None."""
+    if len(data) < offset + 4 or data[offset] != 0xFF:
+        return None
+    b1, b2, b3 = data[offset + 1 : offset + 4]
+    version = {3: 1, 2: 2, 0: 2.5}.get((b1 >> 3) & 3)
+    layer = (b1 >> 1) & 3
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 3
+    if (
+        b1 & 0xE0 != 0xE0
+        or version is None
+        or layer != 1
+        or bitrate_index in (0, 15)
+        or sample_rate_index == 3
+    ):
+        return None
+
+    bitrate = MP3_BITRATES[1 if version == 1 else 2][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    channels = 1 if b3 >> 6 == 3 else 2
+    padding = (b2 >> 1) & 1
+    coefficient = 144 if version == 1 else 72
+    return version, sample_rate, channels, coefficient * bitrate // sample_rate + padding
+
+
+def mp3_frames(data):
+    """
+    Strip tags and any leading Xing/Info/VBRI frame from an MP3 and return
+    ``(format, frames)``. ``format`` is ``(version, sample_rate, channels)``, or
+    None when no MPEG Layer III frame is found. The VBR header frame is dropped
+    because it describes the length of this file only, which is wrong once the
+    frames are concatenated with others.
+    """
+    data = strip_id3_tags(data)
+    offset = data.find(b"\xff")
+    while offset != -1:
+        header = parse_mp3_frame_header(data, offset)
+        if header is not None:
+            break
+        offset = data.find(b"\xff", offset + 1)
     else:
-        raise Exception("ElevenLabs error")
+        return None, b""
+
+    version, sample_rate, channels, frame_length = header
+    frames = data[offset:]
+    if any(tag in frames[:frame_length] for tag in MP3_VBR_TAGS):
+        frames = frames[frame_length:]
+    return (version, sample_rate, channels), frames
+
+
+MP3_VERSION_BITS = {1: 0b11, 2: 0b10, 2.5: 0b00}
+
+
+def silent_mp3_frames(count, sample_rate, channels):
+    """``count`` silent Layer III frames (128 kbit/s MPEG-1, 64 kbit/s otherwise)."""
+    version = next(
+        version for version, rates in MP3_SAMPLE_RATES.items() if sample_rate in rates
+    )
+    bitrate = 128 if version == 1 else 64
+    bitrate_index = MP3_BITRATES[1 if version == 1 else 2].index(bitrate)
+    rate_index = MP3_SAMPLE_RATES[version].index(sample_rate)
+    header = bytes(
+        [
+            0xFF,
+            0xE3 | MP3_VERSION_BITS[version] << 3,
+            bitrate_index << 4 | rate_index << 2,
+            0xC0 if channels == 1 else 0x00,
+        ]
+    )
+    coefficient = 144 if version == 1 else 72
+    frame_length = coefficient * bitrate * 1000 // sample_rate
+    return (header + bytes(frame_length - 4)) * count
+
+
+def audio_metadata(fileobj):
+    """Return ``(duration_seconds, size_bytes)`` for an open MP3; either is None if unavailable."""
+    from mutagen import MutagenError
+    from mutagen.mp3 import MP3
+
+    try:
+        size_bytes = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(0)
+    except OSError:
+        return None, None
+
+    try:
+        duration = round(MP3(fileobj).info.length, 2)
+    except (MutagenError, OSError):
+        duration = None
+    return duration, size_bytes
+
+
+def audio_file_metadata(path):
+    try:
+        with open(path, "rb") as f:
+            return audio_metadata(f)
+    except OSError:
+        return None, None
+
+
+def stored_audio_metadata(name):
+    """``audio_metadata`` for a file in media storage, by its stored name."""
+    try:
+        with default_storage.open(name, "rb") as f:
+            return audio_metadata(f)
+    except OSError:
+        return None, None
 
 
 def clean_text(text):
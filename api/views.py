@@ -1,46 +1,124 @@
+import base64
+import json
 import os
+import shutil
+import tempfile
 import uuid
 
+from collections import deque
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 # from django.views.decorators.cache import cache_page
-# from django.utils.decorators import method_decorator
 
 from rest_framework import status, generics, serializers
+from rest_framework.exceptions import AuthenticationFailed, NotFound
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.views import APIView
 
 
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 from dotenv import load_dotenv
 
-from .choices import SenderTypeChoices, StatusChoices
-from .models import Avatar, ChatHistory, GeneratedAudio, Mood, User
+from .choices import (
+    JobKindChoices,
+    SenderTypeChoices,
+    StatusChoices,
+    UploadStateChoices,
+)
+from .models import (
+    Avatar,
+    ChatHistory,
+    Conversation,
+    GeneratedAudio,
+    Mood,
+    SynthesisJob,
+    AvatarUpload,
+    User,
+)
+from .providers import pool_stats
+from .health import breaker_snapshots
+from .jobs import enqueue_job
+from .pagination import IdCursorPagination
+from .lookups import cached_list, lookup_cache_stats
 from .serializers import (
     AvatarSerializer,
+    AvatarUploadSerializer,
+    BatchSpeakSerializer,
     ChatHistorySerializer,
     GeneratedAudioSerializer,
     LoginUserSerializer,
     MoodSerializer,
+    SynthesisJobSerializer,
     UserSerializer,
 )
-from .utils import clean_text, generate_elevenlabs_audio
+from .services import (
+    ReplayStitchError,
+    ReplyGenerationError,
+    aanalyze_text,
+    analyze_text,
+    arun_speak,
+    conversation_turns,
+    discard_after,
+    generate_ai_reply,
+    generate_ai_reply_stream,
+    manual_speak_turn,
+    resolve_speak_context,
+    run_speak,
+    run_speak_batch,
+    speak_executor,
+    speak_params,
+    stitch_conversation_audio,
+)
+from .storage import PendingAudio
+from .throttling import (
+    analyze_cost,
+    batch_speak_cost,
+    charge_request,
+    speak_cost,
+    throttled_response,
+)
+from .transcoding import AUDIO_ACCEPT_HEADER, pick_audio
+from .uploads import (
+    UploadConflict,
+    append_chunk,
+    discard_upload,
+    finalize_upload,
+    start_upload,
+)
+from .tts_cache import get_tts_cache
+from .utils import (
+    clean_text,
+    generate_audio_with_fallback,
+    mp3_frames,
+    split_sentences,
+    stream_audio_with_fallback,
+    strip_id3_tags,
+)
 
 import google.generativeai as genai
-from openai import OpenAI
 
 # Create your views here.
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-
 class ListCreateUserAPIView(generics.ListCreateAPIView):
     queryset = User.objects.IS_ACTIVE().order_by("id")
     serializer_class = UserSerializer
+    pagination_class = IdCursorPagination
+    throttle_scope = "auth"
 
     def get_permissions(self):
         if self.request.method == "GET":
@@ -66,6 +144,7 @@ class RetrieveUpdateDestroyMeUserAPIView(generics.RetrieveUpdateDestroyAPIView):
 
 class LoginUserView(generics.GenericAPIView):
     serializer_class = LoginUserSerializer
+    throttle_scope = "auth"
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -91,6 +170,14 @@ class LoginUserView(generics.GenericAPIView):
         )
 
 
+class AuthTokenObtainPairView(TokenObtainPairView):
+    throttle_scope = "auth"
+
+
+class AuthTokenRefreshView(TokenRefreshView):
+    throttle_scope = "auth"
+
+
 # class RetrieveUpdateMeUserView(generics.RetrieveUpdateAPIView):
 #     serializer_class = UserSerializer
 #     permission_classes = [IsAuthenticated]
@@ -103,236 +190,309 @@ class LoginUserView(generics.GenericAPIView):
 class GenerateAudioAPIView(generics.GenericAPIView):
     serializer_class = GeneratedAudioSerializer
     permission_classes = [IsAuthenticated]
+    throttle_scope = "speak"
+
+    def estimate_throttle_cost(self, request):
+        return speak_cost(request.data)
 
     def post(self, request):
         user = self.request.user
         serializer = GeneratedAudioSerializer(data=request.data)
         if serializer.is_valid():
-            validated_data = serializer.validated_data
-            user_text = validated_data.get("text")
-            mode = request.data.get("mode", "friendly")
-            convo_id = request.data.get("conversation_id", str(uuid.uuid4()))
-            user_voice_name = validated_data.get("user_voice_name")
-            ai_voice_name = validated_data.get("ai_voice_name")
-            reply_as = validated_data.get("reply_as", "AI")
-            # reply_as = request.data.get("reply_as", "AI")
-            sender_type = request.data.get("sender_type")
-
-            user_voice = Avatar.objects.filter(
-                voice_name=user_voice_name, side=SenderTypeChoices.USER
-            ).latest("created_at")
-            ai_voice = Avatar.objects.filter(
-                voice_name=ai_voice_name, side=SenderTypeChoices.AI
-            ).latest("created_at")
-
-            user_voice_id = user_voice.elevenlabs_voice_id
-            ai_voice_id = ai_voice.elevenlabs_voice_id
-
-            mood_obj = Mood.objects.filter(
-                mood_name=mode.lower(), status=StatusChoices.ACTIVE
-            ).latest("created_at")
-            prompt = f"{mood_obj.mood_prompt}\nUser: {user_text}\nAI:"
-
-            if reply_as == SenderTypeChoices.AI:
-                # --- OpenAI integration ---
-
-                try:
-                    response = client.chat.completions.create(
-                        model="gpt-4o",
-                        messages=[
-                            {
-                                "role": "system",
-                                "content": "You are not an AI character. You will act like another person and reply in a conversation.",
-                            },
-                            {"role": "user", "content": prompt},
-                        ],
-                    )
-                    ai_reply = clean_text(response.choices[0].message.content.strip())
+            params = speak_params(serializer.validated_data, request.data)
 
-                except Exception as e:
-                    return Response(
-                        {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                    )
+            if str(request.data.get("background", "")).lower() in ("1", "true"):
+                job = enqueue_job(JobKindChoices.SPEAK, params, user=user)
+                return Response(
+                    {
+                        "job_id": str(job.uid),
+                        "state": job.state,
+                        "conversation_id": params["conversation_id"],
+                        "status_url": f"/api/speak/jobs/{job.uid}",
+                    },
+                    status=status.HTTP_202_ACCEPTED,
+                )
+
+            if request.data.get("stream") == "audio":
+                return self.stream_audio(user, params)
 
-                audio_id = uuid.uuid4().hex
-                user_audio = f"media/audio/user_{audio_id}.mp3"
-                ai_audio = f"media/audio/ai_{audio_id}.mp3"
+            if (
+                request.data.get("stream") == "sentences"
+                and params["reply_as"] == SenderTypeChoices.AI
+            ):
+                return self.stream_sentences(user, params)
 
-                try:
-                    generate_elevenlabs_audio(user_text, user_voice_id, user_audio)
-                    generate_elevenlabs_audio(ai_reply, ai_voice_id, ai_audio)
-                except Exception:
-                    from gtts import gTTS
+            try:
+                payload, _generated = run_speak(user, params)
+            except ReplyGenerationError as e:
+                return Response(
+                    {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
 
-                    gTTS(user_text).save(user_audio)
-                    gTTS(ai_reply).save(ai_audio)
+            return Response(payload, status=status.HTTP_201_CREATED)
+
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-                gen_user = GeneratedAudio.objects.create(
+    def stream_audio(self, user, params):
+        user_voice_id, ai_voice_id, prompt = resolve_speak_context(params)
+        user_text = params["text"]
+        convo_id = params["conversation_id"]
+        audio_id = uuid.uuid4().hex
+        headers = {"X-Conversation-Id": convo_id}
+        user_audio = user_future = None
+        targets = []
+        pending = []
+
+        if params["reply_as"] == SenderTypeChoices.AI:
+            user_audio = PendingAudio("user", audio_id)
+            user_future = speak_executor.submit(
+                generate_audio_with_fallback, user_text, user_voice_id, user_audio.path
+            )
+            try:
+                text = generate_ai_reply(prompt)
+            except Exception as e:
+                discard_after(user_future, user_audio)
+                return Response(
+                    {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+            voice_id = ai_voice_id
+            stream_sender = SenderTypeChoices.AI
+            headers["X-User-Audio"] = user_audio.name
+            targets.append(user_audio)
+
+            pending.append(
+                GeneratedAudio(
                     text=user_text,
-                    audio=user_audio.split("media/")[1],
+                    audio=user_audio.name,
                     sender_type=SenderTypeChoices.USER,
                     conversation_id=convo_id,
                     user=user,
+                    status=StatusChoices.INACTIVE,
                 )
-                gen_ai = GeneratedAudio.objects.create(
-                    text=ai_reply,
-                    audio=ai_audio.split("media/")[1],
-                    sender_type=SenderTypeChoices.AI,
-                    conversation_id=convo_id,
-                    user=user,
-                )
-
-                validated_data.pop("text")
+            )
+        else:
+            (stream_sender, text, voice_id), _reply = manual_speak_turn(
+                params, user_voice_id, ai_voice_id
+            )
 
-                return Response(
-                    {
-                        "reply": ai_reply,
-                        # "reply_as": reply_as,
-                        "user_audio": user_audio.split("media/")[1],
-                        "ai_audio": ai_audio.split("media/")[1],
-                        "conversation_id": convo_id,
-                        # "user_audio_response": GeneratedAudioSerializer(gen_user).data,
-                        # "ai_audio_response": GeneratedAudioSerializer(gen_ai).data
-                    },
-                    status=status.HTTP_201_CREATED,
-                )
-            else:
-                reply_text = request.data.get("reply_text", None)
-                if not reply_text:
-                    raise serializers.ValidationError("User must provide a reply text")
-                ai_reply = clean_text(reply_text)
-
-                audio_id = uuid.uuid4().hex
-                if sender_type == SenderTypeChoices.USER:
-                    user_audio = f"media/audio/user_{audio_id}.mp3"
-                    # ai_audio = f"media/audio/ai_{audio_id}.mp3"
-
-                    try:
-                        generate_elevenlabs_audio(user_text, user_voice_id, user_audio)
-                        # generate_elevenlabs_audio(ai_reply, ai_voice_id, ai_audio)
-                    except Exception:
-                        from gtts import gTTS
-
-                        gTTS(user_text).save(user_audio)
-                        # gTTS(ai_reply).save(ai_audio)
-
-                    gen_user = GeneratedAudio.objects.create(
-                        text=user_text,
-                        audio=user_audio.split("media/")[1],
-                        sender_type=SenderTypeChoices.USER,
-                        conversation_id=convo_id,
-                        user=user,
+        stream_audio = PendingAudio(stream_sender.lower(), audio_id)
+        targets.append(stream_audio)
+        try:
+            chunks = stream_audio_with_fallback(text, voice_id, stream_audio.path)
+        except Exception:
+            if user_future is not None:
+                discard_after(user_future, user_audio)
+            raise
+
+        # Rows stay INACTIVE until their audio is published to media storage.
+        pending.append(
+            GeneratedAudio(
+                text=text,
+                audio=stream_audio.name,
+                sender_type=stream_sender,
+                conversation_id=convo_id,
+                user=user,
+                status=StatusChoices.INACTIVE,
+            )
+        )
+        conversation = Conversation.objects.add_turns(convo_id, user, pending)
+        pending_ids = [gen_audio.pk for gen_audio in pending]
+
+        def body():
+            published = False
+            try:
+                yield from chunks
+                if user_future is not None:
+                    user_future.result()
+                for target in targets:
+                    target.publish()
+                published = True
+            finally:
+                # Also reached when the client disconnects mid-stream.
+                if not published:
+                    if user_future is not None:
+                        discard_after(user_future, user_audio)
+                    for target in targets:
+                        target.discard()
+                    Conversation.objects.remove_turns(
+                        GeneratedAudio.objects.filter(pk__in=pending_ids)
                     )
-                    # gen_ai = GeneratedAudio.objects.create(
-                    #     text=ai_reply,
-                    #     audio=ai_audio.split("media/")[1],
-                    #     sender_type=SenderTypeChoices.AI,
-                    #     conversation_id=convo_id,
-                    #     user=user,
-                    # )
+            for gen_audio in pending:
+                gen_audio.fill_audio_metadata()
+                gen_audio.status = StatusChoices.ACTIVE
+            GeneratedAudio.objects.bulk_update(
+                pending, ["status", "duration", "size_bytes"]
+            )
+            Conversation.objects.add_duration(
+                conversation.pk, sum(gen_audio.duration or 0 for gen_audio in pending)
+            )
+            ChatHistory.objects.append_turns(convo_id, user, pending)
+            SynthesisJob.objects.enqueue_transcodes(pending)
+
+        response = StreamingHttpResponse(body(), content_type="audio/mpeg")
+        response["X-Audio"] = stream_audio.name
+        response["X-Audio-Uid"] = str(pending[-1].uid)
+        response["X-Reply"] = quote(text)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def stream_sentences(self, user, params):
+        user_voice_id, ai_voice_id, prompt = resolve_speak_context(params)
+        user_text = params["text"]
+        convo_id = params["conversation_id"]
+        audio_id = uuid.uuid4().hex
+        user_audio = PendingAudio("user", audio_id)
+        ai_audio = PendingAudio("ai", audio_id)
+        user_future = speak_executor.submit(
+            generate_audio_with_fallback, user_text, user_voice_id, user_audio.path
+        )
 
-                    validated_data.pop("text")
+        def synthesize_segment(text, segment_dir, index):
+            segment_path = os.path.join(segment_dir, f"{index}.mp3")
+            generate_audio_with_fallback(text, ai_voice_id, segment_path)
+            with open(segment_path, "rb") as f:
+                data = f.read()
+            # Each segment's Xing/Info frame gives that segment's length only;
+            # left in the merged turn it makes players misreport the duration.
+            audio_format, frames = mp3_frames(data)
+            return frames if audio_format is not None else strip_id3_tags(data)
+
+        def sse(event, data):
+            return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+        def events():
+            segment_dir = tempfile.mkdtemp(prefix="speak_segments_")
+            pending = deque()
+            segment_texts = []
+            buffer = ""
+
+            def submit(sentence):
+                sentence = clean_text(sentence).strip()
+                if sentence:
+                    index = len(segment_texts)
+                    segment_texts.append(sentence)
+                    pending.append(
+                        (
+                            index,
+                            speak_executor.submit(
+                                synthesize_segment, sentence, segment_dir, index
+                            ),
+                        )
+                    )
 
-                    return Response(
+            def drain(merged, block):
+                while pending and (block or pending[0][1].done()):
+                    index, future = pending.popleft()
+                    audio = future.result()
+                    merged.write(audio)
+                    yield sse(
+                        "segment",
                         {
-                            "reply": ai_reply,
-                            # "reply_as": reply_as,
-                            "user_audio": user_audio.split("media/")[1],
-                            # "ai_audio": ai_audio.split("media/")[1],
-                            "conversation_id": convo_id,
-                            # "user_audio_response": GeneratedAudioSerializer(gen_user).data,
-                            # "ai_audio_response": GeneratedAudioSerializer(gen_ai).data
+                            "index": index,
+                            "text": segment_texts[index],
+                            "audio": base64.b64encode(audio).decode("ascii"),
                         },
-                        status=status.HTTP_201_CREATED,
                     )
 
-                elif sender_type == SenderTypeChoices.AI:
-                    # user_audio = f"media/audio/user_{audio_id}.mp3"
-                    ai_audio = f"media/audio/ai_{audio_id}.mp3"
-
-                    try:
-                        # generate_elevenlabs_audio(user_text, user_voice_id, user_audio)
-                        generate_elevenlabs_audio(ai_reply, ai_voice_id, ai_audio)
-                    except Exception:
-                        from gtts import gTTS
-
-                        # gTTS(user_text).save(user_audio)
-                        gTTS(ai_reply).save(ai_audio)
-
-                    # gen_user = GeneratedAudio.objects.create(
-                    #     text=user_text,
-                    #     audio=user_audio.split("media/")[1],
-                    #     sender_type=SenderTypeChoices.USER,
-                    #     conversation_id=convo_id,
-                    #     user=user,
-                    # )
-                    gen_ai = GeneratedAudio.objects.create(
+            published = False
+            try:
+                with open(ai_audio.path, "wb") as merged:
+                    for delta in generate_ai_reply_stream(prompt):
+                        sentences, buffer = split_sentences(buffer + delta)
+                        for sentence in sentences:
+                            submit(sentence)
+                        yield from drain(merged, block=False)
+                    submit(buffer)
+                    yield from drain(merged, block=True)
+                user_future.result()
+                user_audio.publish()
+                ai_audio.publish()
+                published = True
+            except Exception as e:
+                yield sse("error", {"error": str(e)})
+                return
+            finally:
+                # Also reached when the client disconnects mid-stream.
+                if not published:
+                    for _index, future in pending:
+                        future.cancel()
+                    discard_after(user_future, user_audio)
+                    ai_audio.discard()
+                shutil.rmtree(segment_dir, ignore_errors=True)
+
+            ai_reply = " ".join(segment_texts)
+            Conversation.objects.add_turns(
+                convo_id,
+                user,
+                [
+                    GeneratedAudio(
+                        text=user_text,
+                        audio=user_audio.name,
+                        sender_type=SenderTypeChoices.USER,
+                        conversation_id=convo_id,
+                        user=user,
+                    ),
+                    GeneratedAudio(
                         text=ai_reply,
-                        audio=ai_audio.split("media/")[1],
+                        audio=ai_audio.name,
                         sender_type=SenderTypeChoices.AI,
                         conversation_id=convo_id,
                         user=user,
-                    )
+                    ),
+                ],
+            )
+            yield sse(
+                "done",
+                {
+                    "reply": ai_reply,
+                    "user_audio": user_audio.name,
+                    "ai_audio": ai_audio.name,
+                    "conversation_id": convo_id,
+                },
+            )
 
-                    validated_data.pop("text")
+        response = StreamingHttpResponse(events(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
 
-                    return Response(
-                        {
-                            "reply": ai_reply,
-                            # "reply_as": reply_as,
-                            # "user_audio": user_audio.split("media/")[1],
-                            "ai_audio": ai_audio.split("media/")[1],
-                            "conversation_id": convo_id,
-                            # "user_audio_response": GeneratedAudioSerializer(gen_user).data,
-                            # "ai_audio_response": GeneratedAudioSerializer(gen_ai).data
-                        },
-                        status=status.HTTP_201_CREATED,
-                    )
 
-            # audio_id = uuid.uuid4().hex
-            # user_audio = f"media/audio/user_{audio_id}.mp3"
-            # ai_audio = f"media/audio/ai_{audio_id}.mp3"
-
-            # try:
-            #     generate_elevenlabs_audio(user_text, user_voice_id, user_audio)
-            #     generate_elevenlabs_audio(ai_reply, ai_voice_id, ai_audio)
-            # except Exception:
-            #     from gtts import gTTS
-
-            #     gTTS(user_text).save(user_audio)
-            #     gTTS(ai_reply).save(ai_audio)
-
-            # gen_user = GeneratedAudio.objects.create(
-            #     text=user_text,
-            #     audio=user_audio.split("media/")[1],
-            #     sender_type=SenderTypeChoices.USER,
-            #     conversation_id=convo_id,
-            #     user=user,
-            # )
-            # gen_ai = GeneratedAudio.objects.create(
-            #     text=ai_reply,
-            #     audio=ai_audio.split("media/")[1],
-            #     sender_type=SenderTypeChoices.AI,
-            #     conversation_id=convo_id,
-            #     user=user,
-            # )
-
-            # validated_data.pop("text")
-
-            # return Response(
-            #     {
-            #         "reply": ai_reply,
-            #         # "reply_as": reply_as,
-            #         "user_audio": user_audio.split("media/")[1],
-            #         "ai_audio": ai_audio.split("media/")[1],
-            #         "conversation_id": convo_id,
-            #         # "user_audio_response": GeneratedAudioSerializer(gen_user).data,
-            #         # "ai_audio_response": GeneratedAudioSerializer(gen_ai).data
-            #     },
-            #     status=status.HTTP_201_CREATED,
-            # )
+class BatchGenerateAudioAPIView(generics.GenericAPIView):
+    serializer_class = BatchSpeakSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_scope = "speak_batch"
+
+    def estimate_throttle_cost(self, request):
+        return batch_speak_cost(request.data)
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
+        convo_id = validated_data.get("conversation_id", str(uuid.uuid4()))
+
+        results = run_speak_batch(
+            self.request.user,
+            validated_data["turns"],
+            convo_id,
+            validated_data.get("concurrency", settings.BATCH_SPEAK_CONCURRENCY),
+        )
+        failed = sum(1 for result in results if "error" in result)
+
+        return Response(
+            {"conversation_id": convo_id, "failed": failed, "results": results},
+            status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED,
+        )
 
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class RetrieveSynthesisJobAPIView(generics.RetrieveAPIView):
+    serializer_class = SynthesisJobSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_field = "uid"
+
+    def get_queryset(self):
+        return SynthesisJob.objects.filter(user=self.request.user)
 
 
 class RetrieveDestroyGenericAudioAPIView(generics.RetrieveDestroyAPIView):
@@ -341,31 +501,49 @@ class RetrieveDestroyGenericAudioAPIView(generics.RetrieveDestroyAPIView):
     lookup_field = "uid"
 
     def get_object(self):
-        return GeneratedAudio.objects.IS_ACTIVE().get(uid=self.kwargs["uid"])
+        queryset = GeneratedAudio.objects.IS_ACTIVE().select_related("user")
+        if self.request.headers.get(AUDIO_ACCEPT_HEADER):
+            queryset = queryset.prefetch_related("variants")
+        return queryset.get(uid=self.kwargs["uid"])
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["audio_accept"] = self.request.headers.get(AUDIO_ACCEPT_HEADER)
+        return context
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, [AUDIO_ACCEPT_HEADER])
+        return response
 
     def perform_destroy(self, instance):
-        instance.status = StatusChoices.REMOVED
-        instance.save()
+        Conversation.objects.remove_turns(GeneratedAudio.objects.filter(pk=instance.pk))
+        ChatHistory.objects.rebuild(instance.conversation_id, instance.user)
 
 
 class ListCreateAvatarAPIView(generics.ListCreateAPIView):
     # queryset = Avatar.objects.IS_ACTIVE()
     serializer_class = AvatarSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
         return (
             Avatar.objects.IS_ACTIVE()
             .filter(Q(user=self.request.user) | Q(user__isnull=True))
+            .select_related("user")
             .order_by("id")
         )
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        avatar = serializer.save(user=self.request.user)
+        SynthesisJob.objects.enqueue_avatar_processing(avatar)
 
-    # @method_decorator(cache_page(60 * 15, key_prefix="avatar_list_cache"))
-    # def list(self, request, *args, **kwargs):
-    #     return super().list(request, *args, **kwargs)
+    def list(self, request, *args, **kwargs):
+        def build():
+            return super(ListCreateAvatarAPIView, self).list(request, *args, **kwargs).data
+
+        return Response(cached_list("avatar", request, build))
 
 
 class RetrieveUpdatedDestroyAvatarAPIView(generics.RetrieveUpdateDestroyAPIView):
@@ -374,7 +552,7 @@ class RetrieveUpdatedDestroyAvatarAPIView(generics.RetrieveUpdateDestroyAPIView)
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        avatar = Avatar.objects.get(
+        avatar = Avatar.objects.select_related("user").get(
             user=self.request.user,
             uid=self.kwargs["uid"],
             status__in=[StatusChoices.ACTIVE, StatusChoices.INACTIVE],
@@ -385,20 +563,124 @@ class RetrieveUpdatedDestroyAvatarAPIView(generics.RetrieveUpdateDestroyAPIView)
     # def get(self, request, *args, **kwargs):
     #     return super().get(request, *args, **kwargs)
 
+    def perform_update(self, serializer):
+        if "video" not in serializer.validated_data:
+            serializer.save()
+            return
+        # Derivatives of the old video are left to the retention sweep.
+        avatar = serializer.save(poster="", faststart_video="")
+        SynthesisJob.objects.enqueue_avatar_processing(avatar)
+
     def perform_destroy(self, instance):
         instance.status = StatusChoices.REMOVED
         instance.save()
 
 
+class CreateAvatarUploadAPIView(generics.CreateAPIView):
+    """
+    Start a chunked avatar video upload. Send the bytes with PATCH to
+    ``avatar/uploads/<uid>`` and create the avatar with POST to
+    ``avatar/uploads/<uid>/finalize``.
+    """
+
+    serializer_class = AvatarUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_create(self, serializer):
+        start_upload(serializer.save(user=self.request.user))
+
+
+class AvatarUploadMixin:
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self):
+        try:
+            return AvatarUpload.objects.get(
+                uid=self.kwargs["uid"],
+                user=self.request.user,
+                state=UploadStateChoices.UPLOADING,
+            )
+        except AvatarUpload.DoesNotExist:
+            raise NotFound("No upload in progress with this uid.")
+
+    def offset_response(self, data, offset, status=status.HTTP_200_OK):
+        """A response carrying the stored offset in ``Upload-Offset``, as in the request."""
+        response = Response(data, status=status)
+        response["Upload-Offset"] = str(offset)
+        return response
+
+    def conflict_response(self, conflict):
+        return self.offset_response(
+            {"error": str(conflict), "offset": conflict.offset},
+            conflict.offset,
+            status=status.HTTP_409_CONFLICT,
+        )
+
+
+class AvatarUploadAPIView(AvatarUploadMixin, APIView):
+    """
+    GET reports how many bytes have been stored, which is where an interrupted
+    upload resumes. PATCH appends the raw request body at ``Upload-Offset``,
+    verified against an optional hex ``Upload-Checksum`` (SHA-256 of the chunk).
+    DELETE abandons the upload.
+    """
+
+    def get(self, request, uid):
+        upload = self.get_upload()
+        return self.offset_response(AvatarUploadSerializer(upload).data, upload.offset)
+
+    def patch(self, request, uid):
+        upload = self.get_upload()
+        try:
+            offset = int(request.headers["Upload-Offset"])
+            length = int(request.headers["Content-Length"])
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "Integer Upload-Offset and Content-Length headers are required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            # Read the socket directly; request.data would buffer the whole body.
+            offset = append_chunk(
+                upload,
+                request.stream,
+                offset,
+                length,
+                request.headers.get("Upload-Checksum", ""),
+            )
+        except UploadConflict as e:
+            return self.conflict_response(e)
+        return self.offset_response({"offset": offset, "size": upload.size}, offset)
+
+    def delete(self, request, uid):
+        discard_upload(self.get_upload())
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class FinalizeAvatarUploadAPIView(AvatarUploadMixin, APIView):
+    def post(self, request, uid):
+        upload = self.get_upload()
+        serializer = AvatarSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            avatar = finalize_upload(upload, serializer)
+        except UploadConflict as e:
+            return self.conflict_response(e)
+        return Response(AvatarSerializer(avatar).data, status=status.HTTP_201_CREATED)
+
+
 class ListCreateChatHistorySerializer(generics.ListCreateAPIView):
     # queryset = ChatHistory.objects.IS_ACTIVE()
     serializer_class = ChatHistorySerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
         return (
             ChatHistory.objects.IS_ACTIVE()
             .filter(user=self.request.user)
+            .select_related("user")
             .order_by("id")
         )
 
@@ -416,26 +698,27 @@ class RetrieveUpdatedDestroyChatHistoryAPIView(generics.RetrieveUpdateDestroyAPI
     # def get(self, request, *args, **kwargs):
     #     return super().get(request, *args, **kwargs)
 
+    def get_queryset(self):
+        return ChatHistory.objects.filter(
+            status__in=[StatusChoices.ACTIVE, StatusChoices.INACTIVE],
+            user=self.request.user,
+        )
+
     def retrieve(self, request, *args, **kwargs):
         # chat_history = self.get_object()
-        chat_history = ChatHistory.objects.IS_ACTIVE().get(
-            uid=self.kwargs["uid"], user=self.request.user
+        chat_history = (
+            ChatHistory.objects.IS_ACTIVE()
+            .select_related("user")
+            .get(uid=self.kwargs["uid"], user=self.request.user)
         )
 
         chat_dict = []
         audio_dict = []
 
-        chats = GeneratedAudio.objects.filter(
-            conversation_id=chat_history.conversation_id,
-            status=StatusChoices.ACTIVE,
-            user=self.request.user,
-        )
-
-        for chat in chats:
-            chat_dict.append({chat.sender_type.lower(): chat.text})
-            audio_dict.append(
-                {chat.sender_type.lower(): chat.audio.url.split("/media/")[1]}
-            )
+        for entry in chat_history.chat:
+            sender = entry["sender_type"].lower()
+            chat_dict.append({sender: entry["text"]})
+            audio_dict.append({sender: entry["audio"]})
 
         return Response(
             {
@@ -452,8 +735,11 @@ class RetrieveUpdatedDestroyChatHistoryAPIView(generics.RetrieveUpdateDestroyAPI
         instance.status = StatusChoices.REMOVED
         instance.save()
 
-        GeneratedAudio.objects.filter(conversation_id=instance.conversation_id).update(
-            status=StatusChoices.REMOVED
+        Conversation.objects.remove_turns(
+            GeneratedAudio.objects.filter(
+                dialogue__conversation_id=instance.conversation_id,
+                dialogue__user=instance.user,
+            )
         )
 
 
@@ -469,13 +755,13 @@ class ReplayDialogeAPIView(APIView):
             )
 
         # Fetch all chats and audios for this conversation
-        generated_audios = GeneratedAudio.objects.filter(
-            conversation_id=conversation_id,
-            status=StatusChoices.ACTIVE,
-            user=self.request.user,
-        )
+        audio_accept = request.headers.get(AUDIO_ACCEPT_HEADER)
+        turns = conversation_turns(conversation_id, self.request.user)
+        if audio_accept:
+            turns = turns.prefetch_related("variants")
+        generated_audios = list(turns)
 
-        if not generated_audios.exists():
+        if not generated_audios:
             return Response(
                 {"error": "No data found for this conversation id or User."},
                 status=status.HTTP_404_NOT_FOUND,
@@ -486,11 +772,10 @@ class ReplayDialogeAPIView(APIView):
 
         for item in generated_audios:
             chat_list.append({item.sender_type.lower(): item.text})
-            audio_list.append(
-                {item.sender_type.lower(): item.audio.url.split("/media/")[1]}
-            )
+            audio = pick_audio(item, audio_accept) if audio_accept else item.audio
+            audio_list.append({item.sender_type.lower(): audio.name})
 
-        return Response(
+        response = Response(
             {
                 "conversation_id": conversation_id,
                 "chat_list": chat_list,
@@ -498,10 +783,45 @@ class ReplayDialogeAPIView(APIView):
             },
             status=status.HTTP_200_OK,
         )
+        patch_vary_headers(response, [AUDIO_ACCEPT_HEADER])
+        return response
+
+
+class StitchedReplayDialogueAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        conversation_id = request.data.get("conversation_id")
+        if not conversation_id:
+            return Response(
+                {"error": "conversation_id is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        turns = list(conversation_turns(conversation_id, self.request.user))
+        if not turns:
+            return Response(
+                {"error": "No data found for this conversation id or User."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        try:
+            manifest = stitch_conversation_audio(turns)
+        except ReplayStitchError as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+
+        return Response(
+            {"conversation_id": conversation_id, **manifest},
+            status=status.HTTP_200_OK,
+        )
 
 
 class AnalyzeTextView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = "analyze"
+
+    def estimate_throttle_cost(self, request):
+        return analyze_cost(request.data)
 
     def post(self, request):
         text = request.data.get("text")
@@ -509,12 +829,6 @@ class AnalyzeTextView(APIView):
             return Response(
                 {"error": "text is required."}, status=status.HTTP_400_BAD_REQUEST
             )
-        # prompt = f"Analyze the following conversation and give a short summary or insight in 4-5 sentences:\n\nText: {text}"
-        prompt = (
-            f"Analyze the emotional tone and mood of the following text or conversation. "
-            f"Describe how the speaker(s) might be feeling, and provide a short summary of the overall emotional context "
-            f"in 2-3 sentences:\n\nText: {text}"
-        )
         try:
             # model = genai.GenerativeModel("gemini-2.0-flash")
             # response = model.generate_content(prompt)
@@ -528,19 +842,8 @@ class AnalyzeTextView(APIView):
             #         summary = clean_text(analysis)
             #         return Response({"summary": summary}, status=status.HTTP_200_OK)
 
-            response = client.chat.completions.create(
-                model="gpt-4o",  # or "gpt-4" if needed
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that summarizes content.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-            )
-            analysis = response.choices[0].message.content.strip()
-            if analysis:
-                summary = clean_text(analysis)
+            summary = analyze_text(text)
+            if summary:
                 return Response({"summary": summary}, status=status.HTTP_200_OK)
 
             return Response(
@@ -557,24 +860,135 @@ class AnalyzeTextView(APIView):
             )
 
 
+async def aauthenticate(request):
+    try:
+        result = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def parse_request_data(request):
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError:
+            return None
+    return request.POST.dict()
+
+
+async def aprepare_request(request, scope, estimate_cost):
+    """
+    Authenticate, parse and charge an async API request the way DRF does for the
+    sync views. Returns ``(user, data, None)``, or ``(None, None, response)`` when
+    the request is rejected.
+    """
+    user = await aauthenticate(request)
+    if user is None:
+        return None, None, JsonResponse(
+            {"detail": "Authentication credentials were not provided."},
+            status=status.HTTP_401_UNAUTHORIZED,
+        )
+
+    data = parse_request_data(request)
+    if data is None:
+        return None, None, JsonResponse(
+            {"detail": "JSON parse error."}, status=status.HTTP_400_BAD_REQUEST
+        )
+
+    allowed, retry_after = await sync_to_async(charge_request)(
+        request, user, scope, estimate_cost(data)
+    )
+    if not allowed:
+        return None, None, throttled_response(retry_after)
+    return user, data, None
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncGenerateAudioView(View):
+    """Event-loop twin of ``GenerateAudioAPIView`` for plain (non-streamed) turns."""
+
+    async def post(self, request):
+        user, data, rejected = await aprepare_request(request, "speak", speak_cost)
+        if rejected is not None:
+            return rejected
+
+        serializer = GeneratedAudioSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            payload, _generated = await arun_speak(
+                user, speak_params(serializer.validated_data, data)
+            )
+        except ReplyGenerationError as e:
+            return JsonResponse(
+                {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        except serializers.ValidationError as e:
+            return JsonResponse(
+                e.detail, safe=False, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return JsonResponse(payload, status=status.HTTP_201_CREATED)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncAnalyzeTextView(View):
+    async def post(self, request):
+        user, data, rejected = await aprepare_request(
+            request, "analyze", analyze_cost
+        )
+        if rejected is not None:
+            return rejected
+
+        text = data.get("text")
+        if not text:
+            return JsonResponse(
+                {"error": "text is required."}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            summary = await aanalyze_text(text)
+            if summary:
+                return JsonResponse({"summary": summary}, status=status.HTTP_200_OK)
+
+            return JsonResponse(
+                {
+                    "error": "Unable to generate a valid emotion analysis. Please try again."
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+        except Exception:
+            return JsonResponse(
+                {"error": "Failed to analyze the text."},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+
 class ListCreateMoodAPIView(generics.ListCreateAPIView):
     # queryset = Mood.objects.IS_ACTIVE()
     serializer_class = MoodSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
         return (
             Mood.objects.IS_ACTIVE()
             .filter(Q(user=self.request.user) | Q(user__isnull=True))
+            .select_related("user")
             .order_by("id")
         )
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-    # @method_decorator(cache_page(60 * 15, key_prefix="mood_list_cache"))
-    # def list(self, request, *args, **kwargs):
-    #     return super().list(request, *args, **kwargs)
+    def list(self, request, *args, **kwargs):
+        def build():
+            return super(ListCreateMoodAPIView, self).list(request, *args, **kwargs).data
+
+        return Response(cached_list("mood", request, build))
 
 
 class RetrieveUpdateDestroyMoodAPIView(generics.RetrieveUpdateDestroyAPIView):
@@ -583,7 +997,7 @@ class RetrieveUpdateDestroyMoodAPIView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        return Mood.objects.get(
+        return Mood.objects.select_related("user").get(
             user=self.request.user,
             uid=self.kwargs["uid"],
             status__in=[StatusChoices.ACTIVE, StatusChoices.INACTIVE],
@@ -592,3 +1006,34 @@ class RetrieveUpdateDestroyMoodAPIView(generics.RetrieveUpdateDestroyAPIView):
     # @method_decorator(cache_page(60 * 15, key_prefix="mood_list_cache"))
     # def get(self, request, *args, **kwargs):
     #     return super().get(request, *args, **kwargs)
+
+
+class ProviderHealthAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(breaker_snapshots(), status=status.HTTP_200_OK)
+
+
+class LookupCacheStatsAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(
+            {"pid": os.getpid(), "lookups": lookup_cache_stats()},
+            status=status.HTTP_200_OK,
+        )
+
+
+class ProviderStatsAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        tts_cache = get_tts_cache()
+        return Response(
+            {
+                "pools": pool_stats(),
+                "tts_cache": tts_cache.stats() if tts_cache is not None else None,
+            },
+            status=status.HTTP_200_OK,
+        )
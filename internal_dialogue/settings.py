@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 import os
 
+from corsheaders.defaults import default_headers
 from datetime import timedelta
 from dotenv import load_dotenv
 from pathlib import Path
@@ -62,6 +63,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "api.throttling.ThrottleHeadersMiddleware",
 ]
 
 ROOT_URLCONF = "internal_dialogue.urls"
@@ -149,18 +151,127 @@ AUTH_USER_MODEL = "api.User"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Media goes through Django's storage API. The default is the local
+# filesystem; point MEDIA_STORAGE_BACKEND at a shared backend (for example
+# "storages.backends.s3.S3Storage" from django-storages, configured through
+# its own settings) when several app nodes serve the same media.
+STORAGES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "MEDIA_STORAGE_BACKEND", "django.core.files.storage.FileSystemStorage"
+        ),
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+# Synthesis writes here before publishing to media storage; keep it on the
+# same filesystem as MEDIA_ROOT so publishing is a rename.
+MEDIA_SCRATCH_DIR = os.getenv("MEDIA_SCRATCH_DIR", os.path.join(BASE_DIR, "tmp", "audio"))
+
+# sweep_media deletes files of rows soft-deleted longer than this many seconds
+# ago, and unreferenced files older than it. Stitched replays are regenerated
+# on demand, so they are kept for a shorter, separate period.
+MEDIA_RETENTION_GRACE = int(os.getenv("MEDIA_RETENTION_GRACE", 7 * 86400))
+MEDIA_REPLAY_RETENTION = int(os.getenv("MEDIA_REPLAY_RETENTION", 86400))
+
+# Media is served by api.media.serve_media in every environment. Set
+# MEDIA_ACCEL_REDIRECT_PREFIX (e.g. "/protected-media/", an nginx internal
+# location aliased to MEDIA_ROOT) to hand transfers to the proxy after the
+# permission check; use MEDIA_ACCEL_HEADER=X-Sendfile for Apache/lighttpd.
+# Only set MEDIA_REQUIRE_AUTH=False for deployments with no private media.
+MEDIA_REQUIRE_AUTH = os.getenv("MEDIA_REQUIRE_AUTH", "True") == "True"
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv("MEDIA_ACCEL_REDIRECT_PREFIX", "")
+MEDIA_ACCEL_HEADER = os.getenv("MEDIA_ACCEL_HEADER", "X-Accel-Redirect")
+MEDIA_CACHE_CONTROL = os.getenv("MEDIA_CACHE_CONTROL", "private, max-age=86400")
+
+# Content-addressed cache of ElevenLabs syntheses, shared by all workers on a node.
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "True") == "True"
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(BASE_DIR, "tts_cache"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", 2 * 1024**3))  # 2GB
+
+# Pooled keep-alive clients for upstream TTS and LLM providers (see api/providers.py).
+PROVIDER_CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", 5))
+PROVIDER_READ_TIMEOUT = float(os.getenv("PROVIDER_READ_TIMEOUT", 60))
+PROVIDER_POOL_MAXSIZE = int(os.getenv("PROVIDER_POOL_MAXSIZE", 20))
+PROVIDER_KEEPALIVE_EXPIRY = float(os.getenv("PROVIDER_KEEPALIVE_EXPIRY", 30))
+
+# ElevenLabs circuit breaker and optional hedging to gTTS (see api/health.py).
+TTS_BREAKER_FAILURE_THRESHOLD = int(os.getenv("TTS_BREAKER_FAILURE_THRESHOLD", 5))
+TTS_BREAKER_LATENCY_THRESHOLD = float(os.getenv("TTS_BREAKER_LATENCY_THRESHOLD", 10))
+TTS_BREAKER_RESET_TIMEOUT = float(os.getenv("TTS_BREAKER_RESET_TIMEOUT", 30))
+TTS_HEDGE_AFTER = float(os.getenv("TTS_HEDGE_AFTER", 0))  # seconds, 0 disables hedging
+
+# Database-backed background job queue (see api/jobs.py and run_job_workers).
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 4))
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", 300))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_BACKOFF = int(os.getenv("JOB_RETRY_BACKOFF", 10))
+
+# Compressed renditions of every turn, transcoded by TRANSCODE jobs after the
+# turn is saved (see api/transcoding.py). Clients list the formats they can
+# play in an X-Audio-Accept header and get the smallest one.
+AUDIO_VARIANTS_ENABLED = os.getenv("AUDIO_VARIANTS_ENABLED", "True") == "True"
+AUDIO_VARIANTS = {
+    "mp3-48k": {"format": "mp3", "bitrate": 48},
+    "opus-24k": {"format": "opus", "bitrate": 24},
+}
+AUDIO_TRANSCODER = os.getenv("AUDIO_TRANSCODER", "api.transcoding.FFmpegTranscoder")
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFMPEG_TIMEOUT = int(os.getenv("FFMPEG_TIMEOUT", 120))
+
+# New or replaced avatar videos get a poster frame and a fast-start MP4 from a
+# PROCESS_AVATAR job (see api/avatar_processing.py).
+AVATAR_PROCESSING_ENABLED = os.getenv("AVATAR_PROCESSING_ENABLED", "True") == "True"
+AVATAR_PROCESSOR = os.getenv(
+    "AVATAR_PROCESSOR", "api.avatar_processing.FFmpegAvatarProcessor"
+)
+
+# Batch dialogue synthesis (/api/speak/batch).
+BATCH_SPEAK_MAX_TURNS = int(os.getenv("BATCH_SPEAK_MAX_TURNS", 100))
+BATCH_SPEAK_CONCURRENCY = int(os.getenv("BATCH_SPEAK_CONCURRENCY", 4))
+BATCH_SPEAK_MAX_CONCURRENCY = int(os.getenv("BATCH_SPEAK_MAX_CONCURRENCY", 8))
+
+# Admin changelists trust the planner's row estimate above this many rows
+# instead of running an exact COUNT(*).
+ADMIN_EXACT_COUNT_THRESHOLD = int(os.getenv("ADMIN_EXACT_COUNT_THRESHOLD", 10000))
+
+# List endpoints use keyset pagination; clients may ask for up to
+# API_MAX_PAGE_SIZE rows with ?page_size=.
+API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", 50))
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", 200))
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ],
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "DEFAULT_THROTTLE_CLASSES": [
-        "rest_framework.throttling.AnonRateThrottle",
-        "rest_framework.throttling.UserRateThrottle",
+        "api.throttling.CostBudgetThrottle",
     ],
-    "DEFAULT_THROTTLE_RATES": {"anon": "100/minute", "user": "1000/minute"},
 }
 
+# Requests are charged against per-endpoint budgets of cost units (see
+# api/throttling.py). Speak and analyze cost one unit per character sent to
+# TTS, plus THROTTLE_REPLY_COST when an LLM reply is generated; everything
+# else costs one unit. Anonymous clients share the "anon" budget per address
+# (100/min, the rate AnonRateThrottle enforced before). Login, registration
+# and token endpoints draw on a separate per-address "auth" budget, so
+# anonymous browsing cannot lock users behind a shared NAT out of signing in.
+# Budgets live in the THROTTLE_CACHE alias, which must be shared by all
+# workers (set REDIS_URL) for the limits to hold across processes;
+# `manage.py check --deploy` fails (api.E001) on a per-process cache.
+THROTTLE_CACHE = os.getenv("THROTTLE_CACHE", "default")
+THROTTLE_BUDGETS = {
+    "default": os.getenv("THROTTLE_DEFAULT_BUDGET", "1000/min"),
+    "anon": os.getenv("THROTTLE_ANON_BUDGET", "100/min"),
+    "auth": os.getenv("THROTTLE_AUTH_BUDGET", "1000/min"),
+    "speak": os.getenv("THROTTLE_SPEAK_BUDGET", "20000/min"),
+    "speak_batch": os.getenv("THROTTLE_SPEAK_BATCH_BUDGET", "100000/hour"),
+    "analyze": os.getenv("THROTTLE_ANALYZE_BUDGET", "20000/min"),
+}
+THROTTLE_REPLY_COST = int(os.getenv("THROTTLE_REPLY_COST", 600))
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=5),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=20),
@@ -169,8 +280,47 @@ SIMPLE_JWT = {
 CORS_ALLOW_CREDENTIALS = True
 
 CORS_ALLOW_ALL_ORIGINS = True
-DATA_UPLOAD_MAX_MEMORY_SIZE = 10737418240   #10GB
-FILE_UPLOAD_MAX_MEMORY_SIZE = 10737418240   #10GB
+# Request headers cross-origin clients may send on top of the defaults.
+# X-Audio-Accept picks the audio rendition (see api.transcoding); the
+# Upload-* headers drive chunked avatar uploads (see api.uploads).
+CORS_ALLOW_HEADERS = (
+    *default_headers,
+    "x-audio-accept",
+    "upload-offset",
+    "upload-checksum",
+)
+# Response headers cross-origin clients may read. Streamed /api/speak
+# responses describe the turn in headers because the body is the audio;
+# chunked uploads report their stored offset in Upload-Offset, and every
+# throttled endpoint reports its budget (see api/throttling.py).
+CORS_EXPOSE_HEADERS = [
+    "X-Audio",
+    "X-Audio-Uid",
+    "X-Conversation-Id",
+    "X-Reply",
+    "X-User-Audio",
+    "Upload-Offset",
+    "X-RateLimit-Scope",
+    "X-RateLimit-Limit",
+    "X-RateLimit-Remaining",
+    "X-RateLimit-Cost",
+    "Retry-After",
+]
+# Request bodies are never buffered whole in memory: larger multipart files are
+# spooled to disk, and big avatar videos go through the chunked upload API.
+DATA_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv("DATA_UPLOAD_MAX_MEMORY_SIZE", 2621440))
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv("FILE_UPLOAD_MAX_MEMORY_SIZE", 2621440))
+
+# Chunked avatar video uploads (/api/avatar/uploads). Chunks are streamed into
+# AVATAR_UPLOAD_DIR; only the finished file is published to media storage.
+# Unfinished uploads idle for AVATAR_UPLOAD_EXPIRY seconds are removed by
+# sweep_media.
+AVATAR_UPLOAD_DIR = os.getenv(
+    "AVATAR_UPLOAD_DIR", os.path.join(BASE_DIR, "tmp", "uploads")
+)
+AVATAR_UPLOAD_MAX_SIZE = int(os.getenv("AVATAR_UPLOAD_MAX_SIZE", 10 * 1024**3))  # 10GB
+AVATAR_UPLOAD_MAX_CHUNK = int(os.getenv("AVATAR_UPLOAD_MAX_CHUNK", 16 * 1024**2))
+AVATAR_UPLOAD_EXPIRY = int(os.getenv("AVATAR_UPLOAD_EXPIRY", 86400))
 # CORS_ALLOWED_ORIGINS = [
 #     "http://192.168.10.12:3000",
 #     "http://192.168.10.38:3000",
@@ -185,15 +335,28 @@ FILE_UPLOAD_MAX_MEMORY_SIZE = 10737418240   #10GB
 # }
 
 
-# CACHES = {
-#     "default": {
-#         "BACKEND": "django_redis.cache.RedisCache",
-#         "LOCATION": "redis://127.0.0.1:6379/1",  # Local Redis, database 1
-#         "OPTIONS": {
-#             "CLIENT_CLASS": "django_redis.client.DefaultClient",
-#         },
-#     }
-# }
+# Shared Redis when REDIS_URL is set, otherwise a per-process local-memory cache.
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            },
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "internal-dialogue",
+        }
+    }
+
+# Avatar/Mood lookups are invalidated on save/delete; the timeout only bounds
+# staleness across processes that do not share a cache.
+LOOKUP_CACHE_TIMEOUT = int(os.getenv("LOOKUP_CACHE_TIMEOUT", 300))
 
 if not DEBUG:
     REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"] = (